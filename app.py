@@ -2,6 +2,9 @@
 # PERUBAHAN: Menambahkan impor model PolaMakan dan gcs_helpers (melalui rute gerakan)
 # PERUBAHAN BARU: Menambahkan impor mhodel Badge, UserBadge dan blueprint gamifikasi.
 # PERUBAHAN FIREBASE: Menambahkan inisialisasi Firebase Admin SDK dan konfigurasi client-side.
+# PERUBAHAN: Mendaftarkan perintah CLI dari commands.py (misal: flask rebuild-patient-stats).
+# PERUBAHAN PERFORMA: Registry client storage ber-pool (extensions.storage_clients) diinisialisasi di create_app.
+# PERUBAHAN BARU: STORAGE_BACKEND memilih backend storage media (cloud/lokal/memori) dan blueprint /media untuk backend lokal.
 
 import os
 from flask import Flask
@@ -12,7 +15,7 @@ import json # Diperlukan untuk mengurai JSON kredensial Firebase
 import firebase_admin
 from firebase_admin import credentials, auth
 
-from extensions import db, migrate, jwt, bcrypt, cors
+from extensions import db, migrate, jwt, bcrypt, cors, storage_clients
 
 load_dotenv()
 
@@ -43,7 +46,22 @@ def create_app(test_config=None):
             JWT_SECRET_KEY=os.getenv('JWT_SECRET_KEY'),
             SQLALCHEMY_TRACK_MODIFICATIONS=False,
             JSON_SORT_KEYS=False,
-            JWT_DECODE_JSON=True
+            JWT_DECODE_JSON=True,
+            LEADERBOARD_REFRESH_SECONDS=int(os.getenv('LEADERBOARD_REFRESH_SECONDS', 60)),
+            IDEMPOTENCY_KEY_TTL_HOURS=int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', 24)),
+            IDEMPOTENCY_LEASE_SECONDS=int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', 300)),
+            MEDIA_IO_MAX_WORKERS=int(os.getenv('MEDIA_IO_MAX_WORKERS', 8)),
+            MEDIA_UPLOAD_CHUNK_BYTES=int(os.getenv('MEDIA_UPLOAD_CHUNK_BYTES', 4 * 1024 * 1024)),
+            MEDIA_UPLOAD_MAX_BUFFER_BYTES=int(os.getenv('MEDIA_UPLOAD_MAX_BUFFER_BYTES', 32 * 1024 * 1024)),
+            STORAGE_BACKEND=os.getenv('STORAGE_BACKEND', 'cloud'), # 'cloud' (Azure/GCS), 'lokal' (disk), atau 'memori'
+            DIRECT_UPLOAD_TTL_MINUTES=int(os.getenv('DIRECT_UPLOAD_TTL_MINUTES', 15)),
+            MEDIA_LOCAL_DIR=os.getenv('MEDIA_LOCAL_DIR'),
+            MEDIA_BASE_URL=os.getenv('MEDIA_BASE_URL'), # URL dasar GET /media untuk backend lokal/memori (opsional)
+            STORAGE_POOL_MAXSIZE=int(os.getenv('STORAGE_POOL_MAXSIZE', 16)),
+            STORAGE_CONNECT_TIMEOUT=float(os.getenv('STORAGE_CONNECT_TIMEOUT', 10)),
+            STORAGE_READ_TIMEOUT=float(os.getenv('STORAGE_READ_TIMEOUT', 120)),
+            STORAGE_RETRY_TOTAL=int(os.getenv('STORAGE_RETRY_TOTAL', 3)),
+            STORAGE_RETRY_BACKOFF=float(os.getenv('STORAGE_RETRY_BACKOFF', 1))
         )
     else:
         app.config.from_mapping(test_config)
@@ -56,6 +74,7 @@ def create_app(test_config=None):
     jwt.init_app(app)
     bcrypt.init_app(app)
     cors.init_app(app, resources={r"/*": {"origins": "*"}})
+    storage_clients.init_app(app)
 
     with app.app_context():
         # --- Konfigurasi Firebase Admin SDK di dalam app context ---
@@ -89,7 +108,8 @@ def create_app(test_config=None):
         # Tambahkan PolaMakan, Badge, UserBadge ke daftar impor model
         from models import AppUser, PatientProfile, Gerakan, ProgramRehabilitasi, \
                            ProgramGerakanDetail, LaporanRehabilitasi, LaporanGerakanHasil, \
-                           PolaMakan, Badge, UserBadge 
+                           PolaMakan, Badge, UserBadge, PatientSessionStats, PointsLedger, IdempotencyKey, OutboxEvent, \
+                           ProgramTemplate, ProgramTemplateDetail, ProgramSeries, PendingMedia, PendingDeletion, MediaBlob
 
         from routes.auth_routes import auth_bp
         from routes.patient_routes import patient_bp
@@ -99,6 +119,8 @@ def create_app(test_config=None):
         from routes.monitoring_routes import monitoring_bp
         from routes.terapis_routes import terapis_bp
         from routes.gamification_routes import gamification_bp
+        from routes.upload_routes import upload_bp
+        from routes.media_routes import media_bp
 
         app.register_blueprint(auth_bp, url_prefix='/auth')
         app.register_blueprint(patient_bp, url_prefix='/api/patient')
@@ -108,6 +130,20 @@ def create_app(test_config=None):
         app.register_blueprint(monitoring_bp, url_prefix='/api/monitoring')
         app.register_blueprint(terapis_bp, url_prefix='/api/terapis')
         app.register_blueprint(gamification_bp, url_prefix='/api/gamification')
+        app.register_blueprint(upload_bp, url_prefix='/api/uploads')
+        app.register_blueprint(media_bp, url_prefix='/media')
+
+        from commands import register_commands
+        register_commands(app)
+
+        # Muat indeks leaderboard in-memory saat worker dimulai.
+        # Gagal di sini (misal: tabel belum dimigrasi) tidak fatal; indeks akan dimuat saat pertama dipakai.
+        from utils.leaderboard import leaderboard
+        try:
+            leaderboard.warm_up()
+        except Exception as e:
+            db.session.rollback()
+            print(f"WARNING: Gagal memuat indeks leaderboard saat startup: {e}")
 
         @app.route('/')
         def hello():
@@ -0,0 +1,423 @@
+# BE-RESTRO/commands.py
+# Perintah CLI (dijalankan dengan `flask <nama-perintah>`) untuk pemeliharaan data.
+# Didaftarkan ke aplikasi melalui register_commands(app) di create_app (app.py).
+
+import click
+from flask.cli import with_appcontext
+from extensions import db
+
+
+@click.command('rebuild-patient-stats')
+@click.option('--pasien-id', type=int, multiple=True, help='ID pasien yang dibangun ulang (bisa diulang). Default: semua pasien.')
+@with_appcontext
+def rebuild_patient_stats_command(pasien_id):
+    """Membangun ulang tabel rollup patient_session_stats dari riwayat laporan."""
+    from models import PatientSessionStats
+
+    try:
+        jumlah = PatientSessionStats.rebuild(list(pasien_id) if pasien_id else None)
+        db.session.commit()
+        click.echo(f"Rollup statistik sesi dibangun ulang untuk {jumlah} pasien.")
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Gagal membangun ulang rollup statistik sesi: {str(e)}")
+
+
+@click.command('backfill-highest-badge')
+@with_appcontext
+def backfill_highest_badge_command():
+    """Mengisi ulang AppUser.highest_badge_id untuk semua user dari tabel user_badges."""
+    from models import AppUser
+
+    try:
+        jumlah = AppUser.refresh_highest_badge()
+        db.session.commit()
+        click.echo(f"highest_badge_id diperbarui untuk {jumlah} user.")
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Gagal mengisi ulang highest_badge_id: {str(e)}")
+
+
+@click.command('award-eligible-badges')
+@with_appcontext
+def award_eligible_badges_command():
+    """
+    Memberikan setiap badge ke semua pasien yang poinnya sudah memenuhi ambang batas.
+    Jalankan sekali untuk data lama agar pemberian badge berbasis bisect saat submit laporan tetap akurat.
+    """
+    from models import AppUser, Badge
+
+    try:
+        penerima = set()
+        for badge in Badge.query.order_by(Badge.point_threshold.asc()).all():
+            penerima.update(badge.award_to_eligible_users())
+        AppUser.refresh_highest_badge(penerima)
+        db.session.commit()
+        click.echo(f"Badge diberikan/diperbarui untuk {len(penerima)} pasien.")
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Gagal memberikan badge: {str(e)}")
+
+
+@click.command('compact-points-ledger')
+@click.option('--batch-size', type=int, default=1000, show_default=True, help='Jumlah baris ledger per transaksi.')
+@with_appcontext
+def compact_points_ledger_command(batch_size):
+    """Memadatkan semua baris points_ledger yang belum diterapkan ke AppUser.total_points (jalankan berkala)."""
+    from models import PointsLedger
+
+    total_rows_users = 0
+    try:
+        while True:
+            deltas = PointsLedger.compact(batch_size=batch_size)
+            db.session.commit()
+            if not deltas:
+                break
+            total_rows_users += len(deltas)
+        click.echo(f"Pemadatan points_ledger selesai ({total_rows_users} pembaruan total_points).")
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Gagal memadatkan points_ledger: {str(e)}")
+
+
+@click.command('backfill-points-ledger')
+@with_appcontext
+def backfill_points_ledger_command():
+    """
+    Mengisi points_ledger dari riwayat laporan (points_earned) yang belum tercatat, ditambah baris koreksi
+    agar jumlah ledger setiap user sama dengan total_points saat ini. Semua baris ditandai sudah diterapkan.
+    """
+    from datetime import datetime
+    from models import AppUser, LaporanRehabilitasi, PointsLedger, PointSource
+    from sqlalchemy import func
+
+    try:
+        sudah_tercatat = db.session.query(PointsLedger.id).filter(PointsLedger.laporan_id == LaporanRehabilitasi.id).exists()
+        laporan_rows = db.session.query(LaporanRehabilitasi.id, LaporanRehabilitasi.pasien_id,
+                                        LaporanRehabilitasi.points_earned, LaporanRehabilitasi.created_at,
+                                        LaporanRehabilitasi.tanggal_laporan)\
+            .filter(~sudah_tercatat).all()
+        # bulk_insert_mappings hanya menerima nilai Python (bukan func.now()) untuk created_at yang NULL
+        sekarang = datetime.utcnow()
+        db.session.bulk_insert_mappings(PointsLedger, [{
+            "user_id": pasien_id, "points": points or 0, "source": PointSource.LAPORAN, "laporan_id": laporan_id,
+            "applied": True,
+            "created_at": created_at or (datetime.combine(tanggal_laporan, datetime.min.time()) if tanggal_laporan else sekarang)
+        } for laporan_id, pasien_id, points, created_at, tanggal_laporan in laporan_rows])
+
+        ledger_sum = dict(db.session.query(PointsLedger.user_id, func.sum(PointsLedger.points)).group_by(PointsLedger.user_id).all())
+        koreksi = []
+        # Baris koreksi diberi tanggal pembuatan akun agar tidak terhitung di leaderboard periode berjalan
+        for user_id, total_points, created_at in db.session.query(AppUser.id, AppUser.total_points, AppUser.created_at)\
+                .filter(AppUser.role == 'pasien').all():
+            selisih = (total_points or 0) - (ledger_sum.get(user_id) or 0)
+            if selisih:
+                koreksi.append({"user_id": user_id, "points": selisih, "source": PointSource.KOREKSI,
+                                "keterangan": "Saldo awal dari total_points sebelum ledger", "applied": True,
+                                "created_at": created_at or sekarang})
+        db.session.bulk_insert_mappings(PointsLedger, koreksi)
+        db.session.commit()
+        click.echo(f"{len(laporan_rows)} baris laporan dan {len(koreksi)} baris koreksi ditambahkan ke points_ledger.")
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Gagal mengisi points_ledger: {str(e)}")
+
+
+@click.command('purge-idempotency-keys')
+@with_appcontext
+def purge_idempotency_keys_command():
+    """Menghapus baris idempotency_keys yang sudah kedaluwarsa (jalankan berkala)."""
+    from models import IdempotencyKey
+
+    try:
+        jumlah = IdempotencyKey.hapus_kedaluwarsa()
+        db.session.commit()
+        click.echo(f"{jumlah} idempotency key kedaluwarsa dihapus.")
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Gagal menghapus idempotency key: {str(e)}")
+
+
+@click.command('purge-pending-media')
+@with_appcontext
+def purge_pending_media_command():
+    """
+    Menghapus tiket unggah langsung (pending_media) yang kedaluwarsa. File yang sudah diunggah tetapi
+    tidak pernah difinalisasi dimasukkan ke antrean penghapusan storage (jalankan berkala).
+    """
+    from models import PendingMedia, PendingDeletion
+    from utils.direct_upload import TARGET_UNGGAH
+
+    dihapus = 0
+    try:
+        for pending in PendingMedia.kedaluwarsa():
+            if not pending.finalized_at:
+                # File dihapus worker dari antrean penghapusan, dalam transaksi yang sama dengan tiketnya
+                PendingDeletion.catat(pending.blob_name, TARGET_UNGGAH[pending.target].jenis)
+            db.session.delete(pending)
+            dihapus += 1
+        db.session.commit()
+        click.echo(f"{dihapus} tiket unggah kedaluwarsa dihapus.")
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Gagal menghapus tiket unggah: {str(e)}")
+
+
+@click.command('reconcile-storage')
+@click.option('--umur-minimal-jam', type=float, default=24.0, show_default=True,
+              help='Hanya file yang lebih tua dari ini (unggahan yang sedang berjalan tidak ikut).')
+@click.option('--dry-run', is_flag=True, help='Hanya tampilkan file yatim tanpa memasukkannya ke antrean penghapusan.')
+@with_appcontext
+def reconcile_storage_command(umur_minimal_jam, dry_run):
+    """
+    Membandingkan daftar file di storage dengan referensi di database dan memasukkan file yang tidak
+    dirujuk (yatim) ke antrean penghapusan (pending_deletions), yang lalu dihapus oleh `flask worker`.
+    """
+    from datetime import timedelta
+    from models import PendingDeletion
+    from utils.direct_upload import TARGET_UNGGAH
+    from utils.storage_deletion import cari_file_yatim
+
+    prefixes = sorted({(target.jenis, target.folder.rstrip('/') + '/') for target in TARGET_UNGGAH.values()})
+    try:
+        yatim = cari_file_yatim(prefixes, timedelta(hours=umur_minimal_jam))
+        for ref, jenis in yatim:
+            click.echo(f"{'[dry-run] ' if dry_run else ''}yatim: {ref}")
+            if not dry_run:
+                PendingDeletion.catat(ref, jenis)
+        db.session.commit()
+        click.echo(f"{len(yatim)} file yatim ditemukan{'' if dry_run else ' dan dimasukkan ke antrean penghapusan'}.")
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Gagal merekonsiliasi storage: {str(e)}")
+
+
+@click.command('worker')
+@click.option('--batch-size', type=int, default=100, show_default=True, help='Jumlah event per batch.')
+@click.option('--interval', type=float, default=2.0, show_default=True, help='Jeda (detik) saat antrean kosong.')
+@click.option('--metrics-interval', type=float, default=60.0, show_default=True, help='Jeda (detik) antar cetak metrik.')
+@click.option('--once', is_flag=True, help='Proses antrean sampai kosong lalu berhenti.')
+@with_appcontext
+def worker_command(batch_size, interval, metrics_interval, once):
+    """
+    Memproses event outbox (laporan_submitted, badge_awarded, user_registered) dan antrean penghapusan
+    file storage (pending_deletions) di luar request.
+    """
+    import json
+    import time
+    from utils.outbox import proses_batch, metrics
+    from utils.storage_deletion import proses_batch as proses_batch_penghapusan
+
+    def cetak_metrik():
+        for event_type, stat in metrics.snapshot().items():
+            click.echo(f"[worker] {event_type}: {json.dumps(stat)}")
+
+    click.echo("[worker] Memproses outbox_events dan pending_deletions...")
+    terakhir_cetak = time.monotonic()
+    try:
+        while True:
+            try:
+                jumlah = proses_batch(batch_size)
+                jumlah += proses_batch_penghapusan(batch_size)
+            except Exception as e:
+                db.session.rollback()
+                click.echo(f"[worker] Gagal memproses batch: {str(e)}", err=True)
+                jumlah = 0
+                if once:
+                    raise click.ClickException(str(e))
+            if time.monotonic() - terakhir_cetak >= metrics_interval:
+                cetak_metrik()
+                terakhir_cetak = time.monotonic()
+            if jumlah == 0:
+                if once:
+                    break
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    cetak_metrik()
+
+
+@click.command('enqueue-firebase-sync')
+@with_appcontext
+def enqueue_firebase_sync_command():
+    """Mengantrekan event user_registered untuk semua user agar worker membuat user Firebase yang belum ada."""
+    from models import AppUser, OutboxEvent
+    from utils.outbox import EVENT_USER_REGISTERED
+
+    try:
+        users = db.session.query(AppUser.id, AppUser.role, AppUser.nama_lengkap, AppUser.email).all()
+        db.session.bulk_insert_mappings(OutboxEvent, [{
+            "event_type": EVENT_USER_REGISTERED,
+            "payload": {"user_id": user_id, "role": role, "nama_lengkap": nama_lengkap, "email": email}
+        } for user_id, role, nama_lengkap, email in users])
+        db.session.commit()
+        click.echo(f"{len(users)} event user_registered diantrekan.")
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Gagal mengantrekan event: {str(e)}")
+
+
+@click.command('install-gerakan-search')
+@with_appcontext
+def install_gerakan_search_command():
+    """Memasang indeks pencarian gerakan (FTS5/tsvector/pg_trgm) pada database yang sudah ada dan mengisinya ulang."""
+    from utils.gerakan_search import pasang_indeks
+
+    try:
+        with db.engine.begin() as connection:
+            for pesan in pasang_indeks(connection):
+                click.echo(pesan)
+    except Exception as e:
+        raise click.ClickException(f"Gagal memasang indeks pencarian gerakan: {str(e)}")
+
+
+@click.command('benchmark-gerakan-search')
+@click.option('--jumlah', type=int, multiple=True, help='Jumlah gerakan sintetis (bisa diulang). Default: 1000, 10000, 100000.')
+@click.option('--pencarian', type=int, default=100, show_default=True, help='Jumlah kata kunci acak per ukuran.')
+@with_appcontext
+def benchmark_gerakan_search_command(jumlah, pencarian):
+    """
+    Membandingkan ILIKE '%term%' (pindai tabel) dengan indeks FTS5 pada database SQLite in-memory terpisah
+    berisi N gerakan sintetis. Kosakata sebanding dengan N sehingga jumlah hasil per kata relatif tetap;
+    waktu ILIKE tumbuh linear terhadap N, sedangkan pencarian berindeks tidak.
+    """
+    import random
+    import statistics
+    import time
+    from sqlalchemy import create_engine, insert, select
+    from sqlalchemy.pool import StaticPool
+    from models import Gerakan
+    from utils.gerakan_search import terapkan_pencarian, MODE_PENUH, MODE_PREFIX
+
+    rng = random.Random(42)
+    suku_kata = [k + v for k in 'bcdgjklmnprstw' for v in 'aiueo']
+
+    def kata_acak():
+        return ''.join(rng.choice(suku_kata) for _ in range(rng.randint(2, 4)))
+
+    def median_ms(engine, buat_statement, kata_kunci):
+        durasi, hasil = [], []
+        with engine.connect() as connection:
+            for kata in kata_kunci:
+                mulai = time.perf_counter()
+                rows = connection.execute(buat_statement(connection, kata)).all()
+                durasi.append((time.perf_counter() - mulai) * 1000)
+                hasil.append(len(rows))
+        return statistics.median(durasi), statistics.mean(hasil)
+
+    click.echo(f"{'N':>8} | {'ILIKE ms':>9} | {'FTS ms':>7} | {'prefix ms':>9} | {'hasil/kata':>10}")
+    for n in sorted(jumlah or (1000, 10000, 100000)):
+        engine = create_engine('sqlite://', poolclass=StaticPool)
+        Gerakan.__table__.create(engine) # Memicu DDL FTS5 + trigger seperti db.create_all
+        kosakata = list({kata_acak() for _ in range(max(n // 10, 100))})
+        with engine.begin() as connection:
+            for awal in range(0, n, 5000):
+                connection.execute(insert(Gerakan.__table__), [{
+                    "nama_gerakan": ' '.join(rng.choice(kosakata) for _ in range(3)),
+                    "deskripsi": ' '.join(rng.choice(kosakata) for _ in range(8))
+                } for _ in range(awal, min(awal + 5000, n))])
+        kata_kunci = [rng.choice(kosakata) for _ in range(pencarian)]
+
+        ilike_ms, _ = median_ms(engine, lambda c, kata: select(Gerakan.id).where(Gerakan.nama_gerakan.ilike(f"%{kata}%")), kata_kunci)
+        fts_ms, rata_hasil = median_ms(engine, lambda c, kata: terapkan_pencarian(select(Gerakan.id), kata, MODE_PENUH, bind=c), kata_kunci)
+        prefix_ms, _ = median_ms(engine, lambda c, kata: terapkan_pencarian(select(Gerakan.id), kata[:4], MODE_PREFIX, bind=c), kata_kunci)
+        click.echo(f"{n:>8} | {ilike_ms:>9.2f} | {fts_ms:>7.2f} | {prefix_ms:>9.2f} | {rata_hasil:>10.1f}")
+        engine.dispose()
+
+
+@click.command('benchmark-media-upload')
+@click.option('--ukuran-mb', type=int, multiple=True, help='Ukuran file uji dalam MB (bisa diulang). Default: 16, 64, 256.')
+@click.option('--chunk-bytes', type=int, default=None, help='Ukuran chunk streaming. Default: MEDIA_UPLOAD_CHUNK_BYTES.')
+@with_appcontext
+def benchmark_media_upload_command(ukuran_mb, chunk_bytes):
+    """
+    Mengukur puncak RSS unggahan buffer penuh (file.read() + upload_blob, cara lama) dibandingkan
+    streaming per blok (stage_block/commit_block_list) terhadap ukuran file. Storage diganti stand-in
+    lokal yang menulis blok ke direktori sementara; setiap pengukuran berjalan di proses anak tersendiri.
+    """
+    import multiprocessing
+    import os
+    import resource
+    import shutil
+    import tempfile
+    import time
+    from utils.streaming_upload import stage_blok_azure, ukuran_chunk
+
+    class BlobClientLokal:
+        """Stand-in BlobClient: blok ditulis ke disk lalu dirangkai saat commit."""
+
+        def __init__(self, direktori):
+            self.direktori = direktori
+            self.path = os.path.join(direktori, 'blob')
+
+        def upload_blob(self, data, content_settings=None):
+            with open(self.path, 'wb') as f:
+                f.write(data)
+
+        def stage_block(self, block_id, data, length=None):
+            with open(os.path.join(self.direktori, block_id.replace('/', '_')), 'wb') as f:
+                f.write(data)
+
+        def commit_block_list(self, block_list, content_settings=None):
+            with open(self.path, 'wb') as hasil:
+                for blok in block_list:
+                    path_blok = os.path.join(self.direktori, blok.id.replace('/', '_'))
+                    with open(path_blok, 'rb') as f:
+                        shutil.copyfileobj(f, hasil)
+                    os.remove(path_blok)
+
+    def ukur(mode, path_sumber, antrean):
+        # Proses anak: selisih puncak RSS terhadap RSS awal proses (KB di Linux)
+        awal = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        direktori = tempfile.mkdtemp(prefix='bench-media-')
+        try:
+            client = BlobClientLokal(direktori)
+            mulai = time.perf_counter()
+            with open(path_sumber, 'rb') as stream:
+                if mode == 'buffer':
+                    stream.seek(0)
+                    client.upload_blob(stream.read())
+                else:
+                    stage_blok_azure(client, stream, chunk_size=chunk)
+            durasi = time.perf_counter() - mulai
+            puncak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            antrean.put(((puncak - awal) / 1024, durasi, os.path.getsize(client.path)))
+        finally:
+            shutil.rmtree(direktori, ignore_errors=True)
+
+    chunk = chunk_bytes or ukuran_chunk()
+    konteks = multiprocessing.get_context('fork')
+    click.echo(f"Chunk streaming: {chunk / 1024 / 1024:.2f} MB")
+    click.echo(f"{'MB':>6} | {'buffer +RSS MB':>14} | {'stream +RSS MB':>14} | {'buffer s':>8} | {'stream s':>8}")
+    for mb in sorted(ukuran_mb or (16, 64, 256)):
+        with tempfile.NamedTemporaryFile(prefix='bench-media-src-') as sumber:
+            for _ in range(mb):
+                sumber.write(os.urandom(1024 * 1024))
+            sumber.flush()
+            hasil = {}
+            for mode in ('buffer', 'stream'):
+                antrean = konteks.Queue()
+                proses = konteks.Process(target=ukur, args=(mode, sumber.name, antrean))
+                proses.start()
+                hasil[mode] = antrean.get()
+                proses.join()
+                if hasil[mode][2] != mb * 1024 * 1024:
+                    raise click.ClickException(f"Ukuran blob hasil mode {mode} tidak sesuai")
+        click.echo(f"{mb:>6} | {hasil['buffer'][0]:>14.1f} | {hasil['stream'][0]:>14.1f} | "
+                   f"{hasil['buffer'][1]:>8.2f} | {hasil['stream'][1]:>8.2f}")
+
+
+def register_commands(app):
+    app.cli.add_command(rebuild_patient_stats_command)
+    app.cli.add_command(backfill_highest_badge_command)
+    app.cli.add_command(award_eligible_badges_command)
+    app.cli.add_command(compact_points_ledger_command)
+    app.cli.add_command(backfill_points_ledger_command)
+    app.cli.add_command(purge_idempotency_keys_command)
+    app.cli.add_command(purge_pending_media_command)
+    app.cli.add_command(reconcile_storage_command)
+    app.cli.add_command(worker_command)
+    app.cli.add_command(enqueue_firebase_sync_command)
+    app.cli.add_command(install_gerakan_search_command)
+    app.cli.add_command(benchmark_gerakan_search_command)
+    app.cli.add_command(benchmark_media_upload_command)
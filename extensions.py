@@ -6,9 +6,11 @@ from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
+from utils.storage_clients import StorageClients
 
 db = SQLAlchemy()
 migrate = Migrate()
 jwt = JWTManager()
 bcrypt = Bcrypt()
 cors = CORS()
+storage_clients = StorageClients() # Client Azure Blob/GCS ber-pool, satu per proses worker
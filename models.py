@@ -3,14 +3,33 @@
 # PERUBAHAN BARU: Menambahkan model Badge, UserBadge, dan kolom poin untuk gamifikasi.
 # PERUBAHAN DASHBOARD PASIEN: Menambahkan estimasi total gerakan dan durasi ke serialisasi ProgramRehabilitasi.
 # PERUBAHAN PROFIL PASIEN: Menambahkan highest_badge_info ke serialisasi PatientProfile.
+# PERUBAHAN PERFORMA: Menambahkan ProgramRehabilitasi.serialize_full_batch (eager loading, jumlah query tetap per halaman).
+# PERUBAHAN PERFORMA: Menambahkan model PatientSessionStats (rollup statistik sesi per pasien).
+# PERUBAHAN PERFORMA: Menambahkan AppUser.highest_badge_id (pointer badge tertinggi terdenormalisasi).
+# PERUBAHAN PERFORMA: Menambahkan model PointsLedger; AppUser.total_points menjadi cache turunan ledger.
+# PERUBAHAN PERFORMA: LaporanRehabilitasi.serialize_full memuat gerakan dan detail program secara eager.
+# PERUBAHAN BARU: Menambahkan model IdempotencyKey (respons tersimpan untuk header Idempotency-Key).
+# PERUBAHAN BARU: Menambahkan model OutboxEvent (event domain yang diproses `flask worker`).
+# PERUBAHAN BARU: Menambahkan model ProgramTemplate dan ProgramTemplateDetail (template program untuk assign massal).
+# PERUBAHAN BARU: Menambahkan model ProgramSeries (jadwal program berulang) dan ProgramRehabilitasi.series_id.
+# PERUBAHAN PERFORMA: Serializer Gerakan, ProgramRehabilitasi, dan LaporanRehabilitasi mendukung sparse fieldset (utils/fieldsets.py).
+# PERUBAHAN PERFORMA: Indeks komposit untuk urutan riwayat program/laporan dan katalog gerakan (paging cursor).
+# PERUBAHAN PERFORMA: Indeks pencarian gerakan (utils/gerakan_search.py) didaftarkan pada tabel gerakan.
+# PERUBAHAN BARU: Menambahkan model PendingMedia (tiket unggah langsung ke storage dengan URL bertanda tangan).
+# PERUBAHAN BARU: URL media dibangun backend storage yang dipilih konfigurasi (utils/storage_backend.py); URL model .tflite memakai path objek GCS lengkap.
+# PERUBAHAN BARU: Menambahkan model PendingDeletion (antrean penghapusan file storage yang diproses worker per batch).
+# PERUBAHAN PERFORMA: Menambahkan model MediaBlob (deduplikasi media berdasarkan hash isi dengan reference count).
 
 from app import db, bcrypt
-from datetime import datetime, date
-from sqlalchemy.orm import validates
+from datetime import datetime, date, timedelta
+from sqlalchemy.orm import validates, joinedload
 import enum
-from utils.azure_helpers import get_blob_url
-from utils.gcs_helpers import get_gcs_url
-from sqlalchemy import desc # Import desc untuk mengurutkan badge
+from collections import defaultdict
+from utils.storage_backend import url_file, JENIS_MODEL
+from utils.fieldsets import ALL_FIELDS
+from utils.gerakan_search import daftarkan_ddl as daftarkan_ddl_pencarian_gerakan
+from sqlalchemy import desc, func, case, cast, update, insert # Import desc untuk mengurutkan badge
+from sqlalchemy.exc import IntegrityError
 
 # Enum untuk Status Program
 class ProgramStatus(str, enum.Enum):
@@ -19,6 +38,23 @@ class ProgramStatus(str, enum.Enum):
     SELESAI = "selesai"
     DIBATALKAN = "dibatalkan"
 
+# Enum untuk status event di outbox_events
+class OutboxStatus(str, enum.Enum):
+    PENDING = "pending"
+    SELESAI = "selesai"
+    GAGAL = "gagal"
+
+# Enum untuk status antrean penghapusan file storage (pending_deletions)
+class DeletionStatus(str, enum.Enum):
+    PENDING = "pending"
+    GAGAL = "gagal" # Melewati batas percobaan, menunggu penanganan manual
+
+# Enum untuk sumber kredit poin di points_ledger
+class PointSource(str, enum.Enum):
+    LAPORAN = "laporan"
+    BONUS = "bonus"
+    KOREKSI = "koreksi"
+
 # Model AppUser
 class AppUser(db.Model):
     __tablename__ = 'app_users'
@@ -28,9 +64,14 @@ class AppUser(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(128), nullable=False)
     role = db.Column(db.String(10), nullable=False, index=True)
+    # Cache turunan dari points_ledger: ditambah saat baris ledger dipadatkan (lihat PointsLedger.compact)
     total_points = db.Column(db.Integer, default=0, nullable=False)
+    # Pointer terdenormalisasi ke badge dengan point_threshold tertinggi yang dimiliki user.
+    # Dijaga saat badge diberikan, serta saat ambang batas badge diubah/badge dihapus (lihat refresh_highest_badge).
+    highest_badge_id = db.Column(db.Integer, db.ForeignKey('badges.id', ondelete='SET NULL'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     patient_profile = db.relationship('PatientProfile', back_populates='user', uselist=False, cascade="all, delete-orphan")
+    highest_badge = db.relationship('Badge', foreign_keys=[highest_badge_id])
     # Relasi ke PolaMakan yang dibuat oleh terapis
     pola_makan_dibuat = db.relationship('PolaMakan', foreign_keys='PolaMakan.terapis_id', backref='terapis_pembuat', lazy=True)
     # Relasi ke PolaMakan yang diterima oleh pasien
@@ -42,6 +83,25 @@ class AppUser(db.Model):
     def check_password(self, password):
         return bcrypt.check_password_hash(self.password_hash, password)
 
+    @classmethod
+    def refresh_highest_badge(cls, user_ids=None):
+        """
+        Menghitung ulang highest_badge_id dengan satu UPDATE berbasis subquery terkorelasi.
+        Jika user_ids None, semua user dihitung ulang (backfill). Tidak melakukan commit.
+        """
+        if user_ids is not None and not user_ids:
+            return 0
+        badge_tertinggi = db.session.query(UserBadge.badge_id)\
+            .join(Badge, UserBadge.badge_id == Badge.id)\
+            .filter(UserBadge.user_id == cls.id)\
+            .order_by(desc(Badge.point_threshold))\
+            .limit(1).correlate(cls).scalar_subquery()
+        stmt = update(cls).values(highest_badge_id=badge_tertinggi)
+        if user_ids is not None:
+            stmt = stmt.where(cls.id.in_(list(user_ids)))
+        result = db.session.execute(stmt, execution_options={"synchronize_session": "fetch"})
+        return result.rowcount
+
     def serialize_basic(self):
         return {
             'id': self.id,
@@ -52,6 +112,9 @@ class AppUser(db.Model):
             'total_points': self.total_points
         }
 
+# Field AppUser.serialize_basic, dipakai sebagai sub-field relasi user pada FIELDSET_SPEC
+USER_FIELDS = ("id", "username", "nama_lengkap", "email", "role", "total_points")
+
 # Model PatientProfile
 class PatientProfile(db.Model):
     __tablename__ = 'patient_profiles'
@@ -78,12 +141,8 @@ class PatientProfile(db.Model):
         user_data = self.user.serialize_basic() if self.user else {}
         serialized_data = user_data.copy()
 
-        # Ambil badge tertinggi yang dimiliki user ini
-        highest_badge_entry = UserBadge.query.filter_by(user_id=self.user_id)\
-                                             .join(Badge)\
-                                             .order_by(desc(Badge.point_threshold))\
-                                             .first()
-        highest_badge_info = highest_badge_entry.badge.serialize() if highest_badge_entry and highest_badge_entry.badge else None
+        # Badge tertinggi dibaca dari pointer terdenormalisasi AppUser.highest_badge
+        highest_badge_info = self.user.highest_badge.serialize() if self.user and self.user.highest_badge else None
 
         serialized_data.update({
             'jenis_kelamin': self.jenis_kelamin,
@@ -99,12 +158,15 @@ class PatientProfile(db.Model):
             'golongan_darah': self.golongan_darah,
             'riwayat_medis': self.riwayat_medis,
             'riwayat_alergi': self.riwayat_alergi,
-            'url_foto_profil': get_blob_url(self.filename_foto_profil),
+            'url_foto_profil': self.url_foto_profil(),
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'highest_badge_info': highest_badge_info # Menambahkan informasi badge tertinggi
         })
         return serialized_data
 
+    def url_foto_profil(self):
+        return url_file(self.filename_foto_profil)
+
 # Model Gerakan
 class Gerakan(db.Model):
     __tablename__ = 'gerakan'
@@ -119,23 +181,37 @@ class Gerakan(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     pembuat = db.relationship('AppUser', foreign_keys=[created_by_terapis_id])
+    # Indeks sesuai urutan katalog gerakan (paging cursor/keyset)
+    __table_args__ = (db.Index('ix_gerakan_nama_id', 'nama_gerakan', 'id'),)
 
     def serialize_simple(self):
         return {"id": self.id, "nama_gerakan": self.nama_gerakan}
 
-    def serialize_full(self):
-        pembuat_info = self.pembuat.serialize_basic() if self.pembuat else None
-        return {
-            "id": self.id,
-            "nama_gerakan": self.nama_gerakan,
-            "deskripsi": self.deskripsi,
-            "url_foto": get_blob_url(self.blob_name_foto),
-            "url_video": get_blob_url(self.blob_name_video),
-            "url_model_tflite": get_gcs_url(self.gcs_uri_model_tflite.split('/')[-1]) if self.gcs_uri_model_tflite else None, # Ambil nama blob dari URI GCS
-            "created_by_terapis": pembuat_info,
-            "created_at": self.created_at.isoformat() if self.created_at else None,
-            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
-        }
+    # Field yang dapat dipilih lewat query param `fields`/`include` (lihat utils/fieldsets.py)
+    FIELDSET_SPEC = {
+        "id": "id",
+        "fields": ("nama_gerakan", "deskripsi", "url_foto", "url_video", "url_model_tflite", "created_at", "updated_at"),
+        "relations": {"created_by_terapis": USER_FIELDS}
+    }
+
+    def serialize_full(self, fieldset=ALL_FIELDS):
+        # Field yang tidak diminta tidak dihitung (URL blob/GCS) dan relasinya tidak dimuat
+        data = {}
+        if fieldset.wants("id"): data["id"] = self.id
+        if fieldset.wants("nama_gerakan"): data["nama_gerakan"] = self.nama_gerakan
+        if fieldset.wants("deskripsi"): data["deskripsi"] = self.deskripsi
+        if fieldset.wants("url_foto"): data["url_foto"] = url_file(self.blob_name_foto)
+        if fieldset.wants("url_video"): data["url_video"] = url_file(self.blob_name_video)
+        if fieldset.wants("url_model_tflite"):
+            data["url_model_tflite"] = url_file(self.gcs_uri_model_tflite, JENIS_MODEL) # Path objek lengkap dari URI GCS
+        if fieldset.wants("created_by_terapis"):
+            data["created_by_terapis"] = fieldset.sub("created_by_terapis").pick(self.pembuat.serialize_basic()) if self.pembuat else None
+        if fieldset.wants("created_at"): data["created_at"] = self.created_at.isoformat() if self.created_at else None
+        if fieldset.wants("updated_at"): data["updated_at"] = self.updated_at.isoformat() if self.updated_at else None
+        return data
+
+# Indeks pencarian katalog gerakan (FTS5 di SQLite, tsvector/pg_trgm di PostgreSQL) dibuat bersama tabelnya
+daftarkan_ddl_pencarian_gerakan(Gerakan.__table__)
 
 # Model ProgramRehabilitasi
 class ProgramRehabilitasi(db.Model):
@@ -147,6 +223,8 @@ class ProgramRehabilitasi(db.Model):
     status = db.Column(db.Enum(ProgramStatus), nullable=False, default=ProgramStatus.BELUM_DIMULAI, index=True)
     terapis_id = db.Column(db.Integer, db.ForeignKey('app_users.id', ondelete='SET NULL'), nullable=True)
     pasien_id = db.Column(db.Integer, db.ForeignKey('app_users.id', ondelete='CASCADE'), nullable=False)
+    # Seri jadwal berulang asal program ini (NULL untuk program tunggal)
+    series_id = db.Column(db.Integer, db.ForeignKey('program_series.id', ondelete='SET NULL'), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     detail_gerakan = db.relationship('ProgramGerakanDetail', backref='program', lazy='dynamic', cascade="all, delete-orphan")
@@ -154,6 +232,8 @@ class ProgramRehabilitasi(db.Model):
     pasien = db.relationship('AppUser', foreign_keys=[pasien_id], backref="program_diterima")
     # Relasi ke LaporanRehabilitasi, menggunakan backref='program_rehab'
     laporan_hasil = db.relationship('LaporanRehabilitasi', backref='program_rehab', uselist=False, cascade="all, delete-orphan", primaryjoin="ProgramRehabilitasi.id == LaporanRehabilitasi.program_rehabilitasi_id")
+    # Indeks sesuai urutan riwayat program pasien (paging cursor/keyset)
+    __table_args__ = (db.Index('ix_program_rehabilitasi_pasien_riwayat', 'pasien_id', 'tanggal_program', 'created_at', 'id'),)
 
 
     def serialize_simple(self):
@@ -164,59 +244,159 @@ class ProgramRehabilitasi(db.Model):
             "status": self.status.value if self.status else None
         }
 
-    def serialize_full(self):
+    # Field yang dapat dipilih lewat query param `fields`/`include` (lihat utils/fieldsets.py)
+    FIELDSET_SPEC = {
+        "id": "id",
+        "fields": ("nama_program", "tanggal_program", "catatan_terapis", "status", "series_id",
+                   "total_planned_movements", "estimated_total_duration_minutes", "created_at", "updated_at"),
+        "relations": {
+            "terapis": USER_FIELDS,
+            "pasien": USER_FIELDS,
+            "list_gerakan_direncanakan": Gerakan.FIELDSET_SPEC["fields"] + (
+                "id", "created_by_terapis", "jumlah_repetisi_direncanakan", "urutan_dalam_program", "program_gerakan_detail_id"),
+            "laporan_terkait": ("laporan_id", "tanggal_laporan_disubmit", "total_waktu_rehabilitasi_string",
+                                "total_waktu_rehabilitasi_detik", "catatan_pasien_laporan",
+                                "detail_hasil_gerakan_aktual", "summary_total_hitungan_aktual")
+        }
+    }
+
+    def serialize_full(self, fieldset=ALL_FIELDS):
+        return ProgramRehabilitasi.serialize_full_batch([self], fieldset)[0]
+
+    @staticmethod
+    def serialize_full_batch(programs, fieldset=ALL_FIELDS):
+        """
+        Serialisasi penuh untuk banyak program sekaligus.
+        Detail gerakan, laporan, hasil gerakan, dan user (terapis/pasien) dimuat secara massal,
+        sehingga jumlah query tetap (tidak bergantung pada jumlah program dalam satu halaman).
+        Dengan sparse fieldset, relasi yang tidak diminta tidak di-query sama sekali.
+        """
+        programs = list(programs)
+        program_ids = [p.id for p in programs]
+        if not program_ids:
+            return []
+
+        gerakan_fieldset = fieldset.sub("list_gerakan_direncanakan")
+        laporan_fieldset = fieldset.sub("laporan_terkait")
+
+        # 1. Semua detail gerakan beserta gerakan dan pembuatnya
+        details_by_program = defaultdict(list)
+        if fieldset.wants_any("list_gerakan_direncanakan", "total_planned_movements", "estimated_total_duration_minutes"):
+            detail_query = ProgramGerakanDetail.query
+            if fieldset.wants("list_gerakan_direncanakan"):
+                gerakan_load = joinedload(ProgramGerakanDetail.gerakan)
+                if gerakan_fieldset.wants("created_by_terapis"):
+                    gerakan_load = gerakan_load.joinedload(Gerakan.pembuat)
+                detail_query = detail_query.options(gerakan_load)
+            detail_rows = detail_query\
+                .filter(ProgramGerakanDetail.program_id.in_(program_ids))\
+                .order_by(ProgramGerakanDetail.urutan.asc(), ProgramGerakanDetail.id.asc()).all()
+            for detail in detail_rows:
+                details_by_program[detail.program_id].append(detail)
+
+        # 2. Laporan terkait (satu laporan per program)
+        laporan_by_program = {}
+        if fieldset.wants("laporan_terkait"):
+            laporan_rows = LaporanRehabilitasi.query\
+                .filter(LaporanRehabilitasi.program_rehabilitasi_id.in_(program_ids))\
+                .order_by(LaporanRehabilitasi.id.asc()).all()
+            for laporan in laporan_rows:
+                laporan_by_program.setdefault(laporan.program_rehabilitasi_id, laporan)
+
+        # 3. Detail hasil gerakan dari semua laporan tersebut
+        hasil_by_laporan = defaultdict(list)
+        laporan_ids = [l.id for l in laporan_by_program.values()]
+        if laporan_ids and laporan_fieldset.wants_any("detail_hasil_gerakan_aktual", "summary_total_hitungan_aktual"):
+            hasil_query = LaporanGerakanHasil.query
+            if laporan_fieldset.wants("detail_hasil_gerakan_aktual"):
+                hasil_query = hasil_query.options(joinedload(LaporanGerakanHasil.gerakan_asli),
+                                                  joinedload(LaporanGerakanHasil.detail_program_asli))
+            hasil_rows = hasil_query\
+                .filter(LaporanGerakanHasil.laporan_rehabilitasi_id.in_(laporan_ids))\
+                .order_by(LaporanGerakanHasil.urutan_gerakan_dalam_program.asc(), LaporanGerakanHasil.id.asc()).all()
+            for hasil in hasil_rows:
+                hasil_by_laporan[hasil.laporan_rehabilitasi_id].append(hasil)
+
+        # 4. Terapis dan pasien dari semua program
+        user_ids = set()
+        if fieldset.wants("terapis"):
+            user_ids |= {p.terapis_id for p in programs if p.terapis_id}
+        if fieldset.wants("pasien"):
+            user_ids |= {p.pasien_id for p in programs if p.pasien_id}
+        users_by_id = {u.id: u for u in AppUser.query.filter(AppUser.id.in_(user_ids)).all()} if user_ids else {}
+
+        results = []
+        for program in programs:
+            laporan = laporan_by_program.get(program.id)
+            results.append(program._serialize_full_from(
+                details_by_program[program.id],
+                laporan,
+                hasil_by_laporan[laporan.id] if laporan else [],
+                users_by_id.get(program.terapis_id),
+                users_by_id.get(program.pasien_id),
+                fieldset
+            ))
+        return results
+
+    def _serialize_full_from(self, details, laporan, hasil_list, terapis, pasien, fieldset=ALL_FIELDS):
         list_gerakan_direncanakan_details = []
         total_planned_movements = 0 # Tambahan untuk dashboard pasien
         # Estimasi 5 detik per repetisi untuk total durasi
         ESTIMATED_SECONDS_PER_REPETITION = 5 
         estimated_total_duration_seconds = 0 # Tambahan untuk dashboard pasien
+        gerakan_fieldset = fieldset.sub("list_gerakan_direncanakan")
+        with_gerakan = fieldset.wants("list_gerakan_direncanakan")
 
-        for detail in self.detail_gerakan.order_by(ProgramGerakanDetail.urutan.asc(), ProgramGerakanDetail.id.asc()).all():
-            gerakan_obj = Gerakan.query.get(detail.gerakan_id)
-            if gerakan_obj:
-                gerakan_data = gerakan_obj.serialize_full()
-                gerakan_data['jumlah_repetisi_direncanakan'] = detail.jumlah_repetisi
-                gerakan_data['urutan_dalam_program'] = detail.urutan
-                gerakan_data['program_gerakan_detail_id'] = detail.id
+        for detail in details:
+            if with_gerakan:
+                gerakan_obj = detail.gerakan
+                if not gerakan_obj:
+                    continue
+                gerakan_data = gerakan_obj.serialize_full(gerakan_fieldset)
+                if gerakan_fieldset.wants("jumlah_repetisi_direncanakan"): gerakan_data['jumlah_repetisi_direncanakan'] = detail.jumlah_repetisi
+                if gerakan_fieldset.wants("urutan_dalam_program"): gerakan_data['urutan_dalam_program'] = detail.urutan
+                if gerakan_fieldset.wants("program_gerakan_detail_id"): gerakan_data['program_gerakan_detail_id'] = detail.id
                 list_gerakan_direncanakan_details.append(gerakan_data)
-                
-                # Hitung total gerakan dan estimasi durasi
-                total_planned_movements += detail.jumlah_repetisi # Asumsi 1 gerakan = 1 repetisi
-                estimated_total_duration_seconds += detail.jumlah_repetisi * ESTIMATED_SECONDS_PER_REPETITION
+
+            # Hitung total gerakan dan estimasi durasi
+            total_planned_movements += detail.jumlah_repetisi # Asumsi 1 gerakan = 1 repetisi
+            estimated_total_duration_seconds += detail.jumlah_repetisi * ESTIMATED_SECONDS_PER_REPETITION
 
 
-        terapis_info = self.terapis.serialize_basic() if self.terapis else None
-        pasien_info = self.pasien.serialize_basic() if self.pasien else None
+        terapis_info = fieldset.sub("terapis").pick(terapis.serialize_basic()) if terapis else None
+        pasien_info = fieldset.sub("pasien").pick(pasien.serialize_basic()) if pasien else None
 
         laporan_terkait_summary = None
-        if self.laporan_hasil:
+        laporan_fieldset = fieldset.sub("laporan_terkait")
+        if laporan:
             laporan_terkait_summary = {
-                "laporan_id": self.laporan_hasil.id,
-                "tanggal_laporan_disubmit": self.laporan_hasil.tanggal_laporan.isoformat() if self.laporan_hasil.tanggal_laporan else None,
-                "total_waktu_rehabilitasi_string": self.laporan_hasil.format_durasi(self.laporan_hasil.total_waktu_rehabilitasi_detik),
-                "total_waktu_rehabilitasi_detik": self.laporan_hasil.total_waktu_rehabilitasi_detik,
-                "catatan_pasien_laporan": self.laporan_hasil.catatan_pasien_laporan,
-                "detail_hasil_gerakan_aktual": []
+                "laporan_id": laporan.id,
+                "tanggal_laporan_disubmit": laporan.tanggal_laporan.isoformat() if laporan.tanggal_laporan else None,
+                "total_waktu_rehabilitasi_string": laporan.format_durasi(laporan.total_waktu_rehabilitasi_detik),
+                "total_waktu_rehabilitasi_detik": laporan.total_waktu_rehabilitasi_detik,
+                "catatan_pasien_laporan": laporan.catatan_pasien_laporan
             }
-            for detail_hasil in self.laporan_hasil.detail_hasil_gerakan.order_by(LaporanGerakanHasil.urutan_gerakan_dalam_program.asc(), LaporanGerakanHasil.id.asc()).all():
-                laporan_terkait_summary["detail_hasil_gerakan_aktual"].append(detail_hasil.serialize())
+            if laporan_fieldset.wants("detail_hasil_gerakan_aktual"):
+                laporan_terkait_summary["detail_hasil_gerakan_aktual"] = [detail_hasil.serialize() for detail_hasil in hasil_list]
 
-            total_sempurna = sum(d.jumlah_sempurna or 0 for d in self.laporan_hasil.detail_hasil_gerakan)
-            total_tidak_sempurna = sum(d.jumlah_tidak_sempurna or 0 for d in self.laporan_hasil.detail_hasil_gerakan)
-            total_tidak_terdeteksi = sum(d.jumlah_tidak_terdeteksi or 0 for d in self.laporan_hasil.detail_hasil_gerakan)
+            total_sempurna = sum(d.jumlah_sempurna or 0 for d in hasil_list)
+            total_tidak_sempurna = sum(d.jumlah_tidak_sempurna or 0 for d in hasil_list)
+            total_tidak_terdeteksi = sum(d.jumlah_tidak_terdeteksi or 0 for d in hasil_list)
             laporan_terkait_summary["summary_total_hitungan_aktual"] = {
                 "sempurna": total_sempurna,
                 "tidak_sempurna": total_tidak_sempurna,
                 "tidak_terdeteksi": total_tidak_terdeteksi
             }
+            laporan_terkait_summary = laporan_fieldset.pick(laporan_terkait_summary)
 
 
-        return {
+        return fieldset.pick({
             "id": self.id,
             "nama_program": self.nama_program,
             "tanggal_program": self.tanggal_program.isoformat() if self.tanggal_program else None,
             "catatan_terapis": self.catatan_terapis,
             "status": self.status.value if self.status else None,
+            "series_id": self.series_id,
             "terapis": terapis_info,
             "pasien": pasien_info,
             "list_gerakan_direncanakan": list_gerakan_direncanakan_details,
@@ -225,7 +405,7 @@ class ProgramRehabilitasi(db.Model):
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
             "laporan_terkait": laporan_terkait_summary
-        }
+        })
 
 # Model ProgramGerakanDetail
 class ProgramGerakanDetail(db.Model):
@@ -237,6 +417,106 @@ class ProgramGerakanDetail(db.Model):
     urutan = db.Column(db.Integer, nullable=True)
     gerakan = db.relationship('Gerakan')
 
+# NEW MODEL: ProgramTemplate
+# Template program milik terapis (daftar gerakan standar) yang dapat di-assign ke banyak pasien
+# dan banyak tanggal sekaligus; setiap assign menghasilkan ProgramRehabilitasi + ProgramGerakanDetail biasa.
+class ProgramTemplate(db.Model):
+    __tablename__ = 'program_templates'
+    id = db.Column(db.Integer, primary_key=True)
+    nama_template = db.Column(db.String(150), nullable=False)
+    catatan_terapis = db.Column(db.Text, nullable=True)
+    terapis_id = db.Column(db.Integer, db.ForeignKey('app_users.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    details = db.relationship('ProgramTemplateDetail', backref='template', lazy=True, cascade="all, delete-orphan",
+                              order_by='ProgramTemplateDetail.urutan')
+
+    def serialize(self, include_details=True):
+        data = {
+            "id": self.id,
+            "nama_template": self.nama_template,
+            "catatan_terapis": self.catatan_terapis,
+            "terapis_id": self.terapis_id,
+            "jumlah_gerakan": len(self.details),
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+        if include_details:
+            data["list_gerakan_direncanakan"] = [detail.serialize() for detail in self.details]
+        return data
+
+# NEW MODEL: ProgramTemplateDetail
+class ProgramTemplateDetail(db.Model):
+    __tablename__ = 'program_template_detail'
+    id = db.Column(db.Integer, primary_key=True)
+    template_id = db.Column(db.Integer, db.ForeignKey('program_templates.id', ondelete='CASCADE'), nullable=False, index=True)
+    gerakan_id = db.Column(db.Integer, db.ForeignKey('gerakan.id', ondelete='CASCADE'), nullable=False)
+    jumlah_repetisi = db.Column(db.Integer, nullable=False)
+    urutan = db.Column(db.Integer, nullable=True)
+    gerakan = db.relationship('Gerakan')
+
+    def serialize(self):
+        return {
+            "gerakan_id": self.gerakan_id,
+            "nama_gerakan": self.gerakan.nama_gerakan if self.gerakan else None,
+            "jumlah_repetisi_direncanakan": self.jumlah_repetisi,
+            "urutan_dalam_program": self.urutan
+        }
+
+# Enum untuk frekuensi jadwal program berulang
+class FrekuensiPengulangan(str, enum.Enum):
+    HARIAN = "harian"
+    HARI_KERJA = "hari_kerja" # Senin-Jumat
+    SETIAP_N_HARI = "setiap_n_hari"
+
+# NEW MODEL: ProgramSeries
+# Aturan pengulangan sebuah jadwal program. Saat dibuat, aturan diekspansi menjadi satu ProgramRehabilitasi
+# (+ ProgramGerakanDetail) per tanggal dengan insert multi-baris; program-program tersebut menyimpan series_id
+# sehingga perubahan pada seri dapat diterapkan secara massal.
+class ProgramSeries(db.Model):
+    __tablename__ = 'program_series'
+    MAKS_KEJADIAN = 366
+
+    id = db.Column(db.Integer, primary_key=True)
+    terapis_id = db.Column(db.Integer, db.ForeignKey('app_users.id', ondelete='SET NULL'), nullable=True)
+    pasien_id = db.Column(db.Integer, db.ForeignKey('app_users.id', ondelete='CASCADE'), nullable=False, index=True)
+    frekuensi = db.Column(db.Enum(FrekuensiPengulangan), nullable=False)
+    interval_hari = db.Column(db.Integer, nullable=False, default=1)
+    tanggal_mulai = db.Column(db.Date, nullable=False)
+    tanggal_selesai = db.Column(db.Date, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    programs = db.relationship('ProgramRehabilitasi', backref='series', lazy='dynamic')
+
+    @staticmethod
+    def ekspansi_tanggal(tanggal_mulai, tanggal_selesai, frekuensi, interval_hari=1):
+        """Daftar tanggal kejadian dari tanggal_mulai sampai tanggal_selesai (inklusif) sesuai frekuensi."""
+        frekuensi = FrekuensiPengulangan(frekuensi)
+        langkah = interval_hari if frekuensi == FrekuensiPengulangan.SETIAP_N_HARI else 1
+        hasil = []
+        tanggal = tanggal_mulai
+        while tanggal <= tanggal_selesai:
+            if frekuensi != FrekuensiPengulangan.HARI_KERJA or tanggal.weekday() < 5:
+                hasil.append(tanggal)
+            tanggal += timedelta(days=langkah)
+        return hasil
+
+    def tanggal_jadwal(self):
+        return self.ekspansi_tanggal(self.tanggal_mulai, self.tanggal_selesai, self.frekuensi, self.interval_hari)
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "terapis_id": self.terapis_id,
+            "pasien_id": self.pasien_id,
+            "frekuensi": self.frekuensi.value if self.frekuensi else None,
+            "interval_hari": self.interval_hari,
+            "tanggal_mulai": self.tanggal_mulai.isoformat() if self.tanggal_mulai else None,
+            "tanggal_selesai": self.tanggal_selesai.isoformat() if self.tanggal_selesai else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
 # Model LaporanRehabilitasi
 class LaporanRehabilitasi(db.Model):
     __tablename__ = 'laporan_rehabilitasi'
@@ -253,6 +533,8 @@ class LaporanRehabilitasi(db.Model):
     terapis_yang_assign = db.relationship('AppUser', foreign_keys=[terapis_id], backref='laporan_rehabilitasi_terapis')
     # program_asli = db.relationship('ProgramRehabilitasi', backref=db.backref('laporan_hasil', uselist=False, cascade="all, delete-orphan")) # Dihapus, diganti relationship di atas
     detail_hasil_gerakan = db.relationship('LaporanGerakanHasil', backref='laporan_induk', lazy='dynamic', cascade="all, delete-orphan")
+    # Indeks sesuai urutan riwayat laporan pasien (paging cursor/keyset)
+    __table_args__ = (db.Index('ix_laporan_rehabilitasi_pasien_riwayat', 'pasien_id', 'tanggal_laporan', 'created_at', 'id'),)
 
     def format_durasi(self, total_detik):
         if total_detik is None: return "00:00"
@@ -262,22 +544,93 @@ class LaporanRehabilitasi(db.Model):
         detik = int(sisa_detik % 60)
         return f"{jam:02d}:{menit:02d}:{detik:02d}" if jam > 0 else f"{menit:02d}:{detik:02d}"
 
-    def serialize_full(self):
-        detail_gerakan_list = []
-        for detail_hasil in self.detail_hasil_gerakan.order_by(LaporanGerakanHasil.urutan_gerakan_dalam_program.asc(), LaporanGerakanHasil.id.asc()).all():
-            detail_gerakan_list.append(detail_hasil.serialize())
+    # Field yang dapat dipilih lewat query param `fields`/`include` (lihat utils/fieldsets.py)
+    FIELDSET_SPEC = {
+        "id": "laporan_id",
+        "fields": ("tanggal_program_direncanakan", "tanggal_laporan_disubmit", "total_waktu_rehabilitasi_string",
+                   "total_waktu_rehabilitasi_detik", "catatan_pasien_laporan", "points_earned",
+                   "summary_total_hitungan", "created_at"),
+        "relations": {
+            "pasien_info": USER_FIELDS,
+            "program_info": ("id", "nama_program", "nama_terapis_program"),
+            "detail_hasil_gerakan": ("laporan_gerakan_id", "nama_gerakan", "jumlah_repetisi_direncanakan", "jumlah_sempurna",
+                                     "jumlah_tidak_sempurna", "jumlah_tidak_terdeteksi", "waktu_aktual_per_gerakan_detik")
+        }
+    }
 
-        pasien_info = self.pasien.serialize_basic() if self.pasien else {}
-        program_asli_info = self.program_rehab.serialize_simple() if self.program_rehab else {} # Menggunakan program_rehab
+    def serialize_full(self, fieldset=ALL_FIELDS):
+        # Untuk satu laporan, pasien dan program diambil lewat relasi (identity map jika sudah dimuat)
+        hasil_list = []
+        if fieldset.wants_any("detail_hasil_gerakan", "summary_total_hitungan"):
+            hasil_list = self.detail_hasil_gerakan.options(
+                joinedload(LaporanGerakanHasil.gerakan_asli),
+                joinedload(LaporanGerakanHasil.detail_program_asli)
+            ).order_by(LaporanGerakanHasil.urutan_gerakan_dalam_program.asc(), LaporanGerakanHasil.id.asc()).all()
+        program_rehab = self.program_rehab if fieldset.wants_any("program_info", "tanggal_program_direncanakan") else None
+        pasien = self.pasien if fieldset.wants("pasien_info") else None
+        return self._serialize_full_from(hasil_list, program_rehab, pasien, fieldset)
 
-        total_hitung_sempurna = sum(d['jumlah_sempurna'] for d in detail_gerakan_list)
-        total_hitung_tidak_sempurna = sum(d['jumlah_tidak_sempurna'] for d in detail_gerakan_list)
-        total_hitung_tidak_terdeteksi = sum(d['jumlah_tidak_terdeteksi'] for d in detail_gerakan_list)
-        nama_terapis_program = self.program_rehab.terapis.nama_lengkap if self.program_rehab and self.program_rehab.terapis else "N/A" # Menggunakan program_rehab
+    @staticmethod
+    def serialize_full_batch(laporan_list, fieldset=ALL_FIELDS):
+        """
+        Serialisasi penuh untuk banyak laporan sekaligus. Hasil gerakan, program asal (beserta terapisnya),
+        dan pasien dimuat secara massal, dan hanya jika field yang membutuhkannya diminta.
+        """
+        laporan_list = list(laporan_list)
+        if not laporan_list:
+            return []
 
-        return {
+        # 1. Detail hasil gerakan semua laporan
+        hasil_by_laporan = defaultdict(list)
+        if fieldset.wants_any("detail_hasil_gerakan", "summary_total_hitungan"):
+            hasil_query = LaporanGerakanHasil.query
+            if fieldset.wants("detail_hasil_gerakan"):
+                hasil_query = hasil_query.options(joinedload(LaporanGerakanHasil.gerakan_asli),
+                                                  joinedload(LaporanGerakanHasil.detail_program_asli))
+            hasil_rows = hasil_query\
+                .filter(LaporanGerakanHasil.laporan_rehabilitasi_id.in_([l.id for l in laporan_list]))\
+                .order_by(LaporanGerakanHasil.urutan_gerakan_dalam_program.asc(), LaporanGerakanHasil.id.asc()).all()
+            for hasil in hasil_rows:
+                hasil_by_laporan[hasil.laporan_rehabilitasi_id].append(hasil)
+
+        # 2. Program asal beserta terapisnya
+        programs_by_id = {}
+        program_ids = {l.program_rehabilitasi_id for l in laporan_list if l.program_rehabilitasi_id}
+        if program_ids and fieldset.wants_any("program_info", "tanggal_program_direncanakan"):
+            program_query = ProgramRehabilitasi.query
+            if fieldset.sub("program_info").wants("nama_terapis_program"):
+                program_query = program_query.options(joinedload(ProgramRehabilitasi.terapis))
+            programs_by_id = {p.id: p for p in program_query.filter(ProgramRehabilitasi.id.in_(program_ids)).all()}
+
+        # 3. Pasien
+        users_by_id = {}
+        pasien_ids = {l.pasien_id for l in laporan_list if l.pasien_id}
+        if pasien_ids and fieldset.wants("pasien_info"):
+            users_by_id = {u.id: u for u in AppUser.query.filter(AppUser.id.in_(pasien_ids)).all()}
+
+        return [laporan._serialize_full_from(hasil_by_laporan[laporan.id],
+                                             programs_by_id.get(laporan.program_rehabilitasi_id),
+                                             users_by_id.get(laporan.pasien_id),
+                                             fieldset)
+                for laporan in laporan_list]
+
+    def _serialize_full_from(self, hasil_list, program_rehab, pasien, fieldset=ALL_FIELDS):
+        hasil_fieldset = fieldset.sub("detail_hasil_gerakan")
+        detail_gerakan_list = [hasil_fieldset.pick(detail_hasil.serialize()) for detail_hasil in hasil_list] if fieldset.wants("detail_hasil_gerakan") else []
+
+        pasien_info = fieldset.sub("pasien_info").pick(pasien.serialize_basic()) if pasien else {}
+        program_asli_info = program_rehab.serialize_simple() if program_rehab else {} # Menggunakan program_rehab
+
+        total_hitung_sempurna = sum(d.jumlah_sempurna or 0 for d in hasil_list)
+        total_hitung_tidak_sempurna = sum(d.jumlah_tidak_sempurna or 0 for d in hasil_list)
+        total_hitung_tidak_terdeteksi = sum(d.jumlah_tidak_terdeteksi or 0 for d in hasil_list)
+        nama_terapis_program = "N/A"
+        if fieldset.sub("program_info").wants("nama_terapis_program") and program_rehab and program_rehab.terapis:
+            nama_terapis_program = program_rehab.terapis.nama_lengkap # Menggunakan program_rehab
+
+        return fieldset.pick({
             "laporan_id": self.id, "pasien_info": pasien_info,
-            "program_info": {"id": program_asli_info.get("id"), "nama_program": program_asli_info.get("nama_program"), "nama_terapis_program": nama_terapis_program},
+            "program_info": fieldset.sub("program_info").pick({"id": program_asli_info.get("id"), "nama_program": program_asli_info.get("nama_program"), "nama_terapis_program": nama_terapis_program}),
             "tanggal_program_direncanakan": program_asli_info.get("tanggal_program"),
             "tanggal_laporan_disubmit": self.tanggal_laporan.isoformat() if self.tanggal_laporan else None,
             "total_waktu_rehabilitasi_string": self.format_durasi(self.total_waktu_rehabilitasi_detik),
@@ -287,7 +640,7 @@ class LaporanRehabilitasi(db.Model):
             "detail_hasil_gerakan": detail_gerakan_list,
             "summary_total_hitungan": {"sempurna": total_hitung_sempurna, "tidak_sempurna": total_hitung_tidak_sempurna, "tidak_terdeteksi": total_hitung_tidak_terdeteksi},
             "created_at": self.created_at.isoformat() if self.created_at else None
-        }
+        })
 
 # Model LaporanGerakanHasil
 class LaporanGerakanHasil(db.Model):
@@ -305,10 +658,9 @@ class LaporanGerakanHasil(db.Model):
     detail_program_asli = db.relationship('ProgramGerakanDetail')
 
     def serialize(self):
-        gerakan_info = self.gerakan_asli.serialize_full() if self.gerakan_asli else {}
         return {
             "laporan_gerakan_id": self.id,
-            "nama_gerakan": gerakan_info.get("nama_gerakan", "Gerakan tidak ditemukan"),
+            "nama_gerakan": self.gerakan_asli.nama_gerakan if self.gerakan_asli else "Gerakan tidak ditemukan",
             "jumlah_repetisi_direncanakan": self.detail_program_asli.jumlah_repetisi if self.detail_program_asli else "N/A",
             "jumlah_sempurna": self.jumlah_sempurna,
             "jumlah_tidak_sempurna": self.jumlah_tidak_sempurna,
@@ -316,6 +668,262 @@ class LaporanGerakanHasil(db.Model):
             "waktu_aktual_per_gerakan_detik": self.waktu_aktual_per_gerakan_detik
         }
 
+# NEW MODEL: PatientSessionStats
+# Rollup statistik sesi per pasien (hanya laporan dari program berstatus SELESAI).
+# Diperbarui secara transaksional saat laporan disubmit, dan bisa dibangun ulang dari riwayat
+# dengan perintah CLI `flask rebuild-patient-stats`.
+class PatientSessionStats(db.Model):
+    __tablename__ = 'patient_session_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('app_users.id', ondelete='CASCADE'), primary_key=True)
+    total_sesi_selesai = db.Column(db.Integer, default=0, nullable=False)
+    total_durasi_detik = db.Column(db.BigInteger, default=0, nullable=False)
+    jumlah_sesi_dengan_durasi = db.Column(db.Integer, default=0, nullable=False)
+    total_akurasi_kumulatif = db.Column(db.Float, default=0, nullable=False) # Jumlah akurasi (%) per sesi
+    jumlah_sesi_dinilai_akurasi = db.Column(db.Integer, default=0, nullable=False)
+    tanggal_sesi_pertama = db.Column(db.Date, nullable=True)
+    tanggal_sesi_terakhir = db.Column(db.Date, nullable=True)
+    total_sempurna = db.Column(db.BigInteger, default=0, nullable=False)
+    total_tidak_sempurna = db.Column(db.BigInteger, default=0, nullable=False)
+    total_tidak_terdeteksi = db.Column(db.BigInteger, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = db.relationship('AppUser', backref=db.backref('session_stats', uselist=False, cascade="all, delete-orphan"))
+
+    def __init__(self, **kwargs):
+        for kolom in ('total_sesi_selesai', 'total_durasi_detik', 'jumlah_sesi_dengan_durasi', 'total_akurasi_kumulatif',
+                      'jumlah_sesi_dinilai_akurasi', 'total_sempurna', 'total_tidak_sempurna', 'total_tidak_terdeteksi'):
+            kwargs.setdefault(kolom, 0)
+        super().__init__(**kwargs)
+
+    def catat_sesi(self, tanggal_laporan, durasi_detik, jumlah_sempurna, jumlah_tidak_sempurna, jumlah_tidak_terdeteksi, ada_hasil=True):
+        """Menambahkan satu sesi (laporan) yang baru selesai ke rollup."""
+        self.total_sesi_selesai += 1
+        if durasi_detik is not None:
+            self.total_durasi_detik += durasi_detik
+            self.jumlah_sesi_dengan_durasi += 1
+
+        total_gerakan = jumlah_sempurna + jumlah_tidak_sempurna + jumlah_tidak_terdeteksi
+        if ada_hasil and total_gerakan > 0:
+            self.total_akurasi_kumulatif += (jumlah_sempurna / total_gerakan) * 100
+            self.jumlah_sesi_dinilai_akurasi += 1
+
+        if tanggal_laporan:
+            if not self.tanggal_sesi_pertama or tanggal_laporan < self.tanggal_sesi_pertama:
+                self.tanggal_sesi_pertama = tanggal_laporan
+            if not self.tanggal_sesi_terakhir or tanggal_laporan > self.tanggal_sesi_terakhir:
+                self.tanggal_sesi_terakhir = tanggal_laporan
+
+        self.total_sempurna += jumlah_sempurna
+        self.total_tidak_sempurna += jumlah_tidak_sempurna
+        self.total_tidak_terdeteksi += jumlah_tidak_terdeteksi
+
+    def rata_rata_durasi_detik(self):
+        return self.total_durasi_detik / self.jumlah_sesi_dengan_durasi if self.jumlah_sesi_dengan_durasi else 0
+
+    def rata_rata_akurasi(self):
+        return self.total_akurasi_kumulatif / self.jumlah_sesi_dinilai_akurasi if self.jumlah_sesi_dinilai_akurasi else 0
+
+    def frekuensi_latihan_per_minggu(self):
+        if self.total_sesi_selesai > 1:
+            if self.tanggal_sesi_pertama and self.tanggal_sesi_terakhir:
+                rentang_hari = (self.tanggal_sesi_terakhir - self.tanggal_sesi_pertama).days
+                if rentang_hari > 0:
+                    return self.total_sesi_selesai / (rentang_hari / 7.0)
+                # Jika semua sesi di hari yang sama, anggap terjadi setiap hari (7 sesi per minggu)
+                return self.total_sesi_selesai * 7
+            return 0
+        return 1 if self.total_sesi_selesai == 1 else 0
+
+    @classmethod
+    def untuk_pasien(cls, pasien_id, lock=False):
+        """Mengambil baris rollup pasien; dengan lock=True baris dikunci (SELECT ... FOR UPDATE)."""
+        query = cls.query.filter_by(user_id=pasien_id)
+        if lock:
+            query = query.with_for_update()
+        return query.first()
+
+    @classmethod
+    def hitung_dari_riwayat(cls, pasien_ids=None):
+        """
+        Menghitung rollup dari data mentah laporan_rehabilitasi dan laporan_gerakan_hasil
+        dengan query agregat per pasien. Mengembalikan dict {pasien_id: PatientSessionStats} (belum disimpan).
+        Jika pasien_ids None, semua pasien yang memiliki laporan selesai dihitung.
+        """
+        def _query_laporan_selesai(*columns):
+            query = db.session.query(*columns).select_from(LaporanRehabilitasi)\
+                .join(ProgramRehabilitasi, LaporanRehabilitasi.program_rehabilitasi_id == ProgramRehabilitasi.id)\
+                .filter(ProgramRehabilitasi.status == ProgramStatus.SELESAI)
+            if pasien_ids is not None:
+                query = query.filter(LaporanRehabilitasi.pasien_id.in_(pasien_ids))
+            return query
+
+        hasil = {}
+        sesi_rows = _query_laporan_selesai(
+            LaporanRehabilitasi.pasien_id,
+            func.count(LaporanRehabilitasi.id),
+            func.sum(LaporanRehabilitasi.total_waktu_rehabilitasi_detik),
+            func.count(LaporanRehabilitasi.total_waktu_rehabilitasi_detik),
+            func.min(LaporanRehabilitasi.tanggal_laporan),
+            func.max(LaporanRehabilitasi.tanggal_laporan)
+        ).group_by(LaporanRehabilitasi.pasien_id).all()
+        for pasien_id, total_sesi, total_durasi, jumlah_durasi, tanggal_pertama, tanggal_terakhir in sesi_rows:
+            hasil[pasien_id] = cls(
+                user_id=pasien_id,
+                total_sesi_selesai=total_sesi,
+                total_durasi_detik=int(total_durasi or 0),
+                jumlah_sesi_dengan_durasi=jumlah_durasi,
+                tanggal_sesi_pertama=tanggal_pertama,
+                tanggal_sesi_terakhir=tanggal_terakhir
+            )
+
+        # Jumlah hasil gerakan per sesi, lalu akurasi per sesi dirata-ratakan per pasien
+        # (sesi tanpa gerakan yang dilakukan tidak ikut dinilai).
+        per_sesi = _query_laporan_selesai(
+            LaporanRehabilitasi.pasien_id.label('pasien_id'),
+            func.sum(func.coalesce(LaporanGerakanHasil.jumlah_sempurna, 0)).label('sempurna'),
+            func.sum(func.coalesce(LaporanGerakanHasil.jumlah_tidak_sempurna, 0)).label('tidak_sempurna'),
+            func.sum(func.coalesce(LaporanGerakanHasil.jumlah_tidak_terdeteksi, 0)).label('tidak_terdeteksi')
+        ).join(LaporanGerakanHasil, LaporanGerakanHasil.laporan_rehabilitasi_id == LaporanRehabilitasi.id)\
+         .group_by(LaporanRehabilitasi.pasien_id, LaporanRehabilitasi.id).subquery()
+        total_gerakan_sesi = per_sesi.c.sempurna + per_sesi.c.tidak_sempurna + per_sesi.c.tidak_terdeteksi
+        akurasi_sesi = case((total_gerakan_sesi > 0, cast(per_sesi.c.sempurna, db.Float) * 100 / total_gerakan_sesi), else_=None)
+        hasil_rows = db.session.query(
+            per_sesi.c.pasien_id,
+            func.sum(akurasi_sesi),
+            func.count(akurasi_sesi),
+            func.sum(per_sesi.c.sempurna),
+            func.sum(per_sesi.c.tidak_sempurna),
+            func.sum(per_sesi.c.tidak_terdeteksi)
+        ).group_by(per_sesi.c.pasien_id).all()
+        for pasien_id, total_akurasi, jumlah_dinilai, sempurna, tidak_sempurna, tidak_terdeteksi in hasil_rows:
+            stats = hasil.get(pasien_id)
+            if stats is None:
+                continue
+            stats.total_akurasi_kumulatif = float(total_akurasi or 0)
+            stats.jumlah_sesi_dinilai_akurasi = jumlah_dinilai
+            stats.total_sempurna = int(sempurna or 0)
+            stats.total_tidak_sempurna = int(tidak_sempurna or 0)
+            stats.total_tidak_terdeteksi = int(tidak_terdeteksi or 0)
+
+        return hasil
+
+    @classmethod
+    def rebuild(cls, pasien_ids=None):
+        """
+        Membangun ulang rollup dari riwayat (tidak melakukan commit).
+        Jika pasien_ids None, seluruh tabel rollup dibangun ulang untuk semua pasien.
+        Baris baru disisipkan di savepoint: jika transaksi lain lebih dulu membuat baris yang sama (mis. dua
+        submit pertama bersamaan), baris tersebut dikunci lalu dihitung ulang dari riwayat yang sudah di-commit.
+        Mengembalikan jumlah baris rollup yang ditulis.
+        """
+        db.session.flush()
+        dihitung = cls.hitung_dari_riwayat(pasien_ids)
+        if pasien_ids is not None:
+            target_ids = set(pasien_ids)
+            existing_query = cls.query.filter(cls.user_id.in_(target_ids))
+        else:
+            target_ids = {user_id for (user_id,) in db.session.query(AppUser.id).filter(AppUser.role == 'pasien').all()}
+            existing_query = cls.query
+        existing = {stats.user_id: stats for stats in existing_query.all()}
+
+        kolom_rollup = [c.name for c in cls.__table__.columns if c.name not in ('user_id', 'updated_at')]
+        for user_id in target_ids:
+            baru = dihitung.get(user_id) or cls(user_id=user_id)
+            stats = existing.get(user_id)
+            if stats is None:
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(baru)
+                    continue
+                except IntegrityError:
+                    stats = cls.untuk_pasien(user_id, lock=True)
+                    baru = cls.hitung_dari_riwayat([user_id]).get(user_id) or cls(user_id=user_id)
+            for kolom in kolom_rollup:
+                setattr(stats, kolom, getattr(baru, kolom))
+        db.session.flush()
+        return len(target_ids)
+
+# NEW MODEL: PointsLedger
+# Satu baris per kredit poin (laporan, bonus, koreksi), ditulis dengan insert biasa tanpa menyentuh
+# baris AppUser. AppUser.total_points adalah cache yang diperbarui oleh compact() (setelah submit dan
+# secara berkala lewat `flask compact-points-ledger`).
+class PointsLedger(db.Model):
+    __tablename__ = 'points_ledger'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('app_users.id', ondelete='CASCADE'), nullable=False)
+    points = db.Column(db.Integer, nullable=False)
+    source = db.Column(db.Enum(PointSource), nullable=False, default=PointSource.LAPORAN)
+    laporan_id = db.Column(db.Integer, db.ForeignKey('laporan_rehabilitasi.id', ondelete='SET NULL'), nullable=True, index=True)
+    keterangan = db.Column(db.String(255), nullable=True)
+    applied = db.Column(db.Boolean, default=False, nullable=False, index=True) # Sudah dijumlahkan ke AppUser.total_points
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    user = db.relationship('AppUser', backref=db.backref('points_ledger_entries', lazy='dynamic', cascade="all, delete-orphan"))
+
+    __table_args__ = (db.Index('ix_points_ledger_user_created', 'user_id', 'created_at'),)
+
+    @classmethod
+    def credit(cls, user_id, points, source=PointSource.LAPORAN, laporan_id=None, keterangan=None):
+        """Mencatat satu kredit poin. Tidak melakukan commit."""
+        entry = cls(user_id=user_id, points=points, source=source, laporan_id=laporan_id, keterangan=keterangan, applied=False)
+        db.session.add(entry)
+        return entry
+
+    @classmethod
+    def pending_points(cls, user_id):
+        """Jumlah poin user yang belum dipadatkan ke AppUser.total_points."""
+        return db.session.query(func.coalesce(func.sum(cls.points), 0))\
+            .filter(cls.user_id == user_id, cls.applied == False).scalar() or 0
+
+    @classmethod
+    def compact(cls, user_ids=None, batch_size=1000):
+        """
+        Memadatkan baris ledger yang belum diterapkan ke AppUser.total_points (satu batch).
+        Baris dikunci dengan SKIP LOCKED sehingga pemadatan paralel tidak saling menunggu,
+        dan total_points ditambah dengan UPDATE atomik (tanpa read-modify-write).
+        Mengembalikan dict {user_id: delta}. Tidak melakukan commit.
+        """
+        query = db.session.query(cls.id, cls.user_id, cls.points).filter(cls.applied == False)
+        if user_ids is not None:
+            query = query.filter(cls.user_id.in_(list(user_ids)))
+        rows = query.order_by(cls.id.asc()).limit(batch_size).with_for_update(skip_locked=True).all()
+        if not rows:
+            return {}
+
+        deltas = defaultdict(int)
+        for _, user_id, points in rows:
+            deltas[user_id] += points
+
+        db.session.execute(update(cls).where(cls.id.in_([row.id for row in rows])).values(applied=True),
+                           execution_options={"synchronize_session": False})
+        for user_id, delta in deltas.items():
+            db.session.execute(update(AppUser).where(AppUser.id == user_id).values(total_points=AppUser.total_points + delta),
+                               execution_options={"synchronize_session": False})
+        db.session.expire_all()
+        return dict(deltas)
+
+    @classmethod
+    def sum_by_user(cls, since=None, until=None):
+        """Query (user_id, points) berisi jumlah poin per user dalam rentang waktu created_at [since, until)."""
+        points = func.sum(cls.points).label('points')
+        query = db.session.query(cls.user_id, points)
+        if since is not None:
+            query = query.filter(cls.created_at >= since)
+        if until is not None:
+            query = query.filter(cls.created_at < until)
+        return query.group_by(cls.user_id)
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "points": self.points,
+            "source": self.source.value if self.source else None,
+            "laporan_id": self.laporan_id,
+            "keterangan": self.keterangan,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
+
 # NEW MODEL: PolaMakan
 class PolaMakan(db.Model):
     __tablename__ = 'pola_makan'
@@ -359,13 +967,29 @@ class Badge(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    def award_to_eligible_users(self):
+        """
+        Memberikan badge ini ke semua pasien yang poinnya sudah memenuhi ambang batas dan belum memilikinya
+        (satu query + satu insert massal). Menjaga invarian bahwa pasien memiliki semua badge
+        dengan ambang batas <= total poinnya. Mengembalikan daftar ID user penerima. Tidak melakukan commit.
+        """
+        sudah_punya = db.session.query(UserBadge.id).filter(UserBadge.user_id == AppUser.id, UserBadge.badge_id == self.id).exists()
+        user_ids = [user_id for (user_id,) in db.session.query(AppUser.id).filter(
+            AppUser.role == 'pasien',
+            AppUser.total_points >= self.point_threshold,
+            ~sudah_punya
+        ).all()]
+        if user_ids:
+            db.session.execute(insert(UserBadge), [{"user_id": user_id, "badge_id": self.id} for user_id in user_ids])
+        return user_ids
+
     def serialize(self):
         return {
             "id": self.id,
             "name": self.name,
             "description": self.description,
             "point_threshold": self.point_threshold,
-            "image_url": get_blob_url(self.filename_image), # Menggunakan helper Azure Anda
+            "image_url": url_file(self.filename_image),
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
@@ -391,3 +1015,256 @@ class UserBadge(db.Model):
             "badge_info": self.badge.serialize() if self.badge else None,
             "awarded_at": self.awarded_at.isoformat() if self.awarded_at else None
         }
+
+# NEW MODEL: IdempotencyKey
+# Menyimpan respons dari permintaan yang dikirim dengan header Idempotency-Key, sehingga pengiriman
+# ulang (retry dari jaringan yang tidak stabil) dijawab dari respons tersimpan tanpa menjalankan ulang transaksi.
+# Baris dengan status_code NULL berarti permintaan pertama masih diproses. Baris kedaluwarsa
+# dibersihkan dengan `flask purge-idempotency-keys`. Lihat utils/idempotency.py.
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('app_users.id', ondelete='CASCADE'), nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False) # SHA-256 body permintaan
+    status_code = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    locked_until = db.Column(db.DateTime, nullable=True) # Batas lease pemrosesan selama status_code masih NULL
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'endpoint', 'key', name='_idempotency_user_endpoint_key_uc'),)
+
+    @classmethod
+    def cari(cls, user_id, endpoint, key):
+        return cls.query.filter_by(user_id=user_id, endpoint=endpoint, key=key).first()
+
+    @classmethod
+    def ambil_alih(cls, entry_id, sekarang, locked_until):
+        """
+        Mengambil alih key yang ditinggalkan (status_code NULL dan lease sudah lewat, mis. worker mati
+        sebelum menyimpan respons). UPDATE bersyarat agar hanya satu permintaan ulang yang berhasil.
+        Tidak melakukan commit. Mengembalikan True jika berhasil.
+        """
+        jumlah = cls.query.filter(cls.id == entry_id, cls.status_code.is_(None),
+                                  db.or_(cls.locked_until.is_(None), cls.locked_until <= sekarang))\
+            .update({cls.locked_until: locked_until}, synchronize_session=False)
+        return jumlah == 1
+
+    @classmethod
+    def hapus_kedaluwarsa(cls, sekarang=None):
+        """Menghapus semua baris yang sudah kedaluwarsa (tidak melakukan commit). Mengembalikan jumlah baris."""
+        sekarang = sekarang or datetime.utcnow()
+        return cls.query.filter(cls.expires_at <= sekarang).delete(synchronize_session=False)
+
+# NEW MODEL: OutboxEvent
+# Event domain (laporan_submitted, badge_awarded, user_registered) yang ditulis dalam transaksi yang sama
+# dengan perubahan datanya, lalu diproses di luar request oleh `flask worker` (lihat utils/outbox.py).
+class OutboxEvent(db.Model):
+    __tablename__ = 'outbox_events'
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False, index=True)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.Enum(OutboxStatus), nullable=False, default=OutboxStatus.PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Waktu paling awal event boleh diproses (backoff retry)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_outbox_events_status_available', 'status', 'available_at'),)
+
+    @classmethod
+    def catat(cls, event_type, payload):
+        """Menambahkan event ke sesi aktif; ikut tersimpan saat transaksi pemanggil di-commit."""
+        event = cls(event_type=event_type, payload=payload)
+        db.session.add(event)
+        return event
+
+    @classmethod
+    def ambil_batch(cls, batch_size=100, sekarang=None):
+        """Mengunci event pending yang sudah boleh diproses (SKIP LOCKED agar beberapa worker bisa berjalan)."""
+        sekarang = sekarang or datetime.utcnow()
+        return cls.query.filter(cls.status == OutboxStatus.PENDING, cls.available_at <= sekarang)\
+            .order_by(cls.id.asc()).limit(batch_size).with_for_update(skip_locked=True).all()
+
+    @classmethod
+    def klaim_batch(cls, batch_size=100, lease_detik=300):
+        """
+        Mengklaim event pending lalu commit: available_at dimajukan sebesar lease_detik sehingga worker lain
+        tidak mengambilnya selama diproses, dan event kembali diproses jika worker mati sebelum selesai.
+        Mengembalikan daftar ID event.
+        """
+        sekarang = datetime.utcnow()
+        events = cls.ambil_batch(batch_size, sekarang)
+        for event in events:
+            event.available_at = sekarang + timedelta(seconds=lease_detik)
+        ids = [event.id for event in events]
+        db.session.commit()
+        return ids
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "event_type": self.event_type,
+            "payload": self.payload,
+            "status": self.status.value if self.status else None,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "processed_at": self.processed_at.isoformat() if self.processed_at else None
+        }
+
+# NEW MODEL: PendingMedia
+# Tiket unggah langsung ke storage: dibuat saat URL unggah bertanda tangan diterbitkan, lalu
+# difinalisasi ketika blob dilampirkan ke Gerakan, PatientProfile, atau Badge (lihat utils/direct_upload.py).
+class PendingMedia(db.Model):
+    __tablename__ = 'pending_media'
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.String(32), unique=True, nullable=False) # ID opaque untuk klien
+    user_id = db.Column(db.Integer, db.ForeignKey('app_users.id', ondelete='CASCADE'), nullable=False)
+    target = db.Column(db.String(30), nullable=False) # Kunci TARGET_UNGGAH, mis. 'gerakan_video'
+    target_id = db.Column(db.Integer, nullable=False)
+    storage = db.Column(db.String(10), nullable=False) # 'azure', 'gcs', 'lokal', atau 'memori'
+    blob_name = db.Column(db.String(255), nullable=False) # Nilai yang disimpan di kolom target (URI gs:// untuk GCS)
+    content_type = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    finalized_at = db.Column(db.DateTime, nullable=True)
+
+    @classmethod
+    def kedaluwarsa(cls, sekarang=None):
+        """Tiket yang sudah lewat masa berlakunya (baik yang sudah maupun belum difinalisasi)."""
+        sekarang = sekarang or datetime.utcnow()
+        return cls.query.filter(cls.expires_at <= sekarang).all()
+
+    def serialize(self):
+        return {
+            "upload_id": self.upload_id,
+            "target": self.target,
+            "target_id": self.target_id,
+            "content_type": self.content_type,
+            "expires_at": self.expires_at.isoformat() if self.expires_at else None,
+            "finalized_at": self.finalized_at.isoformat() if self.finalized_at else None
+        }
+
+# NEW MODEL: PendingDeletion
+# Antrean penghapusan file storage. Ditulis dalam transaksi yang sama dengan perubahan yang melepas referensi
+# file (ganti/hapus media gerakan, badge, foto profil), lalu dihapus per batch oleh `flask worker`
+# (lihat utils/storage_deletion.py). Baris dihapus setelah file terhapus dari storage.
+class PendingDeletion(db.Model):
+    __tablename__ = 'pending_deletions'
+    id = db.Column(db.Integer, primary_key=True)
+    ref = db.Column(db.String(255), nullable=False, index=True) # Nilai kolom media (nama blob / URI gs://)
+    jenis = db.Column(db.String(10), nullable=False) # JENIS_MEDIA atau JENIS_MODEL (utils/storage_backend.py)
+    status = db.Column(db.Enum(DeletionStatus), nullable=False, default=DeletionStatus.PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Waktu paling awal boleh dicoba (backoff retry)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_pending_deletions_status_available', 'status', 'available_at'),)
+
+    @classmethod
+    def catat(cls, ref, jenis):
+        """Menambahkan file ke antrean di sesi aktif; ikut tersimpan saat transaksi pemanggil di-commit."""
+        if not ref:
+            return None
+        deletion = cls(ref=ref, jenis=jenis)
+        db.session.add(deletion)
+        return deletion
+
+    @classmethod
+    def ambil_batch(cls, batch_size=100, sekarang=None):
+        """Mengunci penghapusan pending yang sudah boleh dicoba (SKIP LOCKED agar beberapa worker bisa berjalan)."""
+        sekarang = sekarang or datetime.utcnow()
+        return cls.query.filter(cls.status == DeletionStatus.PENDING, cls.available_at <= sekarang)\
+            .order_by(cls.id.asc()).limit(batch_size).with_for_update(skip_locked=True).all()
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "ref": self.ref,
+            "jenis": self.jenis,
+            "status": self.status.value if self.status else None,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "available_at": self.available_at.isoformat() if self.available_at else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
+
+# NEW MODEL: MediaBlob
+# Tabel content-addressed untuk deduplikasi media: satu baris per isi file (SHA-256) per jenis storage, dengan
+# jumlah referensi dari kolom media (Gerakan, Badge, PatientProfile). Unggahan dengan isi yang sudah ada
+# memakai blob yang sama tanpa diunggah ulang; file baru dihapus dari storage saat referensi terakhir dilepas.
+# File yang tidak tercatat di sini (data lama, unggah langsung) dianggap dimiliki satu referensi saja.
+class MediaBlob(db.Model):
+    __tablename__ = 'media_blobs'
+    id = db.Column(db.Integer, primary_key=True)
+    jenis = db.Column(db.String(10), nullable=False) # JENIS_MEDIA atau JENIS_MODEL (utils/storage_backend.py)
+    content_hash = db.Column(db.String(64), nullable=False) # SHA-256 hex dari isi file
+    ref = db.Column(db.String(255), unique=True, nullable=False) # Nilai yang disimpan di kolom media
+    ukuran = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('jenis', 'content_hash', name='uq_media_blobs_jenis_hash'),)
+
+    @classmethod
+    def cari(cls, jenis, content_hash, lock=False):
+        query = cls.query.filter_by(jenis=jenis, content_hash=content_hash)
+        if lock:
+            query = query.with_for_update()
+        return query.first()
+
+    @classmethod
+    def pakai(cls, hasil):
+        """
+        Menambah satu referensi untuk hasil unggah_dedup (utils/media_dedup.py) di transaksi aktif dan
+        mengembalikan ref yang harus disimpan. Jika unggahan paralel dengan isi yang sama sudah lebih dulu
+        terdaftar, ref miliknya yang dipakai dan salinan ini masuk antrean penghapusan.
+        """
+        blob = cls.cari(hasil.jenis, hasil.content_hash, lock=True)
+        if blob is None:
+            if not hasil.baru:
+                # Blob yang akan dipakai ulang baru saja dilepas referensi terakhirnya
+                raise LookupError(f"Blob {hasil.ref} sudah dilepas, unggah ulang file")
+            try:
+                with db.session.begin_nested():
+                    blob = cls(jenis=hasil.jenis, content_hash=hasil.content_hash, ref=hasil.ref, ukuran=hasil.ukuran,
+                               content_type=hasil.content_type, refcount=1)
+                    db.session.add(blob)
+                return blob.ref
+            except IntegrityError:
+                blob = cls.cari(hasil.jenis, hasil.content_hash, lock=True)
+        if hasil.baru and blob.ref != hasil.ref:
+            PendingDeletion.catat(hasil.ref, hasil.jenis)
+        blob.refcount += 1
+        return blob.ref
+
+    @classmethod
+    def lepas(cls, ref, jenis):
+        """
+        Melepas satu referensi ke `ref` di transaksi aktif. File masuk antrean penghapusan storage hanya jika
+        ini referensi terakhir (atau file tidak tercatat di media_blobs).
+        """
+        if not ref:
+            return
+        blob = cls.query.filter_by(ref=ref).with_for_update().first()
+        if blob is not None:
+            blob.refcount -= 1
+            if blob.refcount > 0:
+                return
+            db.session.delete(blob)
+        PendingDeletion.catat(ref, jenis)
+
+    def serialize(self):
+        return {
+            "content_hash": self.content_hash,
+            "ref": self.ref,
+            "ukuran": self.ukuran,
+            "content_type": self.content_type,
+            "refcount": self.refcount
+        }
@@ -1,21 +1,43 @@
 # BE-RESTRO/routes/auth_routes.py
 # PERUBAHAN FIREBASE: Menambahkan pembuatan/pengambilan pengguna Firebase dan token kustom
 # saat login terapis dan pasien. Menambahkan endpoint untuk mendapatkan konfigurasi Firebase client-side.
+# PERUBAHAN PERFORMA: Pembuatan user Firebase saat registrasi dipindah ke outbox (event user_registered, diproses `flask worker`);
+# login hanya menandatangani custom token (tanpa panggilan jaringan ke Firebase).
 
 from flask import Blueprint, request, jsonify, current_app
-from models import AppUser, PatientProfile, db
+from models import AppUser, PatientProfile, OutboxEvent, db
 from app import bcrypt # Import bcrypt dari app.py
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from datetime import timedelta 
+from utils.leaderboard import leaderboard
 
 # Import firebase_admin dan auth dari app.py setelah diinisialisasi
 # Asumsi inisialisasi di app.py sudah global
 from app import firebase_admin_initialized, FIREBASE_CLIENT_CONFIG
 from firebase_admin import auth
-from firebase_admin.auth import UserNotFoundError
+from utils.outbox import EVENT_USER_REGISTERED
 
 auth_bp = Blueprint('auth_bp', __name__)
 
+def _catat_user_registered(user):
+    """Event untuk provisioning user Firebase (UID = ID user di DB utama) oleh worker outbox."""
+    OutboxEvent.catat(EVENT_USER_REGISTERED, {"user_id": user.id, "role": user.role,
+                                              "nama_lengkap": user.nama_lengkap, "email": user.email})
+
+def _buat_firebase_custom_token(user):
+    """
+    Custom token ditandatangani secara lokal dengan kredensial service account (tanpa request ke Firebase).
+    User Firebase sendiri dibuat oleh worker outbox dari event user_registered.
+    """
+    if not firebase_admin_initialized:
+        return None
+    try:
+        return auth.create_custom_token(str(user.id)).decode('utf-8')
+    except Exception as e:
+        # Log error tapi jangan menghentikan proses login utama
+        current_app.logger.error(f"ERROR_FIREBASE_LOGIN: Failed to create custom token for {user.role} {user.id}: {e}")
+        return None
+
 @auth_bp.route('/terapis/register', methods=['POST'])
 def register_terapis():
     data = request.get_json()
@@ -45,22 +67,10 @@ def register_terapis():
 
     try:
         db.session.add(new_terapis)
+        db.session.flush()
+        # Firebase User Provisioning dijalankan worker outbox setelah commit
+        _catat_user_registered(new_terapis)
         db.session.commit()
-        
-        # --- Firebase User Provisioning for Terapis (saat register) ---
-        if firebase_admin_initialized:
-            try:
-                # Membuat user Firebase dengan UID yang sama dengan ID user di DB utama
-                firebase_user = auth.create_user(
-                    uid=str(new_terapis.id),
-                    display_name=new_terapis.nama_lengkap,
-                    email=new_terapis.email
-                )
-                print(f"Firebase user created successfully for terapis ID: {new_terapis.id}")
-            except Exception as e:
-                # Log error, tapi jangan menghentikan registrasi utama jika Firebase gagal
-                print(f"WARNING: Failed to create Firebase user for new terapis {new_terapis.id}: {str(e)}")
-        # --- End Firebase User Provisioning ---
 
         return jsonify({"msg": "Registrasi terapis berhasil", "user": new_terapis.serialize_basic()}), 201
     except Exception as e:
@@ -91,21 +101,7 @@ def login_terapis():
             expires_delta=expires
         )
         
-        firebase_custom_token = None
-        if firebase_admin_initialized:
-            try:
-                # Dapatkan atau buat user Firebase
-                uid_str = str(user.id)
-                try:
-                    firebase_user = auth.get_user(uid_str)
-                except UserNotFoundError:
-                    firebase_user = auth.create_user(uid=uid_str, display_name=user.nama_lengkap, email=user.email)
-                
-                # Buat custom token
-                firebase_custom_token = auth.create_custom_token(firebase_user.uid).decode('utf-8')
-            except Exception as e:
-                print(f"ERROR_FIREBASE_LOGIN: Failed to handle Firebase user or custom token for terapis {user.id}: {e}")
-                # Log error tapi jangan menghentikan proses login utama
+        firebase_custom_token = _buat_firebase_custom_token(user)
         
         response_payload = {
             "access_token": access_token,
@@ -159,23 +155,13 @@ def register_pasien():
     try:
         db.session.add(new_pasien_user)
         db.session.add(new_patient_profile)
+        db.session.flush()
+        # Firebase User Provisioning dijalankan worker outbox setelah commit
+        _catat_user_registered(new_pasien_user)
         db.session.commit()
         
         user_data = new_pasien_user.serialize_basic()
-        
-        # --- Firebase User Provisioning for Pasien (saat register) ---
-        if firebase_admin_initialized:
-            try:
-                # Membuat user Firebase dengan UID yang sama dengan ID user di DB utama
-                firebase_user = auth.create_user(
-                    uid=str(new_pasien_user.id),
-                    display_name=new_pasien_user.nama_lengkap,
-                    email=new_pasien_user.email
-                )
-                print(f"Firebase user created successfully for pasien ID: {new_pasien_user.id}")
-            except Exception as e:
-                print(f"WARNING: Failed to create Firebase user for new pasien {new_pasien_user.id}: {str(e)}")
-        # --- End Firebase User Provisioning ---
+        leaderboard.update(new_pasien_user.id, new_pasien_user.total_points)
 
         return jsonify({
             "msg": "Registrasi pasien berhasil", 
@@ -211,21 +197,7 @@ def login_pasien():
             expires_delta=expires
         )
 
-        firebase_custom_token = None
-        if firebase_admin_initialized:
-            try:
-                # Dapatkan atau buat user Firebase
-                uid_str = str(user.id)
-                try:
-                    firebase_user = auth.get_user(uid_str)
-                except UserNotFoundError:
-                    firebase_user = auth.create_user(uid=uid_str, display_name=user.nama_lengkap, email=user.email)
-                
-                # Buat custom token
-                firebase_custom_token = auth.create_custom_token(firebase_user.uid).decode('utf-8')
-            except Exception as e:
-                print(f"ERROR_FIREBASE_LOGIN: Failed to handle Firebase user or custom token for pasien {user.id}: {e}")
-                # Log error tapi jangan menghentikan proses login utama
+        firebase_custom_token = _buat_firebase_custom_token(user)
         
         response_payload = {
             "access_token": access_token,
@@ -2,23 +2,127 @@
 # Modul baru untuk mengelola endpoint gamifikasi (leaderboard dan badge).
 # PERBAIKAN: Mengatasi AttributeError: 'InstrumentedList' object has no attribute 'join'
 # dengan melakukan query pada UserBadge.
+# PERUBAHAN PERFORMA: Badge tertinggi dibaca dari AppUser.highest_badge_id dan dijaga saat badge diubah/dihapus.
+# PERUBAHAN PERFORMA: Leaderboard memakai indeks in-memory (utils/leaderboard.py), endpoint /leaderboard/me, dan paging cursor.
+# PERUBAHAN PERFORMA: Leaderboard periode (minggu/bulan) dihitung dari points_ledger.
+# PERUBAHAN PERFORMA: Leaderboard periode mendukung paging cursor (keyset, utils/pagination.py).
+# PERUBAHAN BARU: Gambar badge lama dicatat di antrean penghapusan storage (PendingDeletion) dalam transaksi yang sama.
+# PERUBAHAN PERFORMA: Gambar badge dideduplikasi berdasarkan hash isi (utils/media_dedup.py, MediaBlob).
 
 from flask import Blueprint, jsonify, request, current_app
-from models import db, AppUser, Badge, UserBadge
+from models import db, AppUser, Badge, UserBadge, PointsLedger, MediaBlob
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import desc, asc
-from utils.azure_helpers import upload_file_to_blob, delete_blob # Untuk upload/hapus gambar badge
+from sqlalchemy.orm import joinedload
+from utils.storage_backend import JENIS_MEDIA
+from utils.media_dedup import unggah_dedup, batalkan # Untuk upload gambar badge (dideduplikasi berdasarkan isi)
+from utils.leaderboard import leaderboard, encode_cursor, decode_cursor, InvalidCursorError
+from utils.badge_catalog import badge_catalog
+from utils.pagination import keyset_paginate
+from datetime import datetime, timedelta
+import math
 import uuid
 
 gamification_bp = Blueprint('gamification_bp', __name__)
 
+LEADERBOARD_PER_PAGE_DEFAULT = 10
+LEADERBOARD_PER_PAGE_MAKS = 100
+
+def _badge_holder_ids(badge_id):
+    """ID user yang memiliki badge tertentu."""
+    return [user_id for (user_id,) in db.session.query(UserBadge.user_id).filter(UserBadge.badge_id == badge_id).all()]
+
 # --- ENDPOINT UNTUK LEADERBOARD ---
+def _serialize_leaderboard_entries(entries):
+    """
+    Melengkapi entri (user_id, total_points, peringkat) dari indeks leaderboard
+    dengan data user dan badge tertinggi dalam satu query.
+    """
+    user_ids = [user_id for user_id, _, _ in entries]
+    users_by_id = {u.id: u for u in AppUser.query.options(joinedload(AppUser.highest_badge)).filter(AppUser.id.in_(user_ids)).all()} if user_ids else {}
+
+    results = []
+    for user_id, total_points, rank in entries:
+        user = users_by_id.get(user_id)
+        if not user:
+            continue
+        results.append({
+            "rank": rank,
+            "user_id": user.id,
+            "username": user.username,
+            "nama_lengkap": user.nama_lengkap,
+            "total_points": total_points,
+            "highest_badge_info": user.highest_badge.serialize() if user.highest_badge else None,
+        })
+    return results
+
+LEADERBOARD_PERIODS = {'week': timedelta(days=7), 'month': timedelta(days=30)}
+
+def _leaderboard_periode(period, page, per_page, cursor=None):
+    """
+    Leaderboard berdasarkan poin yang diperoleh dalam periode tertentu (jendela bergulir),
+    dihitung dari points_ledger dengan satu query agregat per halaman.
+    Dengan `cursor`, halaman diambil secara keyset pada (poin menurun, user_id menaik) tanpa COUNT total.
+    """
+    since = datetime.utcnow() - LEADERBOARD_PERIODS[period]
+    sums = PointsLedger.sum_by_user(since=since).subquery()
+    base_query = db.session.query(sums.c.user_id, sums.c.points)\
+        .join(AppUser, AppUser.id == sums.c.user_id)\
+        .filter(AppUser.role == 'pasien', sums.c.points > 0)
+
+    def peringkat(rows, start=None):
+        # Peringkat kompetisi dalam periode: posisi pertama dengan poin yang sama.
+        # `start` adalah posisi absolut baris pertama (mode offset); pada mode cursor posisi tidak diketahui,
+        # sehingga peringkat nilai poin baru sesudah nilai pertama dihitung dari jumlah baris dengan poin >= nilai pertama.
+        entries = []
+        for position, (user_id, points) in enumerate(rows, start=start or 0):
+            if entries and entries[-1][1] == points:
+                rank = entries[-1][2]
+            elif not entries:
+                rank = base_query.filter(sums.c.points > points).count() + 1
+            elif start is not None:
+                rank = position + 1
+            elif entries[-1][1] == entries[0][1]:
+                rank = base_query.filter(sums.c.points >= entries[0][1]).count() + 1
+            else:
+                rank = entries[-1][2] + sum(1 for entry in entries if entry[1] == entries[-1][1])
+            entries.append((user_id, int(points), rank))
+        return entries
+
+    if cursor is not None:
+        rows, next_cursor = keyset_paginate(base_query, [(sums.c.points, True), (sums.c.user_id, False)],
+                                            cursor, per_page, (int, int))
+        return jsonify({
+            "period": period,
+            "since": since.isoformat(),
+            "leaderboard": _serialize_leaderboard_entries(peringkat(rows)),
+            "next_cursor": next_cursor
+        }), 200
+
+    total_items = base_query.count()
+    rows = base_query.order_by(desc(sums.c.points), asc(sums.c.user_id))\
+        .offset((page - 1) * per_page).limit(per_page).all()
+    entries = peringkat(rows, start=(page - 1) * per_page)
+
+    return jsonify({
+        "period": period,
+        "since": since.isoformat(),
+        "leaderboard": _serialize_leaderboard_entries(entries),
+        "total_items": total_items,
+        "total_pages": math.ceil(total_items / per_page),
+        "current_page": page
+    }), 200
+
 @gamification_bp.route('/leaderboard', methods=['GET'])
 @jwt_required()
 def get_leaderboard():
     """
     Endpoint untuk mendapatkan leaderboard pasien berdasarkan total poin.
     Dapat diakses oleh terapis dan pasien.
+    Urutan dan peringkat diambil dari indeks leaderboard in-memory (O(log n) per halaman).
+    Jika query param `cursor` dikirim (boleh kosong untuk halaman pertama), paging berbasis cursor
+    digunakan dan respons berisi `next_cursor` alih-alih total halaman.
+    Query param `period` (week|month) menampilkan peringkat poin yang diperoleh dalam periode tersebut.
     """
     current_user_identity = get_jwt_identity()
     # Anda bisa menambahkan otorisasi di sini jika hanya role tertentu yang boleh melihat
@@ -26,36 +130,82 @@ def get_leaderboard():
     #     return jsonify({"msg": "Akses ditolak"}), 403
 
     page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int) # Default 10 top users
+    per_page = request.args.get('per_page', LEADERBOARD_PER_PAGE_DEFAULT, type=int)
+    cursor = request.args.get('cursor')
+    if page < 1:
+        page = 1
+    per_page = min(max(per_page, 1), LEADERBOARD_PER_PAGE_MAKS)
+
+    period = request.args.get('period')
+    if period:
+        if period not in LEADERBOARD_PERIODS:
+            return jsonify({"msg": "period harus salah satu dari: week, month"}), 400
+        try:
+            return _leaderboard_periode(period, page, per_page, cursor)
+        except InvalidCursorError as e:
+            return jsonify({"msg": str(e)}), 400
 
-    # Mengambil pasien dengan role 'pasien' dan mengurutkan berdasarkan total_points
-    paginated_leaderboard = AppUser.query.filter_by(role='pasien') \
-                                        .order_by(desc(AppUser.total_points)) \
-                                        .paginate(page=page, per_page=per_page, error_out=False)
+    if cursor is not None:
+        try:
+            start = leaderboard.position_after(*decode_cursor(cursor)) if cursor else 0
+        except InvalidCursorError as e:
+            return jsonify({"msg": str(e)}), 400
 
-    results = []
-    for user in paginated_leaderboard.items:
-        # PERBAIKAN: Mengambil badge tertinggi yang dimiliki user.
-        # Kita perlu query dari UserBadge, join ke Badge, lalu filter berdasarkan user.id
-        highest_badge_entry = UserBadge.query.filter_by(user_id=user.id)\
-                                             .join(Badge)\
-                                             .order_by(desc(Badge.point_threshold))\
-                                             .first()
+        entries = leaderboard.slice(start, start + per_page + 1)
+        has_more = len(entries) > per_page
+        entries = entries[:per_page]
+        next_cursor = encode_cursor(entries[-1][1], entries[-1][0]) if has_more else None
 
-        results.append({
-            "user_id": user.id,
-            "username": user.username,
-            "nama_lengkap": user.nama_lengkap,
-            "total_points": user.total_points,
-            # Pastikan highest_badge_entry dan highest_badge_entry.badge ada sebelum diserialisasi
-            "highest_badge_info": highest_badge_entry.badge.serialize() if highest_badge_entry and highest_badge_entry.badge else None,
-        })
+        return jsonify({
+            "leaderboard": _serialize_leaderboard_entries(entries),
+            "next_cursor": next_cursor
+        }), 200
+
+    start = (page - 1) * per_page
+    total_items = leaderboard.total()
+    entries = leaderboard.slice(start, start + per_page)
+
+    return jsonify({
+        "leaderboard": _serialize_leaderboard_entries(entries),
+        "total_items": total_items,
+        "total_pages": math.ceil(total_items / per_page),
+        "current_page": page
+    }), 200
+
+@gamification_bp.route('/leaderboard/me', methods=['GET'])
+@jwt_required()
+def get_my_leaderboard_rank():
+    """
+    Endpoint untuk pasien melihat peringkatnya di leaderboard beserta pasien di sekitarnya.
+    Query param `neighbours` (default 2, maks 10) menentukan jumlah tetangga di atas dan di bawah.
+    """
+    current_user_identity = get_jwt_identity()
+    if current_user_identity.get('role') != 'pasien':
+        return jsonify({"msg": "Akses ditolak"}), 403
+
+    user_id = current_user_identity.get('id')
+    neighbours = min(max(request.args.get('neighbours', 2, type=int), 0), 10)
+
+    rank_info = leaderboard.rank_of(user_id)
+    if rank_info is None:
+        # Pasien baru yang belum masuk indeks worker ini
+        user = AppUser.query.filter_by(id=user_id, role='pasien').first_or_404("Pasien tidak ditemukan.")
+        leaderboard.update(user.id, user.total_points)
+        rank_info = leaderboard.rank_of(user_id)
+        if rank_info is None:
+            return jsonify({"msg": "Leaderboard belum tersedia, coba beberapa saat lagi."}), 503
+
+    rank, position, total_points = rank_info
+    entries = _serialize_leaderboard_entries(leaderboard.slice(position - neighbours, position + neighbours + 1))
+    my_index = next((i for i, entry in enumerate(entries) if entry["user_id"] == user_id), None)
+    if my_index is None:
+        return jsonify({"msg": "Pasien tidak ditemukan."}), 404
 
     return jsonify({
-        "leaderboard": results,
-        "total_items": paginated_leaderboard.total,
-        "total_pages": paginated_leaderboard.pages,
-        "current_page": paginated_leaderboard.page
+        "me": entries[my_index],
+        "above": entries[:my_index],
+        "below": entries[my_index + 1:],
+        "total_participants": leaderboard.total()
     }), 200
 
 # --- ENDPOINT UNTUK MANAJEMEN BADGE (OLEH TERAPIS/ADMIN) ---
@@ -90,15 +240,14 @@ def create_badge():
     if Badge.query.filter_by(point_threshold=point_threshold).first():
         return jsonify({"msg": "Ambang batas poin ini sudah digunakan oleh badge lain"}), 409
 
-    filename_image = None
+    hasil_gambar = None
     if badge_image_file:
         try:
-            # Menggunakan helper upload_file_to_blob dari azure_helpers.py
+            # Menggunakan helper unggah_dedup dari media_dedup.py
             # Subfolder: 'badges/'
-            blob_name, err = upload_file_to_blob(badge_image_file, 'badges')
+            hasil_gambar, err = unggah_dedup(badge_image_file, 'badges')
             if err:
                 raise Exception(err)
-            filename_image = blob_name
         except Exception as e:
             current_app.logger.error(f"Gagal upload gambar badge: {str(e)}")
             return jsonify({"msg": "Gagal mengunggah gambar badge", "error": str(e)}), 500
@@ -106,19 +255,23 @@ def create_badge():
     new_badge = Badge(
         name=name,
         description=description,
-        point_threshold=point_threshold,
-        filename_image=filename_image
+        point_threshold=point_threshold
     )
 
     try:
+        if hasil_gambar:
+            new_badge.filename_image = MediaBlob.pakai(hasil_gambar)
         db.session.add(new_badge)
+        db.session.flush()
+        # Berikan langsung ke pasien yang poinnya sudah memenuhi ambang batas
+        AppUser.refresh_highest_badge(new_badge.award_to_eligible_users())
         db.session.commit()
+        badge_catalog.invalidate()
         return jsonify({"msg": "Badge berhasil dibuat", "badge": new_badge.serialize()}), 201
     except Exception as e:
         db.session.rollback()
         # Jika terjadi error setelah DB, hapus file yang mungkin sudah terupload
-        if filename_image:
-            delete_blob(filename_image)
+        batalkan(hasil_gambar)
         current_app.logger.error(f"Gagal membuat badge: {str(e)}")
         return jsonify({"msg": "Gagal membuat badge", "error": str(e)}), 500
 
@@ -153,6 +306,7 @@ def update_badge(badge_id):
         return jsonify({"msg": "Akses ditolak: Hanya terapis yang bisa memperbarui badge"}), 403
 
     badge = Badge.query.get_or_404(badge_id)
+    threshold_changed = False
 
     name = request.form.get('name')
     description = request.form.get('description')
@@ -174,34 +328,45 @@ def update_badge(badge_id):
                 return jsonify({"msg": "Ambang batas poin tidak boleh negatif"}), 400
             if point_threshold != badge.point_threshold and Badge.query.filter_by(point_threshold=point_threshold).first():
                 return jsonify({"msg": "Ambang batas poin ini sudah digunakan oleh badge lain"}), 409
+            threshold_changed = point_threshold != badge.point_threshold
             badge.point_threshold = point_threshold
         except ValueError:
             return jsonify({"msg": "Ambang batas poin harus berupa angka integer"}), 400
 
     old_filename_image = badge.filename_image
+    hasil_gambar = None
     if badge_image_file:
         try:
-            blob_name, err = upload_file_to_blob(badge_image_file, 'badges')
+            hasil_gambar, err = unggah_dedup(badge_image_file, 'badges')
             if err:
                 raise Exception(err)
-            badge.filename_image = blob_name
-            # Hapus gambar lama jika berhasil upload yang baru
-            if old_filename_image:
-                delete_blob(old_filename_image)
+            badge.filename_image = MediaBlob.pakai(hasil_gambar)
+            # Referensi ke gambar lama dilepas, ikut tersimpan bersama perubahan badge
+            MediaBlob.lepas(old_filename_image, JENIS_MEDIA)
         except Exception as e:
+            db.session.rollback()
+            batalkan(hasil_gambar)
             current_app.logger.error(f"Gagal update gambar badge: {str(e)}")
             return jsonify({"msg": "Gagal mengupdate gambar badge", "error": str(e)}), 500
     elif 'image' in request.files and not badge_image_file: # Jika file 'image' dikirim tapi kosong (untuk hapus gambar)
-        if old_filename_image:
-            delete_blob(old_filename_image)
+        MediaBlob.lepas(old_filename_image, JENIS_MEDIA)
         badge.filename_image = None
 
 
     try:
+        if threshold_changed:
+            # Urutan badge berubah: berikan ke pasien yang kini memenuhi ambang batas,
+            # lalu hitung ulang badge tertinggi untuk semua pemilik badge ini
+            db.session.flush()
+            badge.award_to_eligible_users()
+            AppUser.refresh_highest_badge(_badge_holder_ids(badge.id))
         db.session.commit()
+        badge_catalog.invalidate()
         return jsonify({"msg": "Badge berhasil diperbarui", "badge": badge.serialize()}), 200
     except Exception as e:
         db.session.rollback()
+        # Gambar baru belum dirujuk siapa pun, hapus kembali
+        batalkan(hasil_gambar)
         current_app.logger.error(f"Gagal memperbarui badge {badge_id}: {str(e)}")
         return jsonify({"msg": "Gagal memperbarui badge", "error": str(e)}), 500
 
@@ -219,12 +384,17 @@ def delete_badge(badge_id):
     filename_to_delete = badge.filename_image
 
     try:
+        # Hapus kepemilikan badge ini, lalu hitung ulang badge tertinggi para pemiliknya
+        holder_ids = _badge_holder_ids(badge.id)
+        UserBadge.query.filter_by(badge_id=badge.id).delete(synchronize_session=False)
+        AppUser.query.filter_by(highest_badge_id=badge.id).update({AppUser.highest_badge_id: None}, synchronize_session=False)
+        # File gambar dihapus worker dari antrean penghapusan setelah transaksi ini di-commit (jika referensi terakhir)
+        MediaBlob.lepas(filename_to_delete, JENIS_MEDIA)
         db.session.delete(badge)
+        db.session.flush()
+        AppUser.refresh_highest_badge(holder_ids)
         db.session.commit()
-        
-        # Hapus file gambar dari Azure Blob Storage
-        if filename_to_delete:
-            delete_blob(filename_to_delete)
+        badge_catalog.invalidate()
 
         return jsonify({"msg": "Badge berhasil dihapus"}), 200
     except Exception as e:
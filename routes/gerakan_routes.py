@@ -1,16 +1,31 @@
 # BE-RESTRO/routes/gerakan_routes.py
+# PERUBAHAN PERFORMA: Daftar gerakan mendukung sparse fieldset (`fields=`/`include=`) dan memuat pembuat secara eager.
+# PERUBAHAN PERFORMA: Daftar gerakan mendukung paging cursor (keyset) tanpa COUNT(*)/OFFSET.
+# PERUBAHAN PERFORMA: Pencarian gerakan memakai indeks teks (FTS5/tsvector/pg_trgm) dengan peringkat relevansi dan mode prefix.
+# PERUBAHAN PERFORMA: Katalog gerakan memakai cache serialisasi berversi (utils/gerakan_catalog.py), ETag, dan 304 Not Modified.
+# PERUBAHAN PERFORMA: Unggah/hapus media gerakan berjalan paralel di thread pool bersama (utils/media_io.py), durasi di header Server-Timing.
+# PERUBAHAN BARU: Media gerakan disimpan lewat backend storage yang dipilih konfigurasi (utils/storage_backend.py).
+# PERUBAHAN BARU: File lama dicatat di antrean penghapusan (PendingDeletion) dalam transaksi yang sama, dihapus worker per batch.
+# PERUBAHAN PERFORMA: Unggahan dideduplikasi berdasarkan hash isi (utils/media_dedup.py, MediaBlob) dengan reference count.
 
 from flask import Blueprint, request, jsonify, current_app
-from models import db, Gerakan, AppUser
+from models import db, Gerakan, AppUser, MediaBlob
 from flask_jwt_extended import jwt_required, get_jwt_identity
-# Import helper Azure kita
-from utils.azure_helpers import upload_file_to_blob, delete_blob
-# Import helper GCS baru
-from utils.gcs_helpers import upload_file_to_gcs, delete_file_from_gcs, trigger_vertex_ai_training, GCS_DESTINATION_FOLDER_MODELS, GCS_DESTINATION_FOLDER_RAW_VIDEOS
-import uuid # Untuk membuat ID unik
+from utils.fieldsets import fieldset_dari_request
+from utils.pagination import keyset_paginate, keyset_order_by, InvalidCursorError
+from utils.gerakan_search import terapkan_pencarian, MODE_PENUH, MODE_PENCARIAN
+from utils.gerakan_catalog import gerakan_catalog, buat_etag, etag_permintaan, tidak_berubah, respons_304, respons_dengan_etag
+from datetime import datetime
+from utils.gcs_helpers import GCS_DESTINATION_FOLDER_MODELS
+from utils.storage_backend import JENIS_MEDIA, JENIS_MODEL
+from utils.media_dedup import unggah_dedup, batalkan
+from utils.media_io import UnggahanMedia, MediaUploadError, unggah_semua, batalkan_unggahan, pasang_server_timing
 
 gerakan_bp = Blueprint('gerakan_bp', __name__)
 
+# Urutan katalog gerakan (kolom, menurun); id sebagai pemutus seri agar kunci cursor unik
+URUTAN_KATALOG_GERAKAN = [(Gerakan.nama_gerakan, False), (Gerakan.id, False)]
+
 @gerakan_bp.route('', methods=['POST'])
 @jwt_required()
 def create_gerakan():
@@ -26,74 +41,54 @@ def create_gerakan():
 
     foto_file = request.files.get('foto')
     video_file = request.files.get('video')
-    model_file = request.files.get('model_tflite') # Ini akan diunggah ke GCS
+    model_file = request.files.get('model_tflite') # Ini akan diunggah ke GCS (mode cloud)
+
+    # Foto/video (Azure) dan model .tflite (GCS) diunggah paralel di pool media bersama;
+    # file yang isinya sudah tersimpan tidak diunggah ulang (utils/media_dedup.py)
+    unggahan = {}
+    if foto_file:
+        unggahan['foto'] = UnggahanMedia((unggah_dedup, foto_file, 'gerakan/foto'), batalkan)
+    if video_file:
+        unggahan['video'] = UnggahanMedia((unggah_dedup, video_file, 'gerakan/video'), batalkan)
+    if model_file:
+        # Nama unik model_<uuid>.<ext> di folder model
+        unggahan['model_tflite'] = UnggahanMedia(
+            (unggah_dedup, model_file, GCS_DESTINATION_FOLDER_MODELS, JENIS_MODEL, 'model_', 'application/octet-stream'), batalkan)
+
+    # Pemicu Vertex AI training (opsional, tergantung implementasi) dapat ditambahkan setelah model
+    # dan video training diunggah ke GCS (GCS_DESTINATION_FOLDER_RAW_VIDEOS), lihat trigger_vertex_ai_training.
 
-    blob_name_foto, blob_name_video, gcs_uri_model = None, None, None
-    
     try:
-        # Upload foto dan video ke Azure Blob Storage
-        if foto_file:
-            blob_name_foto, err_foto = upload_file_to_blob(foto_file, 'gerakan/foto')
-            if err_foto: raise Exception(f"Upload foto gagal: {err_foto}")
-        
-        if video_file:
-            blob_name_video, err_video = upload_file_to_blob(video_file, 'gerakan/video')
-            if err_video: raise Exception(f"Upload video gagal: {err_video}")
-
-        # Upload model .tflite ke Google Cloud Storage
-        if model_file:
-            # Buat nama blob unik untuk model di GCS
-            model_extension = model_file.filename.rsplit('.', 1)[1].lower()
-            unique_model_filename = f"model_{uuid.uuid4().hex}.{model_extension}"
-            gcs_destination_blob_name = f"{GCS_DESTINATION_FOLDER_MODELS}{unique_model_filename}"
-            
-            gcs_uri_model, err_model = upload_file_to_gcs(model_file, gcs_destination_blob_name, content_type='application/octet-stream')
-            if err_model: raise Exception(f"Upload model TFLite gagal: {err_model}")
-
-            # Pemicu Vertex AI training (opsional, tergantung implementasi)
-            # Anda perlu mengisi project_id dan location yang sesuai
-            project_id = os.getenv("GOOGLE_CLOUD_PROJECT_ID", "restro-462703") # Ganti dengan ID project Anda
-            location = os.getenv("VERTEX_AI_LOCATION", "asia-southeast2") # Ganti dengan region yang sesuai
-            
-            # Jika video_file juga diunggah ke GCS untuk training Vertex AI
-            # Anda bisa memicu training di sini
-            # if video_file:
-            #     # Pastikan video diunggah ke folder raw_videos di GCS untuk training
-            #     video_extension = video_file.filename.rsplit('.', 1)[1].lower()
-            #     unique_video_filename_for_training = f"video_{uuid.uuid4().hex}.{video_extension}"
-            #     gcs_training_video_blob_name = f"{GCS_DESTINATION_FOLDER_RAW_VIDEOS}{unique_video_filename_for_training}"
-            #     
-            #     # Reset stream pointer for video_file if it was read previously
-            #     video_file.seek(0) 
-            #     gcs_video_training_uri, err_video_training = upload_file_to_gcs(video_file, gcs_training_video_blob_name, content_type=video_file.content_type)
-            #     if err_video_training:
-            #         current_app.logger.error(f"Gagal upload video untuk training Vertex AI: {err_video_training}")
-            #         # Lanjutkan saja, atau berikan error jika training mutlak dibutuhkan
-            #     else:
-            #         trigger_vertex_ai_training(gcs_video_training_uri, str(uuid.uuid4()), nama_gerakan, project_id, location)
-
+        hasil_unggah = unggah_semua(unggahan)
+    except MediaUploadError as e:
+        current_app.logger.error(f"Gagal membuat gerakan: {str(e)}")
+        return pasang_server_timing(jsonify({"msg": "Gagal membuat gerakan", "error": str(e)}),
+                                    e.hasil.server_timing('unggah')), 500
 
+    try:
+        # Reference count blob (baru atau dipakai bersama) ikut transaksi yang sama
+        refs = {nama: MediaBlob.pakai(hasil) for nama, hasil in hasil_unggah.nilai.items()}
         # Buat entitas di database
         new_gerakan = Gerakan(
             nama_gerakan=nama_gerakan,
             deskripsi=deskripsi,
-            blob_name_foto=blob_name_foto,
-            blob_name_video=blob_name_video,
-            gcs_uri_model_tflite=gcs_uri_model, # Simpan URI GCS di sini
+            blob_name_foto=refs.get('foto'),
+            blob_name_video=refs.get('video'),
+            gcs_uri_model_tflite=refs.get('model_tflite'), # Simpan URI GCS di sini
             created_by_terapis_id=current_user_identity.get('id')
         )
 
         db.session.add(new_gerakan)
         db.session.commit()
+        gerakan_catalog.invalidate()
         
-        return jsonify({"msg": "Gerakan berhasil dibuat", "gerakan": new_gerakan.serialize_full()}), 201
+        return pasang_server_timing(jsonify({"msg": "Gerakan berhasil dibuat", "gerakan": new_gerakan.serialize_full()}),
+                                    hasil_unggah.server_timing('unggah')), 201
 
     except Exception as e:
         db.session.rollback()
-        # Jika terjadi error, hapus semua file yang mungkin sudah terupload
-        if blob_name_foto: delete_blob(blob_name_foto)
-        if blob_name_video: delete_blob(blob_name_video)
-        if gcs_uri_model: delete_file_from_gcs(gcs_uri_model.split('/')[-1]) # Hanya kirim nama blob ke GCS helper
+        # Jika terjadi error, hapus semua file yang sudah terupload
+        batalkan_unggahan(unggahan, hasil_unggah)
         
         current_app.logger.error(f"Gagal membuat gerakan: {str(e)}")
         return jsonify({"msg": "Gagal membuat gerakan", "error": str(e)}), 500
@@ -104,24 +99,50 @@ def get_all_gerakan():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
     search_term = request.args.get('search', None, type=str)
+    search_mode = request.args.get('search_mode', MODE_PENUH)
+    if search_mode not in MODE_PENCARIAN:
+        return jsonify({"msg": f"search_mode harus salah satu dari: {', '.join(MODE_PENCARIAN)}"}), 400
+    try:
+        fieldset = fieldset_dari_request(Gerakan.FIELDSET_SPEC)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    # Revalidasi klien: jika katalog belum berubah sejak respons sebelumnya, cukup 304 tanpa query halaman
+    version = gerakan_catalog.version()
+    etag = etag_permintaan(version)
+    if tidak_berubah(etag):
+        return respons_304(etag)
 
     query = Gerakan.query
+    cursor = request.args.get('cursor')
     if search_term:
-        query = query.filter(Gerakan.nama_gerakan.ilike(f"%{search_term}%"))
+        # Mode cursor tetap berurutan nama_gerakan, id (kunci keyset); mode halaman diurutkan berdasarkan relevansi
+        query = terapkan_pencarian(query, search_term, search_mode, urutkan=cursor is None)
     
-    paginated = query.order_by(Gerakan.nama_gerakan.asc()).paginate(page=page, per_page=per_page, error_out=False)
-    results = [g.serialize_full() for g in paginated.items]
+    if cursor is not None:
+        # Paging keyset: tanpa COUNT(*) dan OFFSET
+        try:
+            items, next_cursor = keyset_paginate(query, URUTAN_KATALOG_GERAKAN, cursor, per_page, (str, int))
+        except InvalidCursorError as e:
+            return jsonify({"msg": str(e)}), 400
+        return respons_dengan_etag(jsonify({"gerakan": gerakan_catalog.serialize(items, version, fieldset), "next_cursor": next_cursor}), etag)
+
+    paginated = query.order_by(*keyset_order_by(URUTAN_KATALOG_GERAKAN)).paginate(page=page, per_page=per_page, error_out=False)
+    results = gerakan_catalog.serialize(paginated.items, version, fieldset)
     
-    return jsonify({
+    return respons_dengan_etag(jsonify({
         "gerakan": results, "total_items": paginated.total,
         "total_pages": paginated.pages, "current_page": paginated.page
-    })
+    }), etag)
 
 @gerakan_bp.route('/<int:gerakan_id>', methods=['GET'])
 @jwt_required()
 def get_gerakan_by_id(gerakan_id):
     gerakan = Gerakan.query.get_or_404(gerakan_id)
-    return jsonify(gerakan.serialize_full())
+    etag = buat_etag('gerakan', gerakan.id, gerakan.updated_at)
+    if tidak_berubah(etag):
+        return respons_304(etag)
+    return respons_dengan_etag(jsonify(gerakan_catalog.serialize([gerakan], gerakan_catalog.version())[0]), etag)
 
 @gerakan_bp.route('/<int:gerakan_id>', methods=['PUT'])
 @jwt_required()
@@ -135,48 +156,51 @@ def update_gerakan(gerakan_id):
     gerakan.nama_gerakan = request.form.get('nama_gerakan', gerakan.nama_gerakan)
     gerakan.deskripsi = request.form.get('deskripsi', gerakan.deskripsi)
 
-    # Dictionary untuk memproses file: (file_key_in_request, blob_attribute_in_model, subfolder_for_azure/gcs_folder, is_gcs_file)
+    # Dictionary untuk memproses file: (file_key_in_request, blob_attribute_in_model, subfolder, is_model_file)
     files_to_process = {
         'foto': ('blob_name_foto', 'gerakan/foto', False), # Azure
         'video': ('blob_name_video', 'gerakan/video', False), # Azure
         'model_tflite': ('gcs_uri_model_tflite', GCS_DESTINATION_FOLDER_MODELS, True) # GCS
     }
 
+    unggahan = {}
+    for file_key, (blob_attr, storage_path, is_model_file) in files_to_process.items():
+        if file_key in request.files:
+            file_storage = request.files[file_key]
+            if is_model_file:
+                unggahan[file_key] = UnggahanMedia(
+                    (unggah_dedup, file_storage, storage_path, JENIS_MODEL, 'model_', 'application/octet-stream'), batalkan)
+            else:
+                unggahan[file_key] = UnggahanMedia((unggah_dedup, file_storage, storage_path, JENIS_MEDIA), batalkan)
+
     try:
-        for file_key, (blob_attr, storage_path, is_gcs_file) in files_to_process.items():
-            if file_key in request.files:
-                file_storage = request.files[file_key]
-                new_blob_name_or_uri = None
-                err = None
-
-                if is_gcs_file:
-                    model_extension = file_storage.filename.rsplit('.', 1)[1].lower()
-                    unique_model_filename = f"model_{uuid.uuid4().hex}.{model_extension}"
-                    gcs_destination_blob_name = f"{storage_path}{unique_model_filename}"
-                    new_blob_name_or_uri, err = upload_file_to_gcs(file_storage, gcs_destination_blob_name, content_type='application/octet-stream')
-                else: # Azure Blob
-                    new_blob_name_or_uri, err = upload_file_to_blob(file_storage, storage_path)
-                
-                if err:
-                    raise Exception(f"Gagal upload {file_key}: {err}")
-                
-                # Hapus blob lama jika ada
-                old_blob_value = getattr(gerakan, blob_attr)
-                if old_blob_value:
-                    if is_gcs_file:
-                        delete_file_from_gcs(old_blob_value.split('/')[-1]) # Hanya kirim nama blob GCS
-                    else:
-                        delete_blob(old_blob_value) # Azure
-                
-                # Set atribut dengan nama blob/uri baru
-                setattr(gerakan, blob_attr, new_blob_name_or_uri)
+        hasil_unggah = unggah_semua(unggahan)
+    except MediaUploadError as e:
+        db.session.rollback()
+        current_app.logger.error(f"Gagal update gerakan {gerakan_id}: {str(e)}")
+        return pasang_server_timing(jsonify({"msg": "Gagal mengupdate gerakan", "error": str(e)}),
+                                    e.hasil.server_timing('unggah')), 500
+
+    # Referensi ke blob lama dilepas dalam transaksi yang sama (masuk antrean penghapusan jika referensi terakhir);
+    # rollback tidak menghapus blob yang masih dirujuk
+    try:
+        for file_key, hasil in hasil_unggah.nilai.items():
+            blob_attr, _, is_model_file = files_to_process[file_key]
+            # Tambah referensi baru dulu, agar mengunggah ulang isi yang sama tidak melepas blob yang sedang dipakai
+            new_blob_name_or_uri = MediaBlob.pakai(hasil)
+            MediaBlob.lepas(getattr(gerakan, blob_attr), JENIS_MODEL if is_model_file else JENIS_MEDIA)
+            # Set atribut dengan nama blob/uri baru
+            setattr(gerakan, blob_attr, new_blob_name_or_uri)
         
-        gerakan.updated_at = db.func.now()
+        gerakan.updated_at = datetime.utcnow() # Jam yang sama dengan default kolom, agar versi katalog (max updated_at) selalu naik
         db.session.commit()
-        return jsonify({"msg": "Gerakan berhasil diupdate", "gerakan": gerakan.serialize_full()}), 200
+        gerakan_catalog.invalidate()
+        return pasang_server_timing(jsonify({"msg": "Gerakan berhasil diupdate", "gerakan": gerakan.serialize_full()}),
+                                    hasil_unggah.server_timing('unggah')), 200
 
     except Exception as e:
         db.session.rollback()
+        batalkan_unggahan(unggahan, hasil_unggah)
         current_app.logger.error(f"Gagal update gerakan {gerakan_id}: {str(e)}")
         return jsonify({"msg": "Gagal mengupdate gerakan", "error": str(e)}), 500
 
@@ -189,20 +213,15 @@ def delete_gerakan(gerakan_id):
 
     gerakan = Gerakan.query.get_or_404(gerakan_id)
 
-    # Simpan nama blob/URI sebelum object dihapus dari session
-    blob_foto = gerakan.blob_name_foto
-    blob_video = gerakan.blob_name_video
-    gcs_uri_model = gerakan.gcs_uri_model_tflite # Ambil URI GCS
-
     try:
+        # File gerakan dihapus worker dari antrean penghapusan setelah transaksi ini di-commit,
+        # kecuali masih dirujuk data lain dengan isi yang sama
+        MediaBlob.lepas(gerakan.blob_name_foto, JENIS_MEDIA)
+        MediaBlob.lepas(gerakan.blob_name_video, JENIS_MEDIA)
+        MediaBlob.lepas(gerakan.gcs_uri_model_tflite, JENIS_MODEL)
         db.session.delete(gerakan)
         db.session.commit()
-
-        # Hapus file dari Azure Blob Storage setelah commit DB berhasil
-        if blob_foto: delete_blob(blob_foto)
-        if blob_video: delete_blob(blob_video)
-        # Hapus file dari GCS
-        if gcs_uri_model: delete_file_from_gcs(gcs_uri_model.split('/')[-1]) # Hanya kirim nama blob GCS
+        gerakan_catalog.invalidate()
 
         return jsonify({"msg": "Gerakan berhasil dihapus"}), 200
     except Exception as e:
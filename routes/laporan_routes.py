@@ -1,11 +1,28 @@
 # BE-RESTRO/routes/laporan_routes.py
 # PERUBAHAN BARU: Menambahkan perhitungan poin dan logika pemberian badge.
-
-from flask import Blueprint, request, jsonify
-from models import db, AppUser, ProgramRehabilitasi, LaporanRehabilitasi, LaporanGerakanHasil, ProgramStatus, ProgramGerakanDetail, Badge, UserBadge # <--- TAMBAH Badge, UserBadge
+# PERUBAHAN PERFORMA: Rollup PatientSessionStats diperbarui saat laporan disubmit.
+# PERUBAHAN PERFORMA: Indeks leaderboard in-memory diperbarui setelah poin berubah.
+# PERUBAHAN PERFORMA: Pemberian badge memakai katalog badge ter-cache (bisect) dan insert massal.
+# PERUBAHAN PERFORMA: Poin dicatat di points_ledger (insert biasa) lalu dipadatkan ke AppUser.total_points.
+# PERUBAHAN PERFORMA: Detail hasil gerakan divalidasi sekali jalan terhadap ProgramGerakanDetail dan ditulis dengan satu insert multi-baris.
+# PERUBAHAN BARU: Endpoint /submit-batch untuk sinkronisasi banyak sesi offline dalam satu transaksi.
+# PERUBAHAN PERFORMA: Riwayat laporan diserialisasi secara batch dan mendukung sparse fieldset (`fields=`/`include=`).
+# PERUBAHAN PERFORMA: Riwayat laporan mendukung paging cursor (keyset) tanpa COUNT(*)/OFFSET.
+# PERUBAHAN BARU: Submit laporan mendukung header Idempotency-Key (utils/idempotency.py).
+# PERUBAHAN PERFORMA: Event laporan_submitted/badge_awarded dicatat di outbox, efek samping diproses `flask worker`.
+
+from flask import Blueprint, request, jsonify, current_app
+from models import db, AppUser, ProgramRehabilitasi, LaporanRehabilitasi, LaporanGerakanHasil, ProgramStatus, ProgramGerakanDetail, UserBadge, PatientSessionStats, PointsLedger, PointSource, OutboxEvent # <--- TAMBAH UserBadge (Badge dibaca dari badge_catalog)
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, date
-from sqlalchemy import asc # <--- TAMBAH INI
+from sqlalchemy import insert, update
+from utils.leaderboard import leaderboard
+from utils.badge_catalog import badge_catalog
+from utils.idempotency import idempotent
+from utils.fieldsets import fieldset_dari_request
+from utils.pagination import keyset_paginate, keyset_order_by, InvalidCursorError
+from utils.outbox import EVENT_LAPORAN_SUBMITTED, EVENT_BADGE_AWARDED
+from utils.validasi import id_int
 
 laporan_bp = Blueprint('laporan_bp', __name__)
 
@@ -14,8 +31,132 @@ POIN_SEMPURNA = 10
 POIN_TIDAK_SEMPURNA = 5
 POIN_TIDAK_TERDETEKSI = 1 # Atau 0 jika Anda tidak ingin memberikan poin sama sekali
 
+# Batas jumlah laporan per permintaan /submit-batch
+MAKS_LAPORAN_PER_BATCH = 50
+
+HITUNGAN_HASIL = ('jumlah_sempurna', 'jumlah_tidak_sempurna', 'jumlah_tidak_terdeteksi')
+
+# Urutan riwayat laporan (kolom, menurun); id sebagai pemutus seri agar kunci cursor unik
+URUTAN_RIWAYAT_LAPORAN = [(LaporanRehabilitasi.tanggal_laporan, True), (LaporanRehabilitasi.created_at, True), (LaporanRehabilitasi.id, True)]
+
+def _detail_program_map(program_ids):
+    """{program_id: {detail_id: gerakan_id}} untuk semua ProgramGerakanDetail dari program-program tersebut (satu query)."""
+    detail_program = {program_id: {} for program_id in program_ids}
+    rows = db.session.query(ProgramGerakanDetail.id, ProgramGerakanDetail.program_id, ProgramGerakanDetail.gerakan_id)\
+        .filter(ProgramGerakanDetail.program_id.in_(program_ids)).all() if program_ids else []
+    for detail_id, program_id, gerakan_id in rows:
+        detail_program[program_id][detail_id] = gerakan_id
+    return detail_program
+
+def _siapkan_hasil_gerakan(detail_hasil_input, detail_program):
+    """
+    Memvalidasi item detail_hasil_gerakan terhadap detail program ({detail_id: gerakan_id}) dan,
+    dalam satu kali iterasi, menyiapkan baris LaporanGerakanHasil (tanpa laporan_rehabilitasi_id)
+    serta ringkasan poin dan total hitungan. Melempar ValueError jika input tidak valid.
+    """
+    gerakan_program = set(detail_program.values())
+    rows = []
+    ringkasan = {"poin": 0, "jumlah_sempurna": 0, "jumlah_tidak_sempurna": 0, "jumlah_tidak_terdeteksi": 0}
+    for index, item_hasil in enumerate(detail_hasil_input):
+        if not isinstance(item_hasil, dict):
+            raise ValueError(f"Item hasil ke-{index + 1} tidak valid")
+        gerakan_id = item_hasil.get('gerakan_id')
+        if not gerakan_id:
+            raise ValueError("Setiap item hasil harus memiliki 'gerakan_id'")
+        gerakan_id = id_int(gerakan_id, 'gerakan_id')
+
+        detail_id = item_hasil.get('program_gerakan_detail_id_asli')
+        if detail_id is not None:
+            detail_id = id_int(detail_id, 'program_gerakan_detail_id_asli')
+            if detail_program.get(detail_id) is None:
+                raise ValueError(f"program_gerakan_detail_id_asli {detail_id} bukan bagian dari program ini")
+            if detail_program[detail_id] != gerakan_id:
+                raise ValueError(f"gerakan_id {gerakan_id} tidak sesuai dengan program_gerakan_detail_id_asli {detail_id}")
+        elif gerakan_id not in gerakan_program:
+            raise ValueError(f"gerakan_id {gerakan_id} bukan bagian dari program ini")
+
+        hitungan = {}
+        for kolom in HITUNGAN_HASIL:
+            nilai = item_hasil.get(kolom) or 0
+            if not isinstance(nilai, int) or isinstance(nilai, bool) or nilai < 0:
+                raise ValueError(f"{kolom} harus berupa bilangan bulat tidak negatif")
+            hitungan[kolom] = nilai
+            ringkasan[kolom] += nilai
+        ringkasan["poin"] += (hitungan['jumlah_sempurna'] * POIN_SEMPURNA) + \
+                             (hitungan['jumlah_tidak_sempurna'] * POIN_TIDAK_SEMPURNA) + \
+                             (hitungan['jumlah_tidak_terdeteksi'] * POIN_TIDAK_TERDETEKSI)
+
+        rows.append({
+            "gerakan_id": gerakan_id,
+            "program_gerakan_detail_id_asli": detail_id,
+            "urutan_gerakan_dalam_program": item_hasil.get('urutan_gerakan_dalam_program'),
+            "waktu_aktual_per_gerakan_detik": item_hasil.get('waktu_aktual_per_gerakan_detik'),
+            **hitungan
+        })
+    return rows, ringkasan
+
+def _berikan_badge_terlewati(pasien_user, poin_sebelumnya, poin_sekarang):
+    """
+    Memberikan badge yang ambang batasnya terlewati (poin lama < ambang <= poin baru) dan
+    memperbarui pointer badge tertinggi. Tidak melakukan commit. Mengembalikan daftar badge baru.
+    """
+    # Hanya badge yang terlewati yang dicek, dicari dengan bisect pada katalog badge yang di-cache.
+    # Badge dengan ambang <= poin lama sudah dimiliki (dijaga juga saat badge dibuat/diubah).
+    crossed_badges = badge_catalog.crossed(poin_sebelumnya, poin_sekarang)
+    if not crossed_badges:
+        return []
+
+    held_ids = {badge_id for (badge_id,) in db.session.query(UserBadge.badge_id).filter(
+        UserBadge.user_id == pasien_user.id,
+        UserBadge.badge_id.in_([b.id for b in crossed_badges])
+    ).all()}
+    new_badges = [b for b in crossed_badges if b.id not in held_ids]
+    if new_badges:
+        db.session.execute(insert(UserBadge), [{"user_id": pasien_user.id, "badge_id": b.id} for b in new_badges])
+        for badge in new_badges:
+            # Notifikasi diproses di luar request oleh `flask worker` (utils/outbox.py)
+            OutboxEvent.catat(EVENT_BADGE_AWARDED, {"user_id": pasien_user.id, "username": pasien_user.username,
+                                                    "badge_id": badge.id, "badge_name": badge.name})
+
+    # Perbarui pointer badge tertinggi jika badge tertinggi yang terlewati melampauinya
+    top_badge = crossed_badges[-1]
+    current_highest = badge_catalog.get(pasien_user.highest_badge_id)
+    if not current_highest or top_badge.point_threshold > current_highest.point_threshold:
+        pasien_user.highest_badge_id = top_badge.id
+    return new_badges
+
+def _catat_laporan_submitted(laporan):
+    OutboxEvent.catat(EVENT_LAPORAN_SUBMITTED, {"laporan_id": laporan.id, "pasien_id": laporan.pasien_id,
+                                                "program_rehabilitasi_id": laporan.program_rehabilitasi_id,
+                                                "points_earned": laporan.points_earned})
+
+def _kunci_rollup_sesi(pasien_id):
+    """
+    Mengambil baris rollup statistik sesi pasien dengan lock (aman dari submit bersamaan).
+    Jika rollup belum ada, bangun dulu dari riwayat sebelum laporan baru ditambahkan; rebuild aman jika
+    submit lain membuat baris yang sama bersamaan (savepoint + hitung ulang setelah baris dikunci).
+    """
+    session_stats = PatientSessionStats.untuk_pasien(pasien_id, lock=True)
+    if session_stats is None:
+        PatientSessionStats.rebuild([pasien_id])
+        session_stats = PatientSessionStats.untuk_pasien(pasien_id, lock=True)
+    return session_stats
+
+def _padatkan_poin(user_id):
+    """
+    Memadatkan baris points_ledger user ke AppUser.total_points dalam transaksi singkat terpisah.
+    Kegagalan tidak fatal: baris yang tertinggal akan dipadatkan oleh `flask compact-points-ledger`.
+    """
+    try:
+        PointsLedger.compact([user_id])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f"Gagal memadatkan points_ledger untuk user {user_id}: {str(e)}")
+
 @laporan_bp.route('/submit', methods=['POST'])
 @jwt_required()
+@idempotent('laporan_submit')
 def submit_laporan_rehabilitasi():
     current_user_identity = get_jwt_identity()
     if current_user_identity.get('role') != 'pasien':
@@ -37,16 +178,12 @@ def submit_laporan_rehabilitasi():
     if LaporanRehabilitasi.query.filter_by(program_rehabilitasi_id=program_rehabilitasi_id).first():
         return jsonify({"msg": "Laporan untuk program ini sudah pernah disubmit."}), 409
 
-    # Hitung total poin dari laporan ini
-    total_poin_laporan_ini = 0
-    for item_hasil in detail_hasil_input:
-        jumlah_sempurna = item_hasil.get('jumlah_sempurna', 0)
-        jumlah_tidak_sempurna = item_hasil.get('jumlah_tidak_sempurna', 0)
-        jumlah_tidak_terdeteksi = item_hasil.get('jumlah_tidak_terdeteksi', 0)
-
-        total_poin_laporan_ini += (jumlah_sempurna * POIN_SEMPURNA) + \
-                                   (jumlah_tidak_sempurna * POIN_TIDAK_SEMPURNA) + \
-                                   (jumlah_tidak_terdeteksi * POIN_TIDAK_TERDETEKSI)
+    # Validasi detail hasil terhadap detail program (satu query) sekaligus hitung poin dan total hitungan
+    try:
+        hasil_rows, ringkasan = _siapkan_hasil_gerakan(detail_hasil_input, _detail_program_map([program_asli.id])[program_asli.id])
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    total_poin_laporan_ini = ringkasan["poin"]
 
     new_laporan = LaporanRehabilitasi(
         program_rehabilitasi_id=program_rehabilitasi_id,
@@ -59,56 +196,45 @@ def submit_laporan_rehabilitasi():
     )
 
     try:
+        # Perbarui rollup statistik sesi pasien dalam transaksi yang sama
+        session_stats = _kunci_rollup_sesi(pasien_id)
+        session_stats.catat_sesi(
+            new_laporan.tanggal_laporan,
+            new_laporan.total_waktu_rehabilitasi_detik,
+            ringkasan["jumlah_sempurna"], ringkasan["jumlah_tidak_sempurna"], ringkasan["jumlah_tidak_terdeteksi"],
+            ada_hasil=len(hasil_rows) > 0
+        )
+
         db.session.add(new_laporan)
         db.session.flush() # Flush untuk mendapatkan ID laporan sebelum commit penuh
 
-        for item_hasil in detail_hasil_input:
-            gerakan_id = item_hasil.get('gerakan_id')
-            program_gerakan_detail_id_asli = item_hasil.get('program_gerakan_detail_id_asli')
-            urutan_gerakan_dalam_program = item_hasil.get('urutan_gerakan_dalam_program')
-            waktu_aktual_per_gerakan_detik = item_hasil.get('waktu_aktual_per_gerakan_detik')
-
-            if not gerakan_id:
-                raise ValueError("Setiap item hasil harus memiliki 'gerakan_id'")
-
-            detail_laporan = LaporanGerakanHasil(
-                laporan_rehabilitasi_id=new_laporan.id,
-                gerakan_id=gerakan_id,
-                program_gerakan_detail_id_asli=program_gerakan_detail_id_asli,
-                urutan_gerakan_dalam_program=urutan_gerakan_dalam_program,
-                jumlah_sempurna=item_hasil.get('jumlah_sempurna', 0),
-                jumlah_tidak_sempurna=item_hasil.get('jumlah_tidak_sempurna', 0),
-                jumlah_tidak_terdeteksi=item_hasil.get('jumlah_tidak_terdeteksi', 0),
-                waktu_aktual_per_gerakan_detik=waktu_aktual_per_gerakan_detik
-            )
-            db.session.add(detail_laporan)
+        # Semua detail hasil ditulis dengan satu INSERT multi-baris (tanpa objek ORM per gerakan)
+        if hasil_rows:
+            db.session.execute(insert(LaporanGerakanHasil), [dict(row, laporan_rehabilitasi_id=new_laporan.id) for row in hasil_rows])
+
+        # Catat poin sebagai baris points_ledger (insert biasa, baris AppUser tidak dikunci).
+        # AppUser.total_points diperbarui oleh pemadatan ledger setelah commit.
+        PointsLedger.credit(pasien_id, total_poin_laporan_ini, PointSource.LAPORAN, laporan_id=new_laporan.id)
+        _catat_laporan_submitted(new_laporan)
 
-        # Update total_points pasien di tabel AppUser
         pasien_user = AppUser.query.get(pasien_id)
         if pasien_user:
-            pasien_user.total_points += total_poin_laporan_ini
+            poin_sebelumnya = pasien_user.total_points + PointsLedger.pending_points(pasien_id) - total_poin_laporan_ini
+            poin_sekarang = poin_sebelumnya + total_poin_laporan_ini
 
             # Logika pemberian badge
-            # Ambil semua badge yang ambang batasnya sudah terpenuhi oleh total_points user
-            # Diurutkan berdasarkan point_threshold secara ascending agar badge tingkat rendah dicek duluan
-            available_badges = Badge.query.filter(
-                Badge.point_threshold <= pasien_user.total_points
-            ).order_by(asc(Badge.point_threshold)).all()
-
-            for badge in available_badges:
-                # Cek apakah user sudah punya badge ini
-                has_badge = UserBadge.query.filter_by(user_id=pasien_id, badge_id=badge.id).first()
-                if not has_badge:
-                    new_user_badge = UserBadge(user_id=pasien_id, badge_id=badge.id)
-                    db.session.add(new_user_badge)
-                    # Opsional: Anda bisa menambahkan logika notifikasi di sini (misal: kirim ke log, atau queue untuk notif ke frontend)
-                    print(f"DEBUG: Pasien {pasien_user.username} mendapatkan badge: {badge.name}!")
+            _berikan_badge_terlewati(pasien_user, poin_sebelumnya, poin_sekarang)
 
         program_asli.status = ProgramStatus.SELESAI
         program_asli.updated_at = datetime.utcnow()
 
         db.session.commit()
 
+        # Padatkan ledger ke total_points lalu perbarui indeks leaderboard in-memory
+        _padatkan_poin(pasien_id)
+        if pasien_user:
+            leaderboard.update(pasien_id, pasien_user.total_points)
+
         return jsonify({
             "msg": "Laporan berhasil disubmit",
             "data_laporan": new_laporan.serialize_full()
@@ -119,6 +245,153 @@ def submit_laporan_rehabilitasi():
         return jsonify({"msg": "Gagal menyimpan laporan", "error": str(e)}), 500
 
 
+@laporan_bp.route('/submit-batch', methods=['POST'])
+@jwt_required()
+@idempotent('laporan_submit_batch')
+def submit_laporan_batch():
+    """
+    Sinkronisasi sesi offline: menerima banyak laporan sekaligus dalam `laporan` (maks MAKS_LAPORAN_PER_BATCH).
+    Semua item divalidasi bersama (program, duplikasi, dan detail gerakan dimuat dengan query massal),
+    item yang valid disimpan dalam satu transaksi, lalu poin dan badge dievaluasi sekali di akhir.
+    Respons berisi status ringkas per item (sesuai urutan input), bukan laporan yang diserialisasi penuh.
+    """
+    current_user_identity = get_jwt_identity()
+    if current_user_identity.get('role') != 'pasien':
+        return jsonify({"msg": "Akses ditolak"}), 403
+
+    pasien_id = current_user_identity.get('id')
+    data = request.get_json(silent=True) or {}
+    items = data.get('laporan')
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"msg": "laporan wajib diisi berupa array yang tidak kosong"}), 400
+    if len(items) > MAKS_LAPORAN_PER_BATCH:
+        return jsonify({"msg": f"Maksimal {MAKS_LAPORAN_PER_BATCH} laporan per permintaan"}), 400
+
+    # ID program per item dinormalisasi sekali (string angka diterima seperti di /submit); None jika kosong/tidak valid
+    program_id_items = []
+    for item in items:
+        program_id = item.get('program_rehabilitasi_id') if isinstance(item, dict) else None
+        try:
+            program_id_items.append(id_int(program_id, 'program_rehabilitasi_id') if program_id else None)
+        except ValueError:
+            program_id_items.append(None)
+    program_ids = {program_id for program_id in program_id_items if program_id is not None}
+    programs_by_id = {p.id: p for p in ProgramRehabilitasi.query.filter(ProgramRehabilitasi.id.in_(program_ids)).all()} if program_ids else {}
+    sudah_dilaporkan = {program_id for (program_id,) in db.session.query(LaporanRehabilitasi.program_rehabilitasi_id)
+                        .filter(LaporanRehabilitasi.program_rehabilitasi_id.in_(program_ids)).all()} if program_ids else set()
+    detail_program = _detail_program_map([p.id for p in programs_by_id.values() if p.pasien_id == pasien_id])
+
+    hasil = [None] * len(items)
+    diterima = [] # (index, program, laporan_baru, hasil_rows, ringkasan)
+    for index, item in enumerate(items):
+        program_id_input = item.get('program_rehabilitasi_id') if isinstance(item, dict) else None
+        status = {"index": index, "program_rehabilitasi_id": program_id_input}
+        hasil[index] = status
+
+        if not program_id_input or not isinstance(item.get('detail_hasil_gerakan'), list):
+            status.update(status_code=400, msg="program_rehabilitasi_id dan detail_hasil_gerakan wajib diisi")
+            continue
+        program_id = program_id_items[index]
+        if program_id is None:
+            status.update(status_code=400, msg="program_rehabilitasi_id harus berupa bilangan bulat")
+            continue
+        program = programs_by_id.get(program_id)
+        if program is None:
+            status.update(status_code=404, msg="Program tidak ditemukan")
+            continue
+        if program.pasien_id != pasien_id:
+            status.update(status_code=403, msg="Anda tidak berhak mengirim laporan untuk program ini")
+            continue
+        if program_id in sudah_dilaporkan:
+            status.update(status_code=409, msg="Laporan untuk program ini sudah pernah disubmit.")
+            continue
+
+        try:
+            tanggal_laporan = date.fromisoformat(item['tanggal_laporan']) if item.get('tanggal_laporan') else date.today()
+        except (TypeError, ValueError):
+            status.update(status_code=400, msg="Format tanggal_laporan tidak valid (YYYY-MM-DD)")
+            continue
+        if tanggal_laporan > date.today():
+            status.update(status_code=400, msg="tanggal_laporan tidak boleh di masa depan")
+            continue
+        try:
+            hasil_rows, ringkasan = _siapkan_hasil_gerakan(item['detail_hasil_gerakan'], detail_program[program_id])
+        except ValueError as e:
+            status.update(status_code=400, msg=str(e))
+            continue
+
+        sudah_dilaporkan.add(program_id) # Program yang sama dua kali dalam satu batch
+        laporan_baru = LaporanRehabilitasi(
+            program_rehabilitasi_id=program_id,
+            pasien_id=pasien_id,
+            terapis_id=program.terapis_id,
+            tanggal_laporan=tanggal_laporan,
+            total_waktu_rehabilitasi_detik=item.get('total_waktu_rehabilitasi_detik'),
+            catatan_pasien_laporan=item.get('catatan_pasien_laporan'),
+            points_earned=ringkasan["poin"]
+        )
+        diterima.append((index, program, laporan_baru, hasil_rows, ringkasan))
+
+    total_poin_batch = sum(ringkasan["poin"] for _, _, _, _, ringkasan in diterima)
+    badge_baru = []
+    pasien_user = None
+    if diterima:
+        try:
+            session_stats = _kunci_rollup_sesi(pasien_id)
+            for _, _, laporan_baru, hasil_rows, ringkasan in diterima:
+                session_stats.catat_sesi(
+                    laporan_baru.tanggal_laporan,
+                    laporan_baru.total_waktu_rehabilitasi_detik,
+                    ringkasan["jumlah_sempurna"], ringkasan["jumlah_tidak_sempurna"], ringkasan["jumlah_tidak_terdeteksi"],
+                    ada_hasil=len(hasil_rows) > 0
+                )
+
+            db.session.add_all([laporan_baru for _, _, laporan_baru, _, _ in diterima])
+            db.session.flush() # Satu flush untuk mendapatkan ID semua laporan
+            laporan_ids = [laporan_baru.id for _, _, laporan_baru, _, _ in diterima]
+
+            semua_hasil_rows = [dict(row, laporan_rehabilitasi_id=laporan_baru.id)
+                                for _, _, laporan_baru, hasil_rows, _ in diterima for row in hasil_rows]
+            if semua_hasil_rows:
+                db.session.execute(insert(LaporanGerakanHasil), semua_hasil_rows)
+            for _, _, laporan_baru, _, ringkasan in diterima:
+                PointsLedger.credit(pasien_id, ringkasan["poin"], PointSource.LAPORAN, laporan_id=laporan_baru.id)
+                _catat_laporan_submitted(laporan_baru)
+
+            db.session.execute(
+                update(ProgramRehabilitasi)
+                .where(ProgramRehabilitasi.id.in_([program.id for _, program, _, _, _ in diterima]))
+                .values(status=ProgramStatus.SELESAI, updated_at=datetime.utcnow()),
+                execution_options={"synchronize_session": False}
+            )
+
+            # Poin dan badge dievaluasi sekali untuk seluruh batch
+            pasien_user = AppUser.query.get(pasien_id)
+            if pasien_user:
+                poin_sebelumnya = pasien_user.total_points + PointsLedger.pending_points(pasien_id) - total_poin_batch
+                badge_baru = _berikan_badge_terlewati(pasien_user, poin_sebelumnya, poin_sebelumnya + total_poin_batch)
+
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({"msg": "Gagal menyimpan laporan", "error": str(e)}), 500
+
+        for (index, _, _, _, ringkasan), laporan_id in zip(diterima, laporan_ids):
+            hasil[index].update(status_code=201, laporan_id=laporan_id, points_earned=ringkasan["poin"])
+
+        _padatkan_poin(pasien_id)
+        if pasien_user:
+            leaderboard.update(pasien_id, pasien_user.total_points)
+
+    return jsonify({
+        "msg": f"{len(diterima)} dari {len(items)} laporan berhasil disubmit",
+        "hasil": hasil,
+        "total_points_earned": total_poin_batch,
+        "badge_baru": [{"id": b.id, "name": b.name, "point_threshold": b.point_threshold} for b in badge_baru]
+    }), 200
+
+
 @laporan_bp.route('/<int:laporan_id>', methods=['GET'])
 @jwt_required()
 def get_detail_laporan(laporan_id):
@@ -150,12 +423,29 @@ def get_laporan_history_pasien():
     pasien_id = current_user_identity.get('id')
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
+    try:
+        fieldset = fieldset_dari_request(LaporanRehabilitasi.FIELDSET_SPEC)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    query = LaporanRehabilitasi.query.filter_by(pasien_id=pasien_id)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        # Paging keyset: tanpa COUNT(*) dan OFFSET
+        try:
+            laporan_list, next_cursor = keyset_paginate(query, URUTAN_RIWAYAT_LAPORAN, cursor, per_page,
+                                                        (date.fromisoformat, datetime.fromisoformat, int))
+        except InvalidCursorError as e:
+            return jsonify({"msg": str(e)}), 400
+        return jsonify({
+            "laporan": LaporanRehabilitasi.serialize_full_batch(laporan_list, fieldset),
+            "next_cursor": next_cursor
+        }), 200
 
-    paginated_laporan = LaporanRehabilitasi.query.filter_by(pasien_id=pasien_id)\
-        .order_by(LaporanRehabilitasi.tanggal_laporan.desc(), LaporanRehabilitasi.created_at.desc())\
+    paginated_laporan = query.order_by(*keyset_order_by(URUTAN_RIWAYAT_LAPORAN))\
         .paginate(page=page, per_page=per_page, error_out=False)
 
-    results = [l.serialize_full() for l in paginated_laporan.items]
+    results = LaporanRehabilitasi.serialize_full_batch(paginated_laporan.items, fieldset)
 
     return jsonify({
         "laporan": results,
@@ -186,12 +476,30 @@ def get_laporan_history_by_pasien_for_terapis(target_pasien_id):
 
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
+    try:
+        fieldset = fieldset_dari_request(LaporanRehabilitasi.FIELDSET_SPEC)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    query = LaporanRehabilitasi.query.filter_by(pasien_id=target_pasien_id)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        # Paging keyset: tanpa COUNT(*) dan OFFSET
+        try:
+            laporan_list, next_cursor = keyset_paginate(query, URUTAN_RIWAYAT_LAPORAN, cursor, per_page,
+                                                        (date.fromisoformat, datetime.fromisoformat, int))
+        except InvalidCursorError as e:
+            return jsonify({"msg": str(e)}), 400
+        return jsonify({
+            "msg": f"Riwayat laporan untuk pasien {pasien_user.nama_lengkap} berhasil diambil",
+            "laporan": LaporanRehabilitasi.serialize_full_batch(laporan_list, fieldset),
+            "next_cursor": next_cursor
+        }), 200
 
-    paginated_laporan = LaporanRehabilitasi.query.filter_by(pasien_id=target_pasien_id)\
-        .order_by(LaporanRehabilitasi.tanggal_laporan.desc(), LaporanRehabilitasi.created_at.desc())\
+    paginated_laporan = query.order_by(*keyset_order_by(URUTAN_RIWAYAT_LAPORAN))\
         .paginate(page=page, per_page=per_page, error_out=False)
 
-    results = [l.serialize_full() for l in paginated_laporan.items]
+    results = LaporanRehabilitasi.serialize_full_batch(paginated_laporan.items, fieldset)
 
     return jsonify({
         "msg": f"Riwayat laporan untuk pasien {pasien_user.nama_lengkap} berhasil diambil",
@@ -0,0 +1,24 @@
+# routes/media_routes.py
+# Menyajikan file media dari backend storage lokal/memori (STORAGE_BACKEND='lokal' atau 'memori') di
+# GET /media/<key>, dengan dukungan Range (206 Partial Content), ETag, dan 304 Not Modified, sehingga
+# pemutaran video dan unduhan dapat diprofilkan di satu mesin. Di mode cloud file disajikan langsung
+# oleh Azure/GCS dan endpoint ini mengembalikan 404. Lihat utils/storage_backend.py.
+# ETag adalah hash SHA-256 isi file (media_blobs), sehingga klien dapat memvalidasi cache tanpa mengunduh ulang.
+
+from flask import Blueprint, jsonify
+from models import db, MediaBlob
+from utils.storage_backend import storage
+
+media_bp = Blueprint('media_bp', __name__)
+
+
+@media_bp.route('/<path:key>', methods=['GET'])
+def sajikan_media(key):
+    backend = storage()
+    if not backend.disajikan_aplikasi:
+        return jsonify({"msg": "Media disajikan langsung oleh storage cloud"}), 404
+    content_hash = db.session.query(MediaBlob.content_hash).filter_by(ref=key).scalar()
+    response = backend.kirim(key, etag=content_hash)
+    if response is None:
+        return jsonify({"msg": "File tidak ditemukan"}), 404
+    return response
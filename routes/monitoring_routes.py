@@ -2,11 +2,13 @@
 # TERBARU: Mengubah KPI dashboard, data grafik harian, dan manajemen Pola Makan.
 # Memperbaiki relasi 'program_asli' menjadi 'program_rehab'.
 # PERUBAHAN: Menambahkan highest_badge_info ke pasien_info di endpoint summary monitoring.
+# PERUBAHAN PERFORMA: KPI, tren, dan distribusi dihitung dengan query agregat SQL (jumlah query tetap).
+# PERUBAHAN PERFORMA: KPI dan distribusi dibaca dari rollup PatientSessionStats.
 
 from flask import Blueprint, jsonify, current_app
-from models import db, AppUser, PatientProfile, LaporanRehabilitasi, LaporanGerakanHasil, ProgramRehabilitasi, ProgramStatus, Badge, UserBadge # Import Badge dan UserBadge
+from models import db, AppUser, PatientProfile, LaporanRehabilitasi, LaporanGerakanHasil, ProgramRehabilitasi, ProgramStatus, PatientSessionStats
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import func, cast, Date as SQLDate, desc # Import desc
+from sqlalchemy import func, cast, Date as SQLDate
 from datetime import date, timedelta, datetime
 
 monitoring_bp = Blueprint('monitoring_bp', __name__)
@@ -21,6 +23,24 @@ def format_durasi_ringkas(total_detik):
     detik = int(total_detik % 60)
     return f"{menit}m {detik}s"
 
+def _query_laporan_selesai(pasien_id, *columns):
+    """
+    Query dasar atas laporan pasien yang programnya berstatus SELESAI,
+    dengan kolom/agregat yang diminta.
+    """
+    return db.session.query(*columns)\
+        .select_from(LaporanRehabilitasi)\
+        .join(ProgramRehabilitasi, LaporanRehabilitasi.program_rehabilitasi_id == ProgramRehabilitasi.id)\
+        .filter(LaporanRehabilitasi.pasien_id == pasien_id, ProgramRehabilitasi.status == ProgramStatus.SELESAI)
+
+def _kolom_jumlah_hasil():
+    """Kolom agregat jumlah sempurna / tidak sempurna / tidak terdeteksi per laporan."""
+    return (
+        func.sum(func.coalesce(LaporanGerakanHasil.jumlah_sempurna, 0)).label('sempurna'),
+        func.sum(func.coalesce(LaporanGerakanHasil.jumlah_tidak_sempurna, 0)).label('tidak_sempurna'),
+        func.sum(func.coalesce(LaporanGerakanHasil.jumlah_tidak_terdeteksi, 0)).label('tidak_terdeteksi')
+    )
+
 @monitoring_bp.route('/summary/pasien/<int:pasien_id>', methods=['GET'])
 @jwt_required()
 def get_pasien_monitoring_summary(pasien_id):
@@ -47,100 +67,59 @@ def get_pasien_monitoring_summary(pasien_id):
     if user_role == 'pasien' and requesting_user_id != pasien_id:
         return jsonify({"msg": "Akses ditolak: Anda hanya bisa melihat summary Anda sendiri."}), 403
     
-    # Mengambil semua laporan yang programnya berstatus SELESAI untuk pasien ini
-    # Diurutkan berdasarkan tanggal laporan untuk analisis tren
-    semua_laporan_selesai = LaporanRehabilitasi.query\
-                                .join(ProgramRehabilitasi, LaporanRehabilitasi.program_rehabilitasi_id == ProgramRehabilitasi.id)\
-                                .filter(LaporanRehabilitasi.pasien_id == pasien_id, ProgramRehabilitasi.status == ProgramStatus.SELESAI)\
-                                .order_by(LaporanRehabilitasi.tanggal_laporan.asc(), LaporanRehabilitasi.created_at.asc()).all()
-
     # --- 1. KPI Cards ---
-    total_sesi_selesai = len(semua_laporan_selesai)
-    
-    # Menghitung rata-rata durasi sesi
-    rata_rata_durasi_detik = 0
-    if total_sesi_selesai > 0:
-        total_durasi_valid_detik = sum(filter(None, [l.total_waktu_rehabilitasi_detik for l in semua_laporan_selesai if l.total_waktu_rehabilitasi_detik is not None]))
-        jumlah_sesi_dengan_durasi = sum(1 for l in semua_laporan_selesai if l.total_waktu_rehabilitasi_detik is not None)
-        if jumlah_sesi_dengan_durasi > 0:
-            rata_rata_durasi_detik = total_durasi_valid_detik / jumlah_sesi_dengan_durasi
-    
-    # Menghitung rata-rata akurasi keseluruhan
-    total_akurasi_kumulatif = 0
-    jumlah_sesi_dinilai_akurasi = 0
-    for laporan in semua_laporan_selesai:
-        # Mengambil detail hasil gerakan untuk setiap laporan
-        hasil_detail_sesi = LaporanGerakanHasil.query.filter_by(laporan_rehabilitasi_id=laporan.id).all()
-        if hasil_detail_sesi:
-            total_gerakan_dilakukan_sesi = sum((h.jumlah_sempurna or 0) + (h.jumlah_tidak_sempurna or 0) + (h.jumlah_tidak_terdeteksi or 0) for h in hasil_detail_sesi)
-            total_sempurna_sesi = sum(h.jumlah_sempurna or 0 for h in hasil_detail_sesi)
-            if total_gerakan_dilakukan_sesi > 0:
-                akurasi_sesi = (total_sempurna_sesi / total_gerakan_dilakukan_sesi) * 100
-                total_akurasi_kumulatif += akurasi_sesi
-                jumlah_sesi_dinilai_akurasi += 1
-    rata_rata_akurasi_keseluruhan = total_akurasi_kumulatif / jumlah_sesi_dinilai_akurasi if jumlah_sesi_dinilai_akurasi > 0 else 0
-    
-    # Menghitung frekuensi latihan per minggu
-    frekuensi_latihan = 0
-    if total_sesi_selesai > 1:
-        tanggal_pertama = semua_laporan_selesai[0].tanggal_laporan
-        tanggal_terakhir = semua_laporan_selesai[-1].tanggal_laporan
-        if tanggal_pertama and tanggal_terakhir:
-            rentang_hari = (tanggal_terakhir - tanggal_pertama).days
-            if rentang_hari > 0 :
-                rentang_minggu = rentang_hari / 7.0
-                frekuensi_latihan = total_sesi_selesai / rentang_minggu
-            else: # Jika semua sesi di hari yang sama
-                frekuensi_latihan = total_sesi_selesai * 7 # Anggap 1 sesi dalam 1 hari = 7 sesi per minggu jika terjadi setiap hari
-    elif total_sesi_selesai == 1:
-        frekuensi_latihan = 1 # Jika hanya ada 1 sesi
+    # KPI dibaca dari rollup PatientSessionStats (satu baris per pasien).
+    # Jika rollup belum pernah dibangun untuk pasien ini, hitung dari riwayat tanpa menyimpannya.
+    session_stats = PatientSessionStats.untuk_pasien(pasien_id)
+    if session_stats is None:
+        session_stats = PatientSessionStats.hitung_dari_riwayat([pasien_id]).get(pasien_id) or PatientSessionStats(user_id=pasien_id)
+
+    total_sesi_selesai = session_stats.total_sesi_selesai
+    rata_rata_durasi_detik = session_stats.rata_rata_durasi_detik()
+    rata_rata_akurasi_keseluruhan = session_stats.rata_rata_akurasi()
+    frekuensi_latihan = session_stats.frekuensi_latihan_per_minggu()
 
     # --- 2. Tren (7 sesi laporan terakhir) ---
-    # Mengambil 7 laporan terakhir untuk analisis tren akurasi dan durasi
-    sesi_terakhir_untuk_tren = semua_laporan_selesai[-7:]
+    # Mengambil 7 laporan terakhir beserta jumlah hasil gerakannya dalam satu query
+    sesi_terakhir_untuk_tren = _query_laporan_selesai(
+        pasien_id,
+        LaporanRehabilitasi.tanggal_laporan,
+        LaporanRehabilitasi.total_waktu_rehabilitasi_detik,
+        *_kolom_jumlah_hasil()
+    ).outerjoin(LaporanGerakanHasil, LaporanGerakanHasil.laporan_rehabilitasi_id == LaporanRehabilitasi.id)\
+     .group_by(LaporanRehabilitasi.id, LaporanRehabilitasi.tanggal_laporan, LaporanRehabilitasi.created_at, LaporanRehabilitasi.total_waktu_rehabilitasi_detik)\
+     .order_by(LaporanRehabilitasi.tanggal_laporan.desc(), LaporanRehabilitasi.created_at.desc(), LaporanRehabilitasi.id.desc())\
+     .limit(7).all()
     tren_akurasi_data = { "labels": [], "data": [] }
     tren_durasi_data = { "labels": [], "data": [] }
 
-    for laporan in sesi_terakhir_untuk_tren:
-        label_sesi = laporan.tanggal_laporan.strftime('%d %b') if laporan.tanggal_laporan else "N/A"
+    for sesi in reversed(sesi_terakhir_untuk_tren):
+        label_sesi = sesi.tanggal_laporan.strftime('%d %b') if sesi.tanggal_laporan else "N/A"
         
         # Akurasi sesi
-        hasil_detail_sesi = LaporanGerakanHasil.query.filter_by(laporan_rehabilitasi_id=laporan.id).all()
-        total_gerakan_dilakukan_sesi = sum((h.jumlah_sempurna or 0) + (h.jumlah_tidak_sempurna or 0) + (h.jumlah_tidak_terdeteksi or 0) for h in hasil_detail_sesi)
-        total_sempurna_sesi = sum(h.jumlah_sempurna or 0 for h in hasil_detail_sesi)
-        akurasi_sesi_tren = (total_sempurna_sesi / total_gerakan_dilakukan_sesi) * 100 if total_gerakan_dilakukan_sesi > 0 else 0
+        total_gerakan_dilakukan_sesi = (sesi.sempurna or 0) + (sesi.tidak_sempurna or 0) + (sesi.tidak_terdeteksi or 0)
+        akurasi_sesi_tren = ((sesi.sempurna or 0) / total_gerakan_dilakukan_sesi) * 100 if total_gerakan_dilakukan_sesi > 0 else 0
         
         tren_akurasi_data["labels"].append(label_sesi)
         tren_akurasi_data["data"].append(round(akurasi_sesi_tren))
 
         # Durasi sesi (dalam menit)
-        durasi_menit_sesi = (laporan.total_waktu_rehabilitasi_detik or 0) / 60.0
+        durasi_menit_sesi = (sesi.total_waktu_rehabilitasi_detik or 0) / 60.0
         tren_durasi_data["labels"].append(label_sesi)
         tren_durasi_data["data"].append(round(durasi_menit_sesi))
 
     # --- 3. Distribusi Hasil Gerakan (Total dari semua laporan selesai) ---
-    # Menghitung total jumlah gerakan sempurna, tidak sempurna, dan tidak terdeteksi
-    total_sempurna_all_sessions = 0
-    total_tidak_sempurna_all_sessions = 0
-    total_tidak_terdeteksi_all_sessions = 0
-    
-    for laporan in semua_laporan_selesai:
-        # Load detail_hasil_gerakan untuk setiap laporan
-        for detail_hasil in laporan.detail_hasil_gerakan:
-            total_sempurna_all_sessions += detail_hasil.jumlah_sempurna or 0
-            total_tidak_sempurna_all_sessions += detail_hasil.jumlah_tidak_sempurna or 0
-            total_tidak_terdeteksi_all_sessions += detail_hasil.jumlah_tidak_terdeteksi or 0
+    # Diambil dari rollup statistik sesi
+    total_sempurna_all_sessions = session_stats.total_sempurna
+    total_tidak_sempurna_all_sessions = session_stats.total_tidak_sempurna
+    total_tidak_terdeteksi_all_sessions = session_stats.total_tidak_terdeteksi
 
     # --- 4. Info Profil Pasien ---
     # Informasi profil pasien sudah diambil di awal fungsi (pasien_user, pasien_profile)
     # dan akan diserialisasi di objek response_data.
     
-    # Ambil badge tertinggi yang dimiliki user (mirip logika leaderboard)
-    highest_badge_entry = UserBadge.query.filter_by(user_id=pasien_user.id)\
-                                         .join(Badge)\
-                                         .order_by(desc(Badge.point_threshold))\
-                                         .first()
-    highest_badge_info = highest_badge_entry.badge.serialize() if highest_badge_entry and highest_badge_entry.badge else None
+    # Ambil badge tertinggi yang dimiliki user dari pointer AppUser.highest_badge
+    highest_badge_info = pasien_user.highest_badge.serialize() if pasien_user.highest_badge else None
 
 
     # --- 5. Catatan Terbaru (contoh: 5 catatan terakhir dari program & laporan) ---
@@ -173,18 +152,24 @@ def get_pasien_monitoring_summary(pasien_id):
     catatan_terbaru = catatan_terbaru[:5]
 
     # --- 6. Riwayat Aktivitas Monitoring (Daftar program yang telah selesai) ---
-    # Mengambil informasi program dari laporan yang sudah selesai
+    # Hanya kolom yang dibutuhkan yang diambil, diurutkan dari yang terbaru ke terlama
+    riwayat_rows = _query_laporan_selesai(
+        pasien_id,
+        LaporanRehabilitasi.id,
+        LaporanRehabilitasi.catatan_pasien_laporan,
+        ProgramRehabilitasi.tanggal_program,
+        ProgramRehabilitasi.nama_program,
+        ProgramRehabilitasi.status
+    ).order_by(LaporanRehabilitasi.tanggal_laporan.desc(), LaporanRehabilitasi.created_at.desc(), LaporanRehabilitasi.id.desc()).all()
     riwayat_aktivitas_monitoring = []
-    for laporan in reversed(semua_laporan_selesai): # Mengurutkan dari yang terbaru ke terlama
-        # PERBAIKAN: Menggunakan 'laporan.program_rehab'
-        if laporan.program_rehab:
-            riwayat_aktivitas_monitoring.append({
-                "tanggal_program": laporan.program_rehab.tanggal_program.strftime('%Y-%m-%d') if laporan.program_rehab.tanggal_program else "N/A",
-                "nama_program": laporan.program_rehab.nama_program,
-                "status_program": laporan.program_rehab.status.value,
-                "laporan_id": laporan.id,
-                "keterangan_sesi": laporan.catatan_pasien_laporan or "-"
-            })
+    for row in riwayat_rows:
+        riwayat_aktivitas_monitoring.append({
+            "tanggal_program": row.tanggal_program.strftime('%Y-%m-%d') if row.tanggal_program else "N/A",
+            "nama_program": row.nama_program,
+            "status_program": row.status.value,
+            "laporan_id": row.id,
+            "keterangan_sesi": row.catatan_pasien_laporan or "-"
+        })
 
     # Menggabungkan semua data ke dalam objek respons akhir
     response_data = {
@@ -196,7 +181,7 @@ def get_pasien_monitoring_summary(pasien_id):
             "tanggal_lahir": pasien_profile.tanggal_lahir.strftime('%d-%m-%Y') if pasien_profile and pasien_profile.tanggal_lahir else "N/A",
             "diagnosis": pasien_profile.diagnosis if pasien_profile else "N/A",
             "catatan_tambahan_pasien": pasien_profile.catatan_tambahan if pasien_profile else "N/A",
-            "url_foto_profil": pasien_profile.serialize_full().get('url_foto_profil') if pasien_profile else None, # URL foto profil
+            "url_foto_profil": pasien_profile.url_foto_profil() if pasien_profile else None, # URL foto profil
             "total_points": pasien_user.total_points, # total_points sudah ada dari AppUser
             "highest_badge_info": highest_badge_info # Menambahkan informasi badge tertinggi
         },
@@ -2,13 +2,16 @@
 # TERBARU: Logika update profil pasien agar memungkinkan field disetel ke null/kosong.
 # Menambahkan endpoint untuk melihat Pola Makan (Diet Plan) oleh Pasien.
 # Menambahkan endpoint baru untuk melihat program rehabilitasi dalam tampilan kalender.
+# PERUBAHAN BARU: Foto profil lama dicatat di antrean penghapusan storage (PendingDeletion) dalam transaksi yang sama.
+# PERUBAHAN PERFORMA: Foto profil dideduplikasi berdasarkan hash isi (utils/media_dedup.py, MediaBlob).
 
 from flask import Blueprint, request, jsonify, current_app
-from models import AppUser, PatientProfile, PolaMakan, ProgramRehabilitasi, ProgramStatus, db
+from models import AppUser, PatientProfile, PolaMakan, ProgramRehabilitasi, ProgramStatus, MediaBlob, db
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, date, timedelta
 from sqlalchemy import func
-from utils.azure_helpers import upload_file_to_blob, delete_blob
+from utils.storage_backend import JENIS_MEDIA
+from utils.media_dedup import unggah_dedup, batalkan
 
 
 patient_bp = Blueprint('patient_bp', __name__)
@@ -132,25 +135,26 @@ def upload_profile_picture():
     
     file = request.files['foto_profil']
     
+    hasil = None
     try:
-        new_blob_name, err = upload_file_to_blob(file, 'profil/foto')
+        hasil, err = unggah_dedup(file, 'profil/foto')
         if err:
             raise Exception(err)
 
-        old_blob_name = profile.filename_foto_profil
-        if old_blob_name:
-            delete_blob(old_blob_name)
-
+        # Referensi ke foto lama dilepas (antrean penghapusan jika referensi terakhir), ikut tersimpan bersama foto baru
+        new_blob_name = MediaBlob.pakai(hasil)
+        MediaBlob.lepas(profile.filename_foto_profil, JENIS_MEDIA)
         profile.filename_foto_profil = new_blob_name
         db.session.commit()
 
         return jsonify({
             "msg": "Foto profil berhasil diupdate",
-            "url_foto_profil": profile.serialize_full().get('url_foto_profil')
+            "url_foto_profil": profile.url_foto_profil()
         }), 200
 
     except Exception as e:
         db.session.rollback()
+        batalkan(hasil)
         current_app.logger.error(f"Gagal upload foto profil untuk user {user_id}: {str(e)}")
         return jsonify({"msg": "Gagal mengupdate foto profil", "error": str(e)}), 500
 
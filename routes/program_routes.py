@@ -2,14 +2,65 @@
 # TERBARU: Menampilkan foto pasien, diagnosis, DAN TOTAL POIN di endpoint /pasien-list
 # Menambahkan endpoint baru /program/patient-info/<int:pasien_id>
 # untuk mendapatkan info pasien dasar, sekarang termasuk total_points.
+# PERUBAHAN BARU: Pembuatan program mendukung header Idempotency-Key (utils/idempotency.py).
+# PERUBAHAN PERFORMA: Pembuatan program memvalidasi gerakan dengan satu query IN, insert detail multi-baris, dan respons dari data di memori.
+# PERUBAHAN BARU: Endpoint template program (/templates) dengan assign massal ke banyak pasien dan tanggal.
+# PERUBAHAN BARU: Jadwal berulang (`pengulangan` saat membuat program) dan endpoint /series untuk perubahan massal.
+# PERUBAHAN PERFORMA: /pasien/history mendukung sparse fieldset (`fields=`/`include=`).
+# PERUBAHAN PERFORMA: /pasien/history mendukung paging cursor (keyset) tanpa COUNT(*)/OFFSET.
 
 from flask import Blueprint, request, jsonify
-from models import db, AppUser, Gerakan, ProgramRehabilitasi, ProgramGerakanDetail, ProgramStatus, PatientProfile
+from models import db, AppUser, Gerakan, ProgramRehabilitasi, ProgramGerakanDetail, ProgramStatus, PatientProfile, PatientSessionStats, \
+                   ProgramTemplate, ProgramTemplateDetail, ProgramSeries, FrekuensiPengulangan, LaporanRehabilitasi
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import date, datetime
+from sqlalchemy import insert, update, delete
+from sqlalchemy.orm import joinedload
+from utils.idempotency import idempotent
+from utils.fieldsets import fieldset_dari_request
+from utils.pagination import keyset_paginate, keyset_order_by, InvalidCursorError
+from utils.validasi import id_int
 
 program_bp = Blueprint('program_bp', __name__)
 
+# Batas jumlah program (pasien x tanggal) yang dibuat dalam satu assign template
+MAKS_PROGRAM_PER_ASSIGN = 5000
+
+# Urutan riwayat program (kolom, menurun); id sebagai pemutus seri agar kunci cursor unik
+URUTAN_RIWAYAT_PROGRAM = [(ProgramRehabilitasi.tanggal_program, True), (ProgramRehabilitasi.created_at, True), (ProgramRehabilitasi.id, True)]
+
+def _validasi_list_gerakan(list_gerakan_input):
+    """
+    Memvalidasi list_gerakan_direncanakan: bentuk setiap item, lalu semua gerakan_id sekaligus dengan satu query IN.
+    Mengembalikan (detail_rows, gerakan_by_id); detail_rows berisi gerakan_id, jumlah_repetisi, dan urutan.
+    Melempar ValueError jika input tidak valid.
+    """
+    if not isinstance(list_gerakan_input, list) or not list_gerakan_input:
+        raise ValueError("list_gerakan_direncanakan harus berupa array yang tidak kosong")
+
+    detail_rows = []
+    for idx, item_gerakan in enumerate(list_gerakan_input):
+        if not isinstance(item_gerakan, dict):
+            raise ValueError(f"Data gerakan tidak valid pada item {idx+1}")
+        gerakan_id = item_gerakan.get('gerakan_id')
+        jumlah_repetisi = item_gerakan.get('jumlah_repetisi_direncanakan')
+        if not gerakan_id or not isinstance(jumlah_repetisi, int) or jumlah_repetisi <= 0:
+            raise ValueError(f"Data gerakan tidak valid pada item {idx+1}")
+        detail_rows.append({
+            "gerakan_id": id_int(gerakan_id, f"gerakan_id pada item {idx+1}"),
+            "jumlah_repetisi": jumlah_repetisi,
+            "urutan": item_gerakan.get('urutan_dalam_program', idx + 1)
+        })
+
+    gerakan_ids = {row["gerakan_id"] for row in detail_rows}
+    # Gerakan (beserta pembuatnya) disimpan di dict agar tetap di identity map selama request,
+    # sehingga detail.gerakan saat serialisasi tidak memicu query
+    gerakan_by_id = {g.id: g for g in Gerakan.query.options(joinedload(Gerakan.pembuat)).filter(Gerakan.id.in_(gerakan_ids)).all()}
+    gerakan_hilang = [gerakan_id for gerakan_id in gerakan_ids if gerakan_id not in gerakan_by_id]
+    if gerakan_hilang:
+        raise ValueError(f"Gerakan dengan ID {', '.join(str(g) for g in sorted(gerakan_hilang, key=str))} tidak ditemukan")
+    return detail_rows, gerakan_by_id
+
 @program_bp.route('/pasien-list', methods=['GET'])
 @jwt_required()
 def get_pasien_list_for_terapis():
@@ -41,7 +92,7 @@ def get_pasien_list_for_terapis():
         
         # Tambahkan data dari PatientProfile jika ada
         if profile:
-            patient_data["foto_url"] = profile.serialize_full().get('url_foto_profil')
+            patient_data["foto_url"] = profile.url_foto_profil()
             patient_data["diagnosis"] = profile.diagnosis
         else:
             patient_data["foto_url"] = None
@@ -83,7 +134,7 @@ def get_patient_info_for_program_context(pasien_id):
     }
 
     if profile:
-        patient_info["foto_url"] = profile.serialize_full().get('url_foto_profil')
+        patient_info["foto_url"] = profile.url_foto_profil()
         patient_info["diagnosis"] = profile.diagnosis
         patient_info["jenis_kelamin"] = profile.jenis_kelamin
         patient_info["tanggal_lahir"] = profile.tanggal_lahir.isoformat() if profile.tanggal_lahir else None
@@ -99,6 +150,7 @@ def get_patient_info_for_program_context(pasien_id):
 
 @program_bp.route('/', methods=['POST'])
 @jwt_required()
+@idempotent('program_create')
 def create_and_assign_program():
     current_user_identity = get_jwt_identity()
     if current_user_identity.get('role') != 'terapis':
@@ -114,8 +166,18 @@ def create_and_assign_program():
 
     if not all([nama_program, pasien_id, list_gerakan_input]):
         return jsonify({"msg": "Nama program, ID pasien, dan daftar gerakan wajib diisi"}), 400
-    
-    pasien = AppUser.query.filter_by(id=pasien_id, role='pasien').first_or_404("Pasien tidak ditemukan.")
+
+    try:
+        pasien_id = int(pasien_id)
+    except (ValueError, TypeError):
+        return jsonify({"msg": "ID pasien tidak valid"}), 400
+
+    # Pasien dan terapis dimuat dengan satu query (terapis dipakai untuk respons)
+    terapis_id = current_user_identity.get('id')
+    users_by_id = {u.id: u for u in AppUser.query.filter(AppUser.id.in_({pasien_id, terapis_id})).all()}
+    pasien = users_by_id.get(pasien_id)
+    if pasien is None or pasien.role != 'pasien':
+        return jsonify({"msg": "Pasien tidak ditemukan."}), 404
 
     try:
         tanggal_program = datetime.strptime(tanggal_program_str, '%Y-%m-%d').date() if tanggal_program_str else date.today()
@@ -123,12 +185,21 @@ def create_and_assign_program():
     except (ValueError, TypeError):
         return jsonify({"msg": "Format tanggal atau status tidak valid"}), 400
 
+    # Validasi semua gerakan dengan satu query IN
+    try:
+        detail_rows, gerakan_by_id = _validasi_list_gerakan(list_gerakan_input)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    if data.get('pengulangan') is not None:
+        return _buat_program_berulang(data, tanggal_program, status_program, terapis_id, pasien_id, detail_rows)
+
     new_program = ProgramRehabilitasi(
         nama_program=nama_program,
         tanggal_program=tanggal_program,
         catatan_terapis=catatan_terapis,
         status=status_program,
-        terapis_id=current_user_identity.get('id'),
+        terapis_id=terapis_id,
         pasien_id=pasien_id
     )
     
@@ -136,33 +207,413 @@ def create_and_assign_program():
         db.session.add(new_program)
         db.session.flush()
 
-        for idx, item_gerakan in enumerate(list_gerakan_input):
-            gerakan_id = item_gerakan.get('gerakan_id')
-            jumlah_repetisi = item_gerakan.get('jumlah_repetisi_direncanakan')
-            urutan = item_gerakan.get('urutan_dalam_program', idx + 1)
-
-            if not gerakan_id or not isinstance(jumlah_repetisi, int) or jumlah_repetisi <= 0:
-                raise ValueError(f"Data gerakan tidak valid pada item {idx+1}")
-            
-            if not Gerakan.query.get(gerakan_id):
-                raise ValueError(f"Gerakan dengan ID {gerakan_id} tidak ditemukan")
-
-            detail = ProgramGerakanDetail(
-                program_id=new_program.id,
-                gerakan_id=gerakan_id,
-                jumlah_repetisi=jumlah_repetisi,
-                urutan=urutan
-            )
-            db.session.add(detail)
-        
+        # Satu INSERT multi-baris; RETURNING mengembalikan objek detail (diurutkan seperti serialize_full)
+        details = db.session.scalars(
+            insert(ProgramGerakanDetail).returning(ProgramGerakanDetail),
+            [dict(row, program_id=new_program.id) for row in detail_rows]
+        ).all()
+        details.sort(key=lambda d: (d.urutan is None, d.urutan or 0, d.id))
+
+        # Respons disusun dari data di memori sebelum commit (tanpa query ulang)
+        program_data = new_program._serialize_full_from(details, None, [], users_by_id.get(terapis_id), pasien)
         db.session.commit()
-        return jsonify({"msg": "Program berhasil dibuat", "program": new_program.serialize_full()}), 201
+        return jsonify({"msg": "Program berhasil dibuat", "program": program_data}), 201
     
     except Exception as e:
         db.session.rollback()
         return jsonify({"msg": "Gagal membuat program", "error": str(e)}), 500
 
 
+def _insert_program_massal(program_rows, detail_rows):
+    """
+    Insert multi-baris untuk program dan detail gerakannya (setiap program mendapat semua detail_rows).
+    Tidak melakukan commit. Mengembalikan baris (id, pasien_id, tanggal_program) program yang dibuat.
+    """
+    sekarang = datetime.utcnow()
+    hasil = db.session.execute(
+        insert(ProgramRehabilitasi).returning(ProgramRehabilitasi.id, ProgramRehabilitasi.pasien_id, ProgramRehabilitasi.tanggal_program),
+        [dict(row, created_at=sekarang, updated_at=sekarang) for row in program_rows]
+    ).all()
+    db.session.execute(insert(ProgramGerakanDetail), [
+        dict(row, program_id=program_id) for program_id, _, _ in hasil for row in detail_rows
+    ])
+    return hasil
+
+def _parse_pengulangan(spec, tanggal_mulai):
+    """
+    Memvalidasi spesifikasi `pengulangan` ({frekuensi, interval_hari, sampai_tanggal}) dan mengembalikan
+    ProgramSeries (belum disimpan, tanpa terapis/pasien) beserta daftar tanggalnya. Melempar ValueError jika tidak valid.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("pengulangan harus berupa object")
+    try:
+        frekuensi = FrekuensiPengulangan(spec.get('frekuensi'))
+    except ValueError:
+        raise ValueError(f"frekuensi harus salah satu dari: {', '.join(f.value for f in FrekuensiPengulangan)}")
+    interval_hari = spec.get('interval_hari', 1)
+    if frekuensi == FrekuensiPengulangan.SETIAP_N_HARI and (not isinstance(interval_hari, int) or interval_hari < 1):
+        raise ValueError("interval_hari harus berupa bilangan bulat >= 1")
+    try:
+        tanggal_selesai = datetime.strptime(spec.get('sampai_tanggal'), '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        raise ValueError("sampai_tanggal wajib diisi dengan format YYYY-MM-DD")
+    if tanggal_selesai < tanggal_mulai:
+        raise ValueError("sampai_tanggal tidak boleh sebelum tanggal_program")
+
+    series = ProgramSeries(frekuensi=frekuensi, interval_hari=interval_hari if frekuensi == FrekuensiPengulangan.SETIAP_N_HARI else 1,
+                           tanggal_mulai=tanggal_mulai, tanggal_selesai=tanggal_selesai)
+    tanggal_list = series.tanggal_jadwal()
+    if not tanggal_list:
+        raise ValueError("Pengulangan tidak menghasilkan tanggal apa pun")
+    if len(tanggal_list) > ProgramSeries.MAKS_KEJADIAN:
+        raise ValueError(f"Pengulangan maksimal {ProgramSeries.MAKS_KEJADIAN} tanggal")
+    return series, tanggal_list
+
+# --- ENDPOINT TEMPLATE PROGRAM (TERAPIS) ---
+def _get_template_milik_terapis(template_id, terapis_id):
+    return ProgramTemplate.query.options(joinedload(ProgramTemplate.details).joinedload(ProgramTemplateDetail.gerakan))\
+        .filter_by(id=template_id, terapis_id=terapis_id).first()
+
+@program_bp.route('/templates', methods=['POST'])
+@jwt_required()
+def create_program_template():
+    current_user_identity = get_jwt_identity()
+    if current_user_identity.get('role') != 'terapis':
+        return jsonify({"msg": "Akses ditolak"}), 403
+
+    data = request.get_json(silent=True) or {}
+    nama_template = data.get('nama_template')
+    if not nama_template:
+        return jsonify({"msg": "nama_template wajib diisi"}), 400
+    try:
+        detail_rows, _ = _validasi_list_gerakan(data.get('list_gerakan_direncanakan'))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    template = ProgramTemplate(
+        nama_template=nama_template,
+        catatan_terapis=data.get('catatan_terapis'),
+        terapis_id=current_user_identity.get('id'),
+        details=[ProgramTemplateDetail(**row) for row in detail_rows]
+    )
+    try:
+        db.session.add(template)
+        db.session.commit()
+        return jsonify({"msg": "Template program berhasil dibuat", "template": template.serialize()}), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Gagal membuat template program", "error": str(e)}), 500
+
+@program_bp.route('/templates', methods=['GET'])
+@jwt_required()
+def get_program_templates():
+    current_user_identity = get_jwt_identity()
+    if current_user_identity.get('role') != 'terapis':
+        return jsonify({"msg": "Akses ditolak"}), 403
+
+    templates = ProgramTemplate.query.options(joinedload(ProgramTemplate.details))\
+        .filter_by(terapis_id=current_user_identity.get('id'))\
+        .order_by(ProgramTemplate.nama_template.asc()).all()
+    return jsonify([t.serialize(include_details=False) for t in templates]), 200
+
+@program_bp.route('/templates/<int:template_id>', methods=['GET'])
+@jwt_required()
+def get_program_template(template_id):
+    current_user_identity = get_jwt_identity()
+    if current_user_identity.get('role') != 'terapis':
+        return jsonify({"msg": "Akses ditolak"}), 403
+
+    template = _get_template_milik_terapis(template_id, current_user_identity.get('id'))
+    if not template:
+        return jsonify({"msg": "Template tidak ditemukan"}), 404
+    return jsonify(template.serialize()), 200
+
+@program_bp.route('/templates/<int:template_id>', methods=['DELETE'])
+@jwt_required()
+def delete_program_template(template_id):
+    """Menghapus template. Program yang sudah dibuat dari template ini tidak terpengaruh."""
+    current_user_identity = get_jwt_identity()
+    if current_user_identity.get('role') != 'terapis':
+        return jsonify({"msg": "Akses ditolak"}), 403
+
+    template = _get_template_milik_terapis(template_id, current_user_identity.get('id'))
+    if not template:
+        return jsonify({"msg": "Template tidak ditemukan"}), 404
+    try:
+        db.session.delete(template)
+        db.session.commit()
+        return jsonify({"msg": "Template program berhasil dihapus"}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Gagal menghapus template program", "error": str(e)}), 500
+
+@program_bp.route('/templates/<int:template_id>/assign', methods=['POST'])
+@jwt_required()
+@idempotent('program_template_assign')
+def assign_program_template(template_id):
+    """
+    Membuat program dari template untuk setiap kombinasi pasien x tanggal dalam satu transaksi.
+    Program dan detail gerakannya ditulis dengan insert multi-baris (jumlah statement tidak bergantung
+    pada jumlah pasien/tanggal). Respons berisi ringkasan program yang dibuat, bukan serialisasi penuh.
+    """
+    current_user_identity = get_jwt_identity()
+    if current_user_identity.get('role') != 'terapis':
+        return jsonify({"msg": "Akses ditolak"}), 403
+    terapis_id = current_user_identity.get('id')
+
+    template = _get_template_milik_terapis(template_id, terapis_id)
+    if not template:
+        return jsonify({"msg": "Template tidak ditemukan"}), 404
+    if not template.details:
+        return jsonify({"msg": "Template tidak memiliki gerakan"}), 400
+
+    data = request.get_json(silent=True) or {}
+    pasien_ids_input = data.get('pasien_ids')
+    tanggal_input = data.get('tanggal_program')
+    if not isinstance(pasien_ids_input, list) or not pasien_ids_input:
+        return jsonify({"msg": "pasien_ids wajib diisi berupa array yang tidak kosong"}), 400
+    if tanggal_input is None:
+        tanggal_input = [date.today().isoformat()]
+    elif not isinstance(tanggal_input, list) or not tanggal_input:
+        return jsonify({"msg": "tanggal_program harus berupa array tanggal (YYYY-MM-DD)"}), 400
+
+    try:
+        pasien_ids = sorted({int(pasien_id) for pasien_id in pasien_ids_input})
+        tanggal_list = sorted({datetime.strptime(t, '%Y-%m-%d').date() for t in tanggal_input})
+        status_program = ProgramStatus(data.get('status', ProgramStatus.BELUM_DIMULAI.value))
+    except (ValueError, TypeError):
+        return jsonify({"msg": "Format ID pasien, tanggal, atau status tidak valid"}), 400
+
+    if len(pasien_ids) * len(tanggal_list) > MAKS_PROGRAM_PER_ASSIGN:
+        return jsonify({"msg": f"Maksimal {MAKS_PROGRAM_PER_ASSIGN} program (pasien x tanggal) per permintaan"}), 400
+
+    pasien_ditemukan = {user_id for (user_id,) in db.session.query(AppUser.id)
+                        .filter(AppUser.id.in_(pasien_ids), AppUser.role == 'pasien').all()}
+    pasien_hilang = [pasien_id for pasien_id in pasien_ids if pasien_id not in pasien_ditemukan]
+    if pasien_hilang:
+        return jsonify({"msg": f"Pasien dengan ID {', '.join(str(p) for p in pasien_hilang)} tidak ditemukan"}), 404
+
+    nama_program = data.get('nama_program') or template.nama_template
+    catatan_terapis = data.get('catatan_terapis', template.catatan_terapis)
+    template_rows = [{"gerakan_id": d.gerakan_id, "jumlah_repetisi": d.jumlah_repetisi, "urutan": d.urutan} for d in template.details]
+
+    try:
+        program_rows = _insert_program_massal([{
+            "nama_program": nama_program,
+            "tanggal_program": tanggal_program,
+            "catatan_terapis": catatan_terapis,
+            "status": status_program,
+            "terapis_id": terapis_id,
+            "pasien_id": pasien_id
+        } for pasien_id in pasien_ids for tanggal_program in tanggal_list], template_rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Gagal meng-assign template program", "error": str(e)}), 500
+
+    return jsonify({
+        "msg": f"{len(program_rows)} program berhasil dibuat dari template",
+        "template_id": template_id,
+        "programs": sorted([{"id": program_id, "pasien_id": pasien_id, "tanggal_program": tanggal_program.isoformat()}
+                            for program_id, pasien_id, tanggal_program in program_rows],
+                           key=lambda p: (p["pasien_id"], p["tanggal_program"]))
+    }), 201
+
+
+def _buat_program_berulang(data, tanggal_mulai, status_program, terapis_id, pasien_id, detail_rows):
+    """
+    Mengekspansi `pengulangan` menjadi satu program per tanggal (insert multi-baris) yang terhubung ke ProgramSeries.
+    Respons berisi ringkasan seri, bukan serialisasi penuh setiap program.
+    """
+    try:
+        series, tanggal_list = _parse_pengulangan(data.get('pengulangan'), tanggal_mulai)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    series.terapis_id = terapis_id
+    series.pasien_id = pasien_id
+
+    try:
+        db.session.add(series)
+        db.session.flush()
+        program_rows = _insert_program_massal([{
+            "nama_program": data.get('nama_program'),
+            "tanggal_program": tanggal_program,
+            "catatan_terapis": data.get('catatan_terapis'),
+            "status": status_program,
+            "terapis_id": terapis_id,
+            "pasien_id": pasien_id,
+            "series_id": series.id
+        } for tanggal_program in tanggal_list], detail_rows)
+        series_data = series.serialize()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Gagal membuat program berulang", "error": str(e)}), 500
+
+    return jsonify({
+        "msg": f"{len(program_rows)} program berulang berhasil dibuat",
+        "series": series_data,
+        "jumlah_program": len(program_rows),
+        "programs": sorted([{"id": program_id, "tanggal_program": tanggal_program.isoformat()} for program_id, _, tanggal_program in program_rows],
+                           key=lambda p: p["tanggal_program"])
+    }), 201
+
+# --- ENDPOINT SERI PROGRAM BERULANG (TERAPIS) ---
+def _query_program_seri_mendatang(series_id, dari_tanggal):
+    """
+    Subquery ID program dalam seri yang masih bisa diubah: tanggal >= dari_tanggal, belum selesai, dan belum memiliki laporan.
+    """
+    sudah_dilaporkan = db.session.query(LaporanRehabilitasi.id)\
+        .filter(LaporanRehabilitasi.program_rehabilitasi_id == ProgramRehabilitasi.id).exists()
+    return db.session.query(ProgramRehabilitasi.id).filter(
+        ProgramRehabilitasi.series_id == series_id,
+        ProgramRehabilitasi.tanggal_program >= dari_tanggal,
+        ProgramRehabilitasi.status != ProgramStatus.SELESAI,
+        ~sudah_dilaporkan
+    )
+
+def _get_series_milik_terapis(series_id, terapis_id):
+    return ProgramSeries.query.filter_by(id=series_id, terapis_id=terapis_id).first()
+
+def _parse_dari_tanggal(nilai):
+    return datetime.strptime(nilai, '%Y-%m-%d').date() if nilai else date.today()
+
+@program_bp.route('/series/<int:series_id>', methods=['GET'])
+@jwt_required()
+def get_program_series(series_id):
+    current_user_identity = get_jwt_identity()
+    if current_user_identity.get('role') != 'terapis':
+        return jsonify({"msg": "Akses ditolak"}), 403
+
+    series = _get_series_milik_terapis(series_id, current_user_identity.get('id'))
+    if not series:
+        return jsonify({"msg": "Seri program tidak ditemukan"}), 404
+
+    programs = db.session.query(ProgramRehabilitasi.id, ProgramRehabilitasi.tanggal_program, ProgramRehabilitasi.status)\
+        .filter(ProgramRehabilitasi.series_id == series_id)\
+        .order_by(ProgramRehabilitasi.tanggal_program.asc()).all()
+    return jsonify({
+        "series": series.serialize(),
+        "jumlah_program": len(programs),
+        "programs": [{"id": program_id, "tanggal_program": tanggal_program.isoformat(), "status": status.value}
+                     for program_id, tanggal_program, status in programs]
+    }), 200
+
+@program_bp.route('/series/<int:series_id>', methods=['PUT'])
+@jwt_required()
+def update_program_series(series_id):
+    """
+    Menerapkan perubahan ke semua program dalam seri mulai `dari_tanggal` (default hari ini) yang belum selesai
+    dan belum dilaporkan: nama_program, catatan_terapis, status (satu UPDATE) dan/atau
+    list_gerakan_direncanakan (satu DELETE + satu insert multi-baris untuk semua program tersebut).
+    """
+    current_user_identity = get_jwt_identity()
+    if current_user_identity.get('role') != 'terapis':
+        return jsonify({"msg": "Akses ditolak"}), 403
+
+    series = _get_series_milik_terapis(series_id, current_user_identity.get('id'))
+    if not series:
+        return jsonify({"msg": "Seri program tidak ditemukan"}), 404
+
+    data = request.get_json(silent=True) or {}
+    nilai_baru = {}
+    if data.get('nama_program'):
+        nilai_baru['nama_program'] = data['nama_program']
+    if 'catatan_terapis' in data:
+        nilai_baru['catatan_terapis'] = data['catatan_terapis']
+    try:
+        dari_tanggal = _parse_dari_tanggal(data.get('dari_tanggal'))
+        if data.get('status'):
+            status_baru = ProgramStatus(data['status'])
+            if status_baru == ProgramStatus.SELESAI:
+                return jsonify({"msg": "Status selesai hanya dapat diberikan melalui laporan"}), 400
+            nilai_baru['status'] = status_baru
+    except (ValueError, TypeError):
+        return jsonify({"msg": "Format dari_tanggal atau status tidak valid"}), 400
+
+    detail_rows = None
+    if data.get('list_gerakan_direncanakan') is not None:
+        try:
+            detail_rows, _ = _validasi_list_gerakan(data['list_gerakan_direncanakan'])
+        except ValueError as e:
+            return jsonify({"msg": str(e)}), 400
+
+    if not nilai_baru and detail_rows is None:
+        return jsonify({"msg": "Tidak ada perubahan yang dikirim"}), 400
+
+    try:
+        program_ids = [program_id for (program_id,) in _query_program_seri_mendatang(series_id, dari_tanggal).all()]
+        if program_ids:
+            if nilai_baru:
+                db.session.execute(
+                    update(ProgramRehabilitasi).where(ProgramRehabilitasi.id.in_(program_ids))
+                    .values(updated_at=datetime.utcnow(), **nilai_baru),
+                    execution_options={"synchronize_session": False}
+                )
+            if detail_rows is not None:
+                db.session.execute(delete(ProgramGerakanDetail).where(ProgramGerakanDetail.program_id.in_(program_ids)),
+                                   execution_options={"synchronize_session": False})
+                db.session.execute(insert(ProgramGerakanDetail), [
+                    dict(row, program_id=program_id) for program_id in program_ids for row in detail_rows
+                ])
+                if not nilai_baru:
+                    db.session.execute(
+                        update(ProgramRehabilitasi).where(ProgramRehabilitasi.id.in_(program_ids)).values(updated_at=datetime.utcnow()),
+                        execution_options={"synchronize_session": False}
+                    )
+        series.updated_at = datetime.utcnow()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Gagal memperbarui seri program", "error": str(e)}), 500
+
+    return jsonify({
+        "msg": f"{len(program_ids)} program dalam seri berhasil diperbarui",
+        "jumlah_program_diperbarui": len(program_ids),
+        "program_ids": program_ids
+    }), 200
+
+@program_bp.route('/series/<int:series_id>', methods=['DELETE'])
+@jwt_required()
+def delete_program_series(series_id):
+    """
+    Menghapus program dalam seri mulai query param `dari_tanggal` (default hari ini) yang belum selesai dan belum dilaporkan.
+    Program yang sudah dilaporkan tetap ada; seri ikut dihapus jika tidak ada program tersisa.
+    """
+    current_user_identity = get_jwt_identity()
+    if current_user_identity.get('role') != 'terapis':
+        return jsonify({"msg": "Akses ditolak"}), 403
+
+    series = _get_series_milik_terapis(series_id, current_user_identity.get('id'))
+    if not series:
+        return jsonify({"msg": "Seri program tidak ditemukan"}), 404
+    try:
+        dari_tanggal = _parse_dari_tanggal(request.args.get('dari_tanggal'))
+    except ValueError:
+        return jsonify({"msg": "Format dari_tanggal tidak valid"}), 400
+
+    try:
+        program_ids = [program_id for (program_id,) in _query_program_seri_mendatang(series_id, dari_tanggal).all()]
+        if program_ids:
+            db.session.execute(delete(ProgramGerakanDetail).where(ProgramGerakanDetail.program_id.in_(program_ids)),
+                               execution_options={"synchronize_session": False})
+            db.session.execute(delete(ProgramRehabilitasi).where(ProgramRehabilitasi.id.in_(program_ids)),
+                               execution_options={"synchronize_session": False})
+        seri_dihapus = not db.session.query(ProgramRehabilitasi.id).filter(ProgramRehabilitasi.series_id == series_id).first()
+        if seri_dihapus:
+            db.session.delete(series)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Gagal menghapus seri program", "error": str(e)}), 500
+
+    return jsonify({
+        "msg": f"{len(program_ids)} program dalam seri berhasil dihapus",
+        "jumlah_program_dihapus": len(program_ids),
+        "series_dihapus": seri_dihapus
+    }), 200
+
+
 @program_bp.route('/pasien/today', methods=['GET'])
 @jwt_required()
 def get_program_pasien_today():
@@ -195,12 +646,29 @@ def get_program_history_pasien():
     pasien_id = current_user_identity.get('id')
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
-
-    paginated_programs = ProgramRehabilitasi.query.filter_by(pasien_id=pasien_id)\
-        .order_by(ProgramRehabilitasi.tanggal_program.desc(), ProgramRehabilitasi.created_at.desc())\
+    cursor = request.args.get('cursor')
+    try:
+        fieldset = fieldset_dari_request(ProgramRehabilitasi.FIELDSET_SPEC)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    query = ProgramRehabilitasi.query.filter_by(pasien_id=pasien_id)
+    if cursor is not None:
+        # Paging keyset: tanpa COUNT(*) dan OFFSET
+        try:
+            programs, next_cursor = keyset_paginate(query, URUTAN_RIWAYAT_PROGRAM, cursor, per_page,
+                                                    (date.fromisoformat, datetime.fromisoformat, int))
+        except InvalidCursorError as e:
+            return jsonify({"msg": str(e)}), 400
+        return jsonify({
+            "programs": ProgramRehabilitasi.serialize_full_batch(programs, fieldset),
+            "next_cursor": next_cursor
+        }), 200
+
+    paginated_programs = query.order_by(*keyset_order_by(URUTAN_RIWAYAT_PROGRAM))\
         .paginate(page=page, per_page=per_page, error_out=False)
     
-    results = [p.serialize_full() for p in paginated_programs.items]
+    results = ProgramRehabilitasi.serialize_full_batch(paginated_programs.items, fieldset)
 
     return jsonify({
         "programs": results,
@@ -230,7 +698,7 @@ def get_assigned_programs_for_patient(pasien_id):
     ).order_by(ProgramRehabilitasi.tanggal_program.desc(), ProgramRehabilitasi.created_at.desc())\
      .paginate(page=page, per_page=per_page, error_out=False)
 
-    results = [p.serialize_full() for p in paginated_programs.items]
+    results = ProgramRehabilitasi.serialize_full_batch(paginated_programs.items)
 
     return jsonify({
         "msg": f"Daftar program yang di-assign ke pasien {pasien.nama_lengkap} berhasil diambil",
@@ -285,7 +753,14 @@ def update_program_status(program_id):
        (new_status == ProgramStatus.SELESAI or new_status == ProgramStatus.DIBATALKAN):
         return jsonify({"msg": "Pasien tidak diizinkan mengubah status menjadi selesai atau dibatalkan langsung."}), 403
 
+    status_lama = program.status
     program.status = new_status
+
+    # Rollup statistik sesi hanya menghitung laporan dari program SELESAI,
+    # jadi bangun ulang rollup pasien jika program berlaporan keluar/masuk status SELESAI.
+    if (status_lama == ProgramStatus.SELESAI) != (new_status == ProgramStatus.SELESAI) and program.laporan_hasil:
+        PatientSessionStats.rebuild([program.pasien_id])
+
     db.session.commit()
 
     return jsonify({
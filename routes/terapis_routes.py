@@ -33,13 +33,12 @@ def get_my_patients_details():
     patients_list = []
     for patient_user, patient_profile in assigned_patients:
         if patient_profile:
-            profile_data = patient_profile.serialize_full()
             patients_list.append({
-                "id": profile_data.get('user_id'),
-                "nama": profile_data.get('nama_lengkap'),
-                "email": profile_data.get('email'),
-                "foto_url": profile_data.get('url_foto_profil'),
-                "diagnosis": profile_data.get('diagnosis', "Belum ada diagnosis")
+                "id": patient_user.id,
+                "nama": patient_user.nama_lengkap,
+                "email": patient_user.email,
+                "foto_url": patient_profile.url_foto_profil(),
+                "diagnosis": patient_profile.diagnosis
             })
         else:
             patients_list.append({
@@ -86,8 +85,7 @@ def get_terapis_dashboard_summary():
         .limit(2).all()
     
     program_terbaru_serialized = []
-    for p in program_terbaru_query:
-        program_data = p.serialize_full()
+    for program_data in ProgramRehabilitasi.serialize_full_batch(program_terbaru_query):
         program_terbaru_serialized.append({
             "id": program_data.get('id'),
             "program_name": program_data.get('nama_program'),
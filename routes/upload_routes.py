@@ -0,0 +1,204 @@
+# routes/upload_routes.py
+# Unggah media langsung ke storage (URL bertanda tangan) untuk foto/video/model gerakan, gambar badge,
+# dan foto profil pasien. Worker API hanya menerbitkan tiket dan melampirkan blob saat finalize;
+# file tidak melewati worker (kecuali di STORAGE_BACKEND lokal/memori). Lihat utils/direct_upload.py.
+# PERUBAHAN PERFORMA: Endpoint /stats untuk statistik connection pool storage dan durasi operasi media worker ini.
+
+import calendar
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from datetime import datetime, timedelta
+import uuid
+from models import db, Gerakan, Badge, PatientProfile, PendingMedia, PendingDeletion, MediaBlob
+from utils.direct_upload import TARGET_UNGGAH, buat_blob_name, backend_tiket, url_unggah, tanda_tangan_valid
+from utils.media_io import metrics as media_io_metrics
+from utils.media_dedup import metrics as dedup_metrics
+from utils.streaming_upload import anggaran_buffer
+from utils.storage_backend import storage
+from extensions import storage_clients
+from utils.gerakan_catalog import gerakan_catalog
+from utils.badge_catalog import badge_catalog
+
+upload_bp = Blueprint('upload_bp', __name__)
+
+MODEL_TARGET = {'Gerakan': Gerakan, 'Badge': Badge, 'PatientProfile': PatientProfile}
+
+
+def _cari_target(target, target_id, user_id, lock=False):
+    """Baris yang akan menerima media; foto profil selalu milik pasien yang login. lock=True: SELECT ... FOR UPDATE."""
+    if target.model == 'PatientProfile':
+        query = PatientProfile.query.filter_by(user_id=user_id)
+    elif target_id is not None:
+        query = MODEL_TARGET[target.model].query.filter_by(id=target_id)
+    else:
+        return None
+    if lock:
+        query = query.with_for_update()
+    return query.first()
+
+
+def _serialize_target(target, row):
+    if target.model == 'Gerakan':
+        return {"gerakan": row.serialize_full()}
+    if target.model == 'Badge':
+        return {"badge": row.serialize()}
+    return {"url_foto_profil": row.url_foto_profil()}
+
+
+@upload_bp.route('', methods=['POST'])
+@jwt_required()
+def buat_tiket_unggah():
+    """
+    Menerbitkan URL unggah bertanda tangan untuk satu file.
+    Body JSON: target, filename, content_type (opsional), target_id (wajib kecuali foto_profil).
+    """
+    current_user_identity = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+
+    target_key = data.get('target')
+    target = TARGET_UNGGAH.get(target_key)
+    if target is None:
+        return jsonify({"msg": f"target harus salah satu dari: {', '.join(TARGET_UNGGAH)}"}), 400
+    if current_user_identity.get('role') != target.role:
+        return jsonify({"msg": f"Akses ditolak: Hanya {target.role} yang bisa mengunggah {target_key}"}), 403
+
+    filename = data.get('filename')
+    if not filename or '.' not in filename:
+        return jsonify({"msg": "filename (dengan ekstensi) wajib diisi"}), 400
+    content_type = data.get('content_type') or 'application/octet-stream'
+
+    target_id = data.get('target_id')
+    if target.model != 'PatientProfile':
+        if not isinstance(target_id, int):
+            return jsonify({"msg": "target_id (integer) wajib diisi"}), 400
+    row = _cari_target(target, target_id, current_user_identity.get('id'))
+    if row is None:
+        return jsonify({"msg": f"{target.model} tidak ditemukan"}), 404
+
+    ttl = timedelta(minutes=current_app.config.get('DIRECT_UPLOAD_TTL_MINUTES', 15))
+    pending = PendingMedia(
+        upload_id=uuid.uuid4().hex,
+        user_id=current_user_identity.get('id'),
+        target=target_key,
+        target_id=row.id,
+        storage=storage(target.jenis).nama,
+        blob_name=buat_blob_name(target, filename),
+        content_type=content_type,
+        expires_at=datetime.utcnow().replace(microsecond=0) + ttl
+    )
+
+    url, headers, err = url_unggah(pending)
+    if err:
+        return jsonify({"msg": "Gagal membuat URL unggah", "error": err}), 500
+
+    try:
+        db.session.add(pending)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Gagal menyimpan tiket unggah: {str(e)}")
+        return jsonify({"msg": "Gagal membuat tiket unggah", "error": str(e)}), 500
+
+    return jsonify({
+        **pending.serialize(),
+        "upload_url": url,
+        "method": "PUT",
+        "headers": headers
+    }), 201
+
+
+@upload_bp.route('/<string:upload_id>/finalize', methods=['POST'])
+@jwt_required()
+def finalize_unggah(upload_id):
+    """Melampirkan blob yang sudah diunggah ke baris target; referensi ke blob lama dilepas (lihat MediaBlob.lepas)."""
+    current_user_identity = get_jwt_identity()
+    pending = PendingMedia.query.filter_by(upload_id=upload_id, user_id=current_user_identity.get('id')).first()
+    if pending is None:
+        return jsonify({"msg": "Tiket unggah tidak ditemukan"}), 404
+    if pending.finalized_at:
+        return jsonify({"msg": "Tiket unggah sudah difinalisasi"}), 409
+    if pending.expires_at <= datetime.utcnow():
+        return jsonify({"msg": "Tiket unggah sudah kedaluwarsa"}), 410
+
+    target = TARGET_UNGGAH[pending.target]
+    storage_backend = backend_tiket(pending)
+    try:
+        if not storage_backend.exists(pending.blob_name):
+            return jsonify({"msg": "File belum diunggah ke storage"}), 409
+    except Exception as e:
+        current_app.logger.error(f"Gagal memeriksa blob {pending.blob_name}: {str(e)}")
+        return jsonify({"msg": "Gagal memeriksa file di storage", "error": str(e)}), 502
+
+    try:
+        # Klaim tiket dengan UPDATE bersyarat: dari finalize bersamaan untuk tiket yang sama hanya satu yang lolos,
+        # sehingga referensi blob lama tidak dilepas dua kali
+        sekarang = datetime.utcnow()
+        diklaim = PendingMedia.query.filter(PendingMedia.id == pending.id, PendingMedia.finalized_at.is_(None))\
+            .update({PendingMedia.finalized_at: sekarang}, synchronize_session=False)
+        if diklaim == 0:
+            db.session.rollback()
+            return jsonify({"msg": "Tiket unggah sudah difinalisasi"}), 409
+
+        # Baris target dikunci agar blob lama dibaca dan dilepas sekali meski tiket lain untuk baris yang sama difinalisasi bersamaan
+        row = _cari_target(target, pending.target_id, pending.user_id, lock=True)
+        if row is None:
+            db.session.rollback()
+            return jsonify({"msg": f"{target.model} tidak ditemukan"}), 404
+
+        blob_lama = getattr(row, target.atribut)
+        if blob_lama != pending.blob_name:
+            MediaBlob.lepas(blob_lama, target.jenis)
+        setattr(row, target.atribut, pending.blob_name)
+        row.updated_at = sekarang
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Gagal finalize unggahan {upload_id}: {str(e)}")
+        return jsonify({"msg": "Gagal melampirkan media", "error": str(e)}), 500
+
+    if target.model == 'Gerakan':
+        gerakan_catalog.invalidate()
+    elif target.model == 'Badge':
+        badge_catalog.invalidate()
+
+    return jsonify({"msg": "Media berhasil dilampirkan", **pending.serialize(), **_serialize_target(target, row)}), 200
+
+
+@upload_bp.route('/<string:upload_id>/lokal', methods=['PUT'])
+def unggah_lokal(upload_id):
+    """
+    Unggah langsung untuk STORAGE_BACKEND lokal/memori: menerima PUT ke URL bertanda tangan dan menulis
+    body ke backend storage per chunk. Diautentikasi dengan tanda tangan URL, bukan JWT, seperti URL SAS/signed URL.
+    """
+    pending = PendingMedia.query.filter_by(upload_id=upload_id).first()
+    expires = request.args.get('expires', type=int)
+    if pending is None or expires is None or not tanda_tangan_valid(upload_id, expires, request.args.get('signature')):
+        return jsonify({"msg": "Tanda tangan URL tidak valid"}), 403
+    if expires != calendar.timegm(pending.expires_at.utctimetuple()) or pending.expires_at <= datetime.utcnow():
+        return jsonify({"msg": "URL unggah sudah kedaluwarsa"}), 403
+    if pending.finalized_at:
+        return jsonify({"msg": "Tiket unggah sudah difinalisasi"}), 409
+
+    storage_backend = backend_tiket(pending)
+    if not storage_backend.disajikan_aplikasi:
+        return jsonify({"msg": "Unggah ke URL storage cloud dari tiket"}), 409
+
+    storage_backend.put(pending.blob_name, request.stream, pending.content_type)
+    return jsonify({"msg": "File tersimpan", "ukuran": request.content_length}), 201
+
+
+@upload_bp.route('/stats', methods=['GET'])
+@jwt_required()
+def statistik_storage():
+    """Statistik operasi media proses worker ini (connection pool storage, durasi unggah/hapus, buffer unggahan, deduplikasi) dan antrean penghapusan."""
+    current_user_identity = get_jwt_identity()
+    if current_user_identity.get('role') != 'terapis':
+        return jsonify({"msg": "Akses ditolak"}), 403
+    antrean = db.session.query(PendingDeletion.status, db.func.count(PendingDeletion.id)).group_by(PendingDeletion.status).all()
+    return jsonify({
+        "pool": storage_clients.snapshot(),
+        "operasi": media_io_metrics.snapshot(),
+        "buffer_unggah": anggaran_buffer().snapshot(),
+        "antrean_penghapusan": {status.value: jumlah for status, jumlah in antrean},
+        "dedup": dedup_metrics.snapshot()
+    }), 200
@@ -1,19 +1,27 @@
 # BE-RESTRO/utils/azure_helpers.py
 # tambah
+# PERUBAHAN PERFORMA: BlobServiceClient dipakai ulang dari registry ber-pool (extensions.storage_clients), bukan dibuat per panggilan.
+# PERUBAHAN BARU: buat_url_unggah_sas dan blob_ada untuk unggah langsung ke storage (utils/direct_upload.py).
+# PERUBAHAN PERFORMA: unggah_blob mengunggah per blok (stage_block/commit_block_list) tanpa memuat seluruh file ke memori.
+# PERUBAHAN BARU: Helper di sini hanya operasi Azure per nama blob (unggah_blob, unduh_blob, hapus_blob_batch, dst.);
+# route memakai antarmuka storage yang dipilih lewat konfigurasi (utils/storage_backend.py).
 import os
-import uuid
 from flask import current_app # <--- PASTIKAN INI ADA
 # 1. Import tambahan: BlobClient dan ContentSettings
-from azure.storage.blob import BlobServiceClient, BlobClient, ContentSettings
+from azure.storage.blob import BlobClient, ContentSettings, BlobSasPermissions, generate_blob_sas
+from utils.streaming_upload import stage_blok_azure
+from extensions import storage_clients
+
+AZURE_MAKS_BATCH = 256 # Batas sub-request per Blob Batch API
 
 def _get_blob_service_client():
-    """Membuat dan mengembalikan client untuk Azure Blob Service."""
-    connect_str = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
-    if not connect_str:
+    """Mengembalikan client Azure Blob Service bersama (dibuat sekali per worker, lihat utils/storage_clients.py)."""
+    try:
+        return storage_clients.azure()
+    except ValueError as e:
         # Menggunakan current_app.logger untuk logging
-        current_app.logger.error("AZURE_STORAGE_CONNECTION_STRING environment variable not set.")
-        raise ValueError("AZURE_STORAGE_CONNECTION_STRING environment variable not set.")
-    return BlobServiceClient.from_connection_string(connect_str)
+        current_app.logger.error(str(e))
+        raise
 
 def get_blob_url(blob_name):
     """Membangun URL publik lengkap untuk sebuah blob."""
@@ -29,37 +37,21 @@ def get_blob_url(blob_name):
 
     return f"https://{storage_account_name}.blob.core.windows.net/{container_name}/{blob_name}"
 
-def upload_file_to_blob(file_storage, subfolder_path):
+def unggah_blob(blob_name, stream, content_type=None):
     """
-    Mengunggah file ke subfolder tertentu di Azure Blob Storage.
-    :param file_storage: Objek file dari request.files.
-    :param subfolder_path: Path tujuan di dalam container, contoh: 'gerakan/foto' atau 'badges'.
-    :return: Tuple (nama_blob, error_message). nama_blob adalah path lengkap di container.
+    Mengunggah stream ke blob_name di container (per blok, lihat utils/streaming_upload.py).
+    Melempar exception jika gagal. Mengembalikan jumlah byte yang diunggah.
     """
-    if not file_storage or not file_storage.filename:
-        return None, "No file selected for upload."
+    blob_client = _get_blob_service_client().get_blob_client(container=os.getenv('AZURE_STORAGE_CONTAINER_NAME'), blob=blob_name)
+    content_settings = ContentSettings(content_type=content_type)
+    # Streaming per blok langsung dari stream request
+    return stage_blok_azure(blob_client, stream, content_settings=content_settings)
 
-    try:
-        blob_service_client = _get_blob_service_client()
-        container_name = os.getenv('AZURE_STORAGE_CONTAINER_NAME')
-
-        extension = file_storage.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4().hex}.{extension}"
-        blob_name = f"{subfolder_path}/{unique_filename}"
-
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-
-        content_settings = ContentSettings(content_type=file_storage.content_type)
-        
-        file_storage.seek(0)
-        
-        blob_client.upload_blob(file_storage.read(), content_settings=content_settings)
-
-        return blob_name, None
-
-    except Exception as e:
-        current_app.logger.error(f"Failed to upload to Azure Blob Storage: {str(e)}")
-        return None, f"Failed to upload file to cloud storage: {str(e)}"
+def unduh_blob(blob_name, start=0, end=None):
+    """Iterator chunk isi blob dari byte `start` sampai `end` (inklusif, None = akhir blob)."""
+    blob_client = _get_blob_service_client().get_blob_client(container=os.getenv('AZURE_STORAGE_CONTAINER_NAME'), blob=blob_name)
+    length = end - start + 1 if end is not None else None
+    return blob_client.download_blob(offset=start, length=length).chunks()
 
 def delete_blob(blob_name):
     """Menghapus sebuah blob dari Azure Blob Storage."""
@@ -79,3 +71,67 @@ def delete_blob(blob_name):
              return True
         current_app.logger.error(f"Failed to delete blob '{blob_name}': {str(e)}")
         return False
+
+def hapus_blob_batch(blob_names):
+    """
+    Menghapus banyak blob dengan Blob Batch API (maks. 256 per request).
+    Blob yang tidak ada dianggap terhapus. Mengembalikan dict nama_blob -> pesan error untuk yang gagal.
+    """
+    container_client = _get_blob_service_client().get_container_client(os.getenv('AZURE_STORAGE_CONTAINER_NAME'))
+    gagal = {}
+    for i in range(0, len(blob_names), AZURE_MAKS_BATCH):
+        bagian = blob_names[i:i + AZURE_MAKS_BATCH]
+        try:
+            responses = container_client.delete_blobs(*bagian, raise_on_any_failure=False)
+        except Exception as e:
+            current_app.logger.error(f"Failed to batch delete {len(bagian)} blobs: {str(e)}")
+            gagal.update({nama: str(e) for nama in bagian})
+            continue
+        for nama, response in zip(bagian, responses):
+            if response.status_code not in (202, 404):
+                gagal[nama] = f"HTTP {response.status_code}: {response.reason}"
+    current_app.logger.info(f"Batch delete {len(blob_names)} blobs, {len(gagal)} gagal.")
+    return gagal
+
+def daftar_blob(prefix):
+    """Iterator (nama_blob, last_modified) untuk semua blob dengan awalan `prefix`."""
+    container_client = _get_blob_service_client().get_container_client(os.getenv('AZURE_STORAGE_CONTAINER_NAME'))
+    for blob in container_client.list_blobs(name_starts_with=prefix):
+        yield blob.name, blob.last_modified
+
+def _akun_dari_connection_string():
+    """Nama akun dan account key dari AZURE_STORAGE_CONNECTION_STRING (dibutuhkan untuk menandatangani SAS)."""
+    connect_str = os.getenv('AZURE_STORAGE_CONNECTION_STRING') or ''
+    bagian = dict(part.split('=', 1) for part in connect_str.split(';') if '=' in part)
+    return bagian.get('AccountName') or os.getenv('AZURE_STORAGE_ACCOUNT_NAME'), bagian.get('AccountKey')
+
+def buat_url_unggah_sas(blob_name, content_type, kedaluwarsa):
+    """
+    Membuat URL SAS berumur pendek yang hanya mengizinkan membuat/menulis satu blob.
+    :return: Tuple (url, headers_wajib, error_message). Klien mengunggah dengan PUT ke url beserta headers.
+    """
+    try:
+        account_name, account_key = _akun_dari_connection_string()
+        container_name = os.getenv('AZURE_STORAGE_CONTAINER_NAME')
+        if not account_name or not account_key or not container_name:
+            return None, None, "Konfigurasi Azure (AccountName/AccountKey/container) untuk SAS tidak lengkap."
+        sas = generate_blob_sas(
+            account_name=account_name,
+            container_name=container_name,
+            blob_name=blob_name,
+            account_key=account_key,
+            permission=BlobSasPermissions(create=True, write=True),
+            expiry=kedaluwarsa,
+            content_type=content_type
+        )
+        url = f"https://{account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas}"
+        return url, {"x-ms-blob-type": "BlockBlob", "Content-Type": content_type}, None
+    except Exception as e:
+        current_app.logger.error(f"Failed to create SAS for blob '{blob_name}': {str(e)}")
+        return None, None, f"Gagal membuat URL unggah: {str(e)}"
+
+def blob_ada(blob_name):
+    """True jika blob sudah ada di container."""
+    blob_service_client = _get_blob_service_client()
+    container_name = os.getenv('AZURE_STORAGE_CONTAINER_NAME')
+    return blob_service_client.get_blob_client(container=container_name, blob=blob_name).exists()
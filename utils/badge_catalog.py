@@ -0,0 +1,57 @@
+# utils/badge_catalog.py
+# Cache katalog badge in-process: array ambang batas poin yang terurut, dipakai untuk
+# menentukan badge yang baru terlewati (bisect) tanpa query per badge.
+# Cache diberi versi (jumlah badge + updated_at terbaru) sehingga perubahan dari worker lain
+# ikut terdeteksi, dan diinvalidasi langsung saat badge dibuat/diubah/dihapus di worker ini.
+
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+
+BadgeEntry = namedtuple('BadgeEntry', ['id', 'name', 'point_threshold'])
+
+
+class BadgeCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._thresholds = []
+        self._entries = []
+        self._by_id = {}
+
+    def _current_version(self):
+        from models import db, Badge
+        return tuple(db.session.query(db.func.count(Badge.id), db.func.max(Badge.updated_at)).one())
+
+    def _ensure_fresh(self):
+        from models import db, Badge
+
+        version = self._current_version()
+        if version == self._version:
+            return
+        rows = db.session.query(Badge.id, Badge.name, Badge.point_threshold).order_by(Badge.point_threshold.asc()).all()
+        entries = [BadgeEntry(*row) for row in rows]
+        with self._lock:
+            self._entries = entries
+            self._thresholds = [entry.point_threshold for entry in entries]
+            self._by_id = {entry.id: entry for entry in entries}
+            self._version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def crossed(self, old_points, new_points):
+        """Badge dengan old_points < point_threshold <= new_points, terurut menaik."""
+        self._ensure_fresh()
+        with self._lock:
+            start = bisect_right(self._thresholds, old_points)
+            stop = bisect_right(self._thresholds, new_points)
+            return self._entries[start:stop]
+
+    def get(self, badge_id):
+        """Entri badge dari cache (tanpa memeriksa versi), atau None."""
+        return self._by_id.get(badge_id)
+
+
+badge_catalog = BadgeCatalog()
@@ -0,0 +1,64 @@
+# utils/direct_upload.py
+# Unggah media dua tahap langsung ke storage, sehingga worker API hanya menangani metadata:
+#   1. Server menerbitkan URL unggah bertanda tangan berumur pendek (Azure SAS / GCS signed URL V4)
+#      beserta baris PendingMedia.
+#   2. Klien mengirim file dengan PUT langsung ke URL tersebut.
+#   3. Klien memanggil finalize; server memastikan blob sudah ada lalu melampirkannya ke baris target.
+# Backend storage lokal/memori (STORAGE_BACKEND, lihat utils/storage_backend.py) tidak punya URL bertanda tangan
+# sendiri: URL unggah menunjuk ke endpoint PUT aplikasi ini yang ditandatangani HMAC, sehingga alur lengkap
+# dapat diuji tanpa cloud.
+
+import calendar
+import hashlib
+import hmac
+from collections import namedtuple
+from flask import current_app, url_for
+from utils.gcs_helpers import GCS_DESTINATION_FOLDER_MODELS
+from utils.storage_backend import storage, nama_unik, JENIS_MEDIA, JENIS_MODEL
+
+# role  : role yang boleh mengunggah
+# jenis : jenis file untuk pemilihan backend storage (JENIS_MEDIA atau JENIS_MODEL)
+# folder: subfolder key, sama dengan unggahan lewat form; awalan: awalan nama file
+# model : nama kelas model target, atribut: kolom yang diisi ref file
+TargetUnggah = namedtuple('TargetUnggah', ['role', 'jenis', 'folder', 'awalan', 'model', 'atribut'])
+
+TARGET_UNGGAH = {
+    'gerakan_foto': TargetUnggah('terapis', JENIS_MEDIA, 'gerakan/foto', '', 'Gerakan', 'blob_name_foto'),
+    'gerakan_video': TargetUnggah('terapis', JENIS_MEDIA, 'gerakan/video', '', 'Gerakan', 'blob_name_video'),
+    'gerakan_model_tflite': TargetUnggah('terapis', JENIS_MODEL, GCS_DESTINATION_FOLDER_MODELS, 'model_', 'Gerakan', 'gcs_uri_model_tflite'),
+    'badge_image': TargetUnggah('terapis', JENIS_MEDIA, 'badges', '', 'Badge', 'filename_image'),
+    'foto_profil': TargetUnggah('pasien', JENIS_MEDIA, 'profil/foto', '', 'PatientProfile', 'filename_foto_profil'),
+}
+
+
+def buat_blob_name(target, filename):
+    """Ref unik untuk file target (nama blob, atau URI gs:// untuk model di GCS)."""
+    return storage(target.jenis).ref(nama_unik(target.folder, filename, target.awalan))
+
+
+def backend_tiket(pending):
+    """Backend storage tempat file tiket berada."""
+    return storage(TARGET_UNGGAH[pending.target].jenis)
+
+
+def tanda_tangan(upload_id, expires):
+    pesan = f"{upload_id}:{expires}".encode()
+    return hmac.new(current_app.config['JWT_SECRET_KEY'].encode(), pesan, hashlib.sha256).hexdigest()
+
+
+def tanda_tangan_valid(upload_id, expires, signature):
+    return hmac.compare_digest(tanda_tangan(upload_id, expires), signature or '')
+
+
+def url_unggah(pending):
+    """
+    URL unggah untuk tiket: SAS/signed URL dari storage cloud, atau PUT /api/uploads/<upload_id>/lokal
+    (HMAC + kedaluwarsa) untuk backend yang disajikan aplikasi. Tuple (url, headers_wajib, error_message).
+    """
+    backend = backend_tiket(pending)
+    if not backend.disajikan_aplikasi:
+        return backend.url_unggah(pending.blob_name, pending.content_type, pending.expires_at)
+    expires = calendar.timegm(pending.expires_at.utctimetuple())
+    url = url_for('upload_bp.unggah_lokal', upload_id=pending.upload_id, expires=expires,
+                  signature=tanda_tangan(pending.upload_id, expires), _external=True)
+    return url, {"Content-Type": pending.content_type}, None
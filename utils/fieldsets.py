@@ -0,0 +1,89 @@
+# utils/fieldsets.py
+# Sparse fieldset untuk serializer di models.py (query param `fields=` dan `include=`).
+# - `fields`  : daftar field yang dikembalikan, dipisah koma. Field bertingkat memakai titik,
+#               mis. `list_gerakan_direncanakan.nama_gerakan` (field relasi hanya berisi sub-field tersebut).
+# - `include` : relasi (objek/daftar bersarang) yang disertakan secara utuh.
+# Tanpa keduanya serializer mengembalikan payload lengkap seperti sebelumnya. Dengan `include` saja,
+# semua field non-relasi ditambah relasi yang disebut. Data relasi yang tidak diminta tidak di-query.
+
+
+class FieldSet:
+    """Pilihan field untuk satu level serializer; keys None berarti semua field."""
+
+    def __init__(self, keys=None, nested=None):
+        self.keys = keys
+        self.nested = nested or {}
+
+    @property
+    def is_all(self):
+        return self.keys is None
+
+    def wants(self, key):
+        return self.keys is None or key in self.keys
+
+    def wants_any(self, *keys):
+        return any(self.wants(key) for key in keys)
+
+    def sub(self, key):
+        """FieldSet untuk relasi `key` (semua field jika tidak dibatasi dengan notasi titik)."""
+        return self.nested.get(key, ALL_FIELDS)
+
+    def pick(self, data):
+        if self.keys is None:
+            return data
+        return {key: value for key, value in data.items() if key in self.keys}
+
+
+ALL_FIELDS = FieldSet()
+
+
+def _split(value):
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+def parse_fieldset(fields, include, spec):
+    """
+    Membangun FieldSet dari nilai query param `fields` dan `include`.
+    `spec` adalah dict dengan kunci:
+      - "id"        : field identitas yang selalu disertakan,
+      - "fields"    : field non-relasi,
+      - "relations" : {nama_relasi: tuple sub-field yang boleh dipilih dengan notasi titik}.
+    Melempar ValueError jika ada field atau relasi yang tidak dikenal.
+    """
+    field_list, include_list = _split(fields), _split(include)
+    if not field_list and not include_list:
+        return ALL_FIELDS
+
+    relations = spec["relations"]
+    unknown_include = [name for name in include_list if name not in relations]
+    if unknown_include:
+        raise ValueError(f"include tidak dikenal: {', '.join(unknown_include)}. Pilihan: {', '.join(relations)}")
+
+    keys = {spec["id"]} | set(include_list)
+    nested = {}
+    if not field_list:
+        keys |= set(spec["fields"])
+    for name in field_list:
+        top, _, child = name.partition('.')
+        if child:
+            if top not in relations or child not in relations[top]:
+                raise ValueError(f"Field tidak dikenal: {name}")
+            keys.add(top)
+            if top not in include_list:
+                nested.setdefault(top, set()).add(child)
+        elif top in relations or top in spec["fields"] or top == spec["id"]:
+            keys.add(top)
+            nested.pop(top, None)
+        else:
+            raise ValueError(f"Field tidak dikenal: {name}")
+    # Relasi yang diminta utuh (tanpa titik) tidak dibatasi sub-fieldnya
+    for name in field_list:
+        if '.' not in name and name in nested:
+            nested.pop(name)
+    return FieldSet(keys, {top: FieldSet(children) for top, children in nested.items()})
+
+
+def fieldset_dari_request(spec):
+    """parse_fieldset dari query param `fields` dan `include` request aktif."""
+    from flask import request
+    return parse_fieldset(request.args.get('fields'), request.args.get('include'), spec)
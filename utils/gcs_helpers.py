@@ -1,9 +1,14 @@
 # utils/gcs_helpers.py
 # Modul helper baru untuk interaksi dengan Google Cloud Storage dan Vertex AI.
+# PERUBAHAN PERFORMA: storage.Client dipakai ulang dari registry ber-pool (extensions.storage_clients) dengan timeout dan retry.
+# PERUBAHAN BARU: buat_signed_url_unggah dan blob_gcs_ada untuk unggah langsung ke storage (utils/direct_upload.py).
+# PERUBAHAN PERFORMA: upload_file_to_gcs memakai resumable upload per chunk (utils/streaming_upload.py).
+# PERUBAHAN BARU: unduh_objek_gcs, hapus_objek_gcs_batch, dan daftar_objek_gcs untuk antarmuka storage (utils/storage_backend.py).
 
-from google.cloud import storage
 import os
 from flask import current_app # Diperlukan untuk logging
+from utils.streaming_upload import unggah_resumable_gcs, ukuran_chunk
+from extensions import storage_clients
 
 # --- Konfigurasi GCS ---
 # Ganti dengan nama bucket GCS yang Anda gunakan untuk data training.
@@ -17,15 +22,18 @@ GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "data-rehab-restro")
 GCS_DESTINATION_FOLDER_RAW_VIDEOS = os.getenv("GCS_RAW_VIDEOS_FOLDER", "data_training_raw_videos/")
 GCS_DESTINATION_FOLDER_MODELS = os.getenv("GCS_MODELS_FOLDER", "trained_tflite_models/")
 
+GCS_MAKS_BATCH = 100 # Batas sub-request per batch request GCS yang disarankan
 
-# Inisialisasi klien GCS.
+
+# Klien GCS bersama (dibuat sekali per worker dengan connection pool, lihat utils/storage_clients.py).
 # Library akan otomatis menggunakan kunci dari environment variable GOOGLE_APPLICATION_CREDENTIALS
 # atau kredensial yang dikonfigurasi di lingkungan GCP.
-try:
-    storage_client = storage.Client()
-except Exception as e:
-    current_app.logger.error(f"Failed to initialize Google Cloud Storage client: {e}")
-    storage_client = None # Set to None if initialization fails
+def _get_storage_client():
+    try:
+        return storage_clients.gcs()
+    except Exception as e:
+        current_app.logger.error(f"Failed to initialize Google Cloud Storage client: {e}")
+        return None # None jika kredensial tidak tersedia
 
 def upload_file_to_gcs(file_stream, destination_blob_name, content_type=None):
     """
@@ -40,18 +48,17 @@ def upload_file_to_gcs(file_stream, destination_blob_name, content_type=None):
     Returns:
         tuple: (URL_GCS_file, error_message)
     """
+    storage_client = _get_storage_client()
     if storage_client is None:
         return None, "Google Cloud Storage client not initialized. Check credentials."
 
     try:
         bucket = storage_client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(destination_blob_name)
         
-        # Pastikan file stream berada di awal sebelum diunggah
-        file_stream.seek(0)
-        
-        # Upload blob dengan content type yang benar
-        blob.upload_from_file(file_stream, content_type=content_type)
+        # Resumable upload per chunk dengan content type yang benar (stream diputar ke awal di helper)
+        # if_generation_match=0: nama objek unik, sehingga retry unggahan aman (tidak menimpa objek lain)
+        unggah_resumable_gcs(bucket, destination_blob_name, file_stream, content_type=content_type,
+                             timeout=storage_clients.timeout, if_generation_match=0, retry=storage_clients.gcs_retry())
         
         # Membuat URL yang dapat diakses publik (jika bucket dikonfigurasi untuk akses publik)
         # Atau URL yang ditandatangani jika akses publik tidak diinginkan.
@@ -65,12 +72,13 @@ def upload_file_to_gcs(file_stream, destination_blob_name, content_type=None):
 
 def delete_file_from_gcs(blob_name):
     """Menghapus sebuah blob dari Google Cloud Storage."""
+    storage_client = _get_storage_client()
     if storage_client is None:
         return False, "Google Cloud Storage client not initialized."
     try:
         bucket = storage_client.bucket(GCS_BUCKET_NAME)
         blob = bucket.blob(blob_name)
-        blob.delete()
+        blob.delete(timeout=storage_clients.timeout, retry=storage_clients.gcs_retry())
         current_app.logger.info(f"SUKSES: File '{blob_name}' dihapus dari GCS.")
         return True, None
     except Exception as e:
@@ -80,6 +88,83 @@ def delete_file_from_gcs(blob_name):
         current_app.logger.error(f"GAGAL: Menghapus file dari GCS gagal. Error: {e}")
         return False, f"Gagal menghapus file dari Google Cloud Storage: {str(e)}"
 
+def buat_signed_url_unggah(blob_name, content_type, kedaluwarsa):
+    """
+    Membuat signed URL (V4) berumur pendek untuk PUT satu objek ke bucket.
+    Membutuhkan kredensial service account yang dapat menandatangani.
+
+    Returns:
+        tuple: (url, headers_wajib, error_message)
+    """
+    storage_client = _get_storage_client()
+    if storage_client is None:
+        return None, None, "Google Cloud Storage client not initialized."
+    try:
+        blob = storage_client.bucket(GCS_BUCKET_NAME).blob(blob_name)
+        url = blob.generate_signed_url(version="v4", expiration=kedaluwarsa, method="PUT", content_type=content_type)
+        return url, {"Content-Type": content_type}, None
+    except Exception as e:
+        current_app.logger.error(f"GAGAL: Membuat signed URL GCS untuk '{blob_name}'. Error: {e}")
+        return None, None, f"Gagal membuat URL unggah: {str(e)}"
+
+def blob_gcs_ada(blob_name):
+    """True jika objek sudah ada di bucket."""
+    storage_client = _get_storage_client()
+    if storage_client is None:
+        raise RuntimeError("Google Cloud Storage client not initialized.")
+    return storage_client.bucket(GCS_BUCKET_NAME).blob(blob_name).exists(timeout=storage_clients.timeout, retry=storage_clients.gcs_retry())
+
+def unduh_objek_gcs(blob_name, start=0, end=None, chunk_size=None):
+    """Iterator chunk isi objek dari byte `start` sampai `end` (inklusif, None = akhir objek), satu request per chunk."""
+    storage_client = _get_storage_client()
+    if storage_client is None:
+        raise RuntimeError("Google Cloud Storage client not initialized.")
+    blob = storage_client.bucket(GCS_BUCKET_NAME).blob(blob_name)
+    if end is None:
+        blob.reload(timeout=storage_clients.timeout, retry=storage_clients.gcs_retry())
+        end = blob.size - 1
+    chunk_size = chunk_size or ukuran_chunk()
+    for awal in range(start, end + 1, chunk_size):
+        yield blob.download_as_bytes(start=awal, end=min(awal + chunk_size, end + 1) - 1,
+                                     timeout=storage_clients.timeout, retry=storage_clients.gcs_retry())
+
+def hapus_objek_gcs_batch(blob_names):
+    """
+    Menghapus banyak objek dengan batch request JSON API (maks. 100 per request).
+    Objek yang tidak ada dianggap terhapus. Mengembalikan dict nama_blob -> pesan error untuk yang gagal.
+    """
+    storage_client = _get_storage_client()
+    if storage_client is None:
+        return {nama: "Google Cloud Storage client not initialized." for nama in blob_names}
+    bucket = storage_client.bucket(GCS_BUCKET_NAME)
+    gagal = {}
+    for i in range(0, len(blob_names), GCS_MAKS_BATCH):
+        bagian = blob_names[i:i + GCS_MAKS_BATCH]
+        try:
+            batch = storage_client.batch(raise_exception=False)
+            with batch:
+                for nama in bagian:
+                    bucket.blob(nama).delete(timeout=storage_clients.timeout)
+        except Exception as e:
+            current_app.logger.error(f"GAGAL: Batch delete {len(bagian)} objek GCS. Error: {e}")
+            gagal.update({nama: str(e) for nama in bagian})
+            continue
+        # Status per sub-request hanya tersedia di respons batch setelah finish()
+        for nama, response in zip(bagian, getattr(batch, '_responses', [])):
+            if not 200 <= response.status_code < 300 and response.status_code != 404:
+                gagal[nama] = f"HTTP {response.status_code}: {response.reason}"
+    current_app.logger.info(f"Batch delete {len(blob_names)} objek GCS, {len(gagal)} gagal.")
+    return gagal
+
+def daftar_objek_gcs(prefix):
+    """Iterator (nama_blob, waktu_update) untuk semua objek dengan awalan `prefix`."""
+    storage_client = _get_storage_client()
+    if storage_client is None:
+        raise RuntimeError("Google Cloud Storage client not initialized.")
+    for blob in storage_client.list_blobs(GCS_BUCKET_NAME, prefix=prefix, timeout=storage_clients.timeout,
+                                          retry=storage_clients.gcs_retry()):
+        yield blob.name, blob.updated
+
 def get_gcs_url(blob_name):
     """Membangun URL publik untuk sebuah blob GCS."""
     if not blob_name:
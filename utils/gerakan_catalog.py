@@ -0,0 +1,109 @@
+# utils/gerakan_catalog.py
+# Cache katalog gerakan in-process: hasil Gerakan.serialize_full per gerakan (info pembuat dan URL media)
+# disimpan per versi katalog. Versi = (jumlah gerakan, updated_at terbaru) dibaca dengan satu query,
+# sehingga perubahan dari worker lain ikut terdeteksi; create/update/delete di worker ini juga
+# menginvalidasi cache secara langsung. Versi yang sama dipakai sebagai dasar ETag respons katalog.
+# Catatan: perubahan data pembuat (AppUser) tidak mengubah versi katalog.
+
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import request, current_app
+from utils.fieldsets import ALL_FIELDS
+
+DEFAULT_MAKS_ENTRI = 5000
+CACHE_CONTROL_KATALOG = 'private, no-cache' # Klien boleh menyimpan, tetapi wajib revalidasi dengan ETag
+
+
+class GerakanCatalog:
+    def __init__(self, maks_entri=DEFAULT_MAKS_ENTRI):
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries = OrderedDict() # gerakan_id -> dict serialize_full, urutan LRU
+        self._maks_entri = maks_entri
+
+    def _current_version(self):
+        from models import db, Gerakan
+        return tuple(db.session.query(db.func.count(Gerakan.id), db.func.max(Gerakan.updated_at)).one())
+
+    def version(self):
+        """Versi katalog saat ini; cache dikosongkan jika versi berubah sejak terakhir dibaca."""
+        version = self._current_version()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+        return version
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+            self._entries.clear()
+
+    def serialize(self, gerakan_list, version, fieldset=ALL_FIELDS):
+        """
+        serialize_full untuk daftar gerakan dari cache. Gerakan yang belum ada di cache diserialisasi
+        sekali (pembuatnya dimuat dengan satu query) lalu disimpan jika versi katalog belum berubah.
+        """
+        from models import AppUser
+
+        gerakan_list = list(gerakan_list)
+        hasil = {}
+        with self._lock:
+            for gerakan in gerakan_list:
+                entry = self._entries.get(gerakan.id)
+                if entry is not None:
+                    self._entries.move_to_end(gerakan.id)
+                    hasil[gerakan.id] = entry
+
+        belum = [gerakan for gerakan in gerakan_list if gerakan.id not in hasil]
+        if belum:
+            # Pembuat dimuat sekaligus; gerakan.pembuat kemudian dibaca dari identity map tanpa query
+            pembuat_ids = {g.created_by_terapis_id for g in belum if g.created_by_terapis_id}
+            pembuat = AppUser.query.filter(AppUser.id.in_(pembuat_ids)).all() if pembuat_ids else []
+            baru = {gerakan.id: gerakan.serialize_full() for gerakan in belum}
+            hasil.update(baru)
+            with self._lock:
+                if version == self._version:
+                    self._entries.update(baru)
+                    maks_entri = current_app.config.get('GERAKAN_CACHE_MAKS_ENTRI', self._maks_entri)
+                    while len(self._entries) > maks_entri:
+                        self._entries.popitem(last=False)
+
+        return [_terapkan_fieldset(hasil[gerakan.id], fieldset) for gerakan in gerakan_list]
+
+
+def _terapkan_fieldset(data, fieldset):
+    if fieldset.is_all:
+        return data
+    return {key: fieldset.sub(key).pick(value) if isinstance(value, dict) else value
+            for key, value in data.items() if fieldset.wants(key)}
+
+
+def buat_etag(*bagian):
+    """ETag kuat dari bagian-bagian penentu isi respons."""
+    return hashlib.sha256('|'.join(str(b) for b in bagian).encode()).hexdigest()[:32]
+
+
+def etag_permintaan(version):
+    """ETag respons daftar: versi katalog ditambah semua query param (halaman, pencarian, fields, cursor)."""
+    args = sorted((key, value) for key in request.args for value in request.args.getlist(key))
+    return buat_etag('katalog', *version, *args)
+
+
+def tidak_berubah(etag):
+    """True jika If-None-Match permintaan cocok dengan etag (klien dapat memakai salinannya)."""
+    return request.if_none_match.contains_weak(etag) or request.if_none_match.star_tag
+
+
+def respons_dengan_etag(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL_KATALOG
+    return response
+
+
+def respons_304(etag):
+    return respons_dengan_etag(current_app.response_class(status=304), etag)
+
+
+gerakan_catalog = GerakanCatalog()
@@ -0,0 +1,150 @@
+# utils/gerakan_search.py
+# Pencarian katalog gerakan atas nama_gerakan dan deskripsi dengan indeks, menggantikan ILIKE '%term%'
+# yang selalu memindai seluruh tabel.
+# - PostgreSQL: indeks GIN atas tsvector (nama berbobot A, deskripsi B) untuk pencocokan kata dan peringkat
+#   ts_rank, ditambah indeks GIN pg_trgm atas nama_gerakan agar pencocokan substring (ILIKE) tetap memakai indeks.
+# - SQLite (lokal): tabel bayangan FTS5 `gerakan_fts` (external content) yang dijaga trigger, peringkat bm25.
+# - Dialek lain: ILIKE seperti sebelumnya.
+# Indeks dibuat otomatis saat tabel gerakan dibuat (db.create_all); untuk database yang sudah ada jalankan
+# `flask install-gerakan-search`.
+
+import re
+import threading
+from sqlalchemy import DDL, event, false, func, literal_column, or_, text, Float, Integer
+
+MODE_PENUH = 'penuh' # Semua kata harus cocok utuh
+MODE_PREFIX = 'prefix' # Typeahead: setiap kata dicocokkan sebagai awalan
+MODE_PENCARIAN = (MODE_PENUH, MODE_PREFIX)
+
+# Ekspresi tsvector harus sama persis dengan ekspresi indeks agar indeks dipakai
+TSVECTOR_GERAKAN = ("setweight(to_tsvector('simple', coalesce(nama_gerakan, '')), 'A') || "
+                    "setweight(to_tsvector('simple', coalesce(deskripsi, '')), 'B')")
+
+DDL_POSTGRES = [
+    f"CREATE INDEX IF NOT EXISTS ix_gerakan_search_tsv ON gerakan USING gin (({TSVECTOR_GERAKAN}))",
+]
+DDL_POSTGRES_TRGM = [
+    "CREATE INDEX IF NOT EXISTS ix_gerakan_nama_trgm ON gerakan USING gin (nama_gerakan gin_trgm_ops)",
+]
+DDL_SQLITE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS gerakan_fts USING fts5(nama_gerakan, deskripsi, content='gerakan', "
+    "content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS gerakan_fts_ai AFTER INSERT ON gerakan BEGIN "
+    "INSERT INTO gerakan_fts(rowid, nama_gerakan, deskripsi) VALUES (new.id, new.nama_gerakan, new.deskripsi); END",
+    "CREATE TRIGGER IF NOT EXISTS gerakan_fts_ad AFTER DELETE ON gerakan BEGIN "
+    "INSERT INTO gerakan_fts(gerakan_fts, rowid, nama_gerakan, deskripsi) VALUES ('delete', old.id, old.nama_gerakan, old.deskripsi); END",
+    "CREATE TRIGGER IF NOT EXISTS gerakan_fts_au AFTER UPDATE OF nama_gerakan, deskripsi ON gerakan BEGIN "
+    "INSERT INTO gerakan_fts(gerakan_fts, rowid, nama_gerakan, deskripsi) VALUES ('delete', old.id, old.nama_gerakan, old.deskripsi); "
+    "INSERT INTO gerakan_fts(rowid, nama_gerakan, deskripsi) VALUES (new.id, new.nama_gerakan, new.deskripsi); END",
+]
+
+_fts_cache_lock = threading.Lock()
+_fts_tersedia_per_engine = {}
+
+
+def _pg_trgm_terpasang(ddl, target, bind, **kw):
+    return bind.exec_driver_sql("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first() is not None
+
+
+def daftarkan_ddl(table):
+    """Mendaftarkan pembuatan indeks pencarian setelah tabel gerakan dibuat (db.create_all)."""
+    for statement in DDL_POSTGRES:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+    for statement in DDL_POSTGRES_TRGM:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='postgresql', callable_=_pg_trgm_terpasang))
+    for statement in DDL_SQLITE:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(table, 'after_create', _reset_cache_fts)
+
+
+def pasang_indeks(connection):
+    """
+    Membuat indeks pencarian pada database yang sudah ada lalu mengisi ulang indeks FTS5 (SQLite).
+    Mengembalikan daftar pesan untuk ditampilkan CLI.
+    """
+    pesan = []
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        for statement in DDL_POSTGRES:
+            connection.exec_driver_sql(statement)
+        pesan.append("Indeks tsvector gerakan terpasang.")
+        try:
+            with connection.begin_nested():
+                connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for statement in DDL_POSTGRES_TRGM:
+                connection.exec_driver_sql(statement)
+            pesan.append("Indeks trigram nama_gerakan terpasang.")
+        except Exception as e:
+            pesan.append(f"Ekstensi pg_trgm tidak dapat dipasang ({str(e).splitlines()[0]}); pencarian substring tanpa indeks trigram.")
+    elif dialect == 'sqlite':
+        for statement in DDL_SQLITE:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql("INSERT INTO gerakan_fts(gerakan_fts) VALUES ('rebuild')")
+        _reset_cache_fts()
+        pesan.append("Tabel FTS5 gerakan_fts dibangun ulang.")
+    else:
+        pesan.append(f"Dialek {dialect} tidak memiliki indeks pencarian khusus; pencarian memakai ILIKE.")
+    return pesan
+
+
+def _reset_cache_fts(*args, **kw):
+    with _fts_cache_lock:
+        _fts_tersedia_per_engine.clear()
+
+
+def _fts_tersedia(bind):
+    engine = bind.engine
+    with _fts_cache_lock:
+        if id(engine) in _fts_tersedia_per_engine:
+            return _fts_tersedia_per_engine[id(engine)]
+    with engine.connect() as connection:
+        ada = connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'gerakan_fts'").first() is not None
+    with _fts_cache_lock:
+        _fts_tersedia_per_engine[id(engine)] = ada
+    return ada
+
+
+def _token(term):
+    return re.findall(r'\w+', term.lower(), re.UNICODE)
+
+
+def terapkan_pencarian(query, term, mode=MODE_PENUH, bind=None, urutkan=True):
+    """
+    Memfilter query (Query ORM atau select) atas Gerakan dengan kata kunci `term`.
+    Jika `urutkan`, hasil diurutkan berdasarkan relevansi (pemanggil dapat menambahkan urutan pemutus seri).
+    """
+    from models import db, Gerakan
+
+    tokens = _token(term)
+    if not tokens:
+        return query.filter(false())
+    bind = bind if bind is not None else db.session.get_bind()
+    dialect = bind.dialect.name
+
+    if dialect == 'postgresql':
+        regconfig = literal_column("'simple'")
+        if mode == MODE_PREFIX:
+            tsquery = func.to_tsquery(regconfig, ' & '.join(f"{token}:*" for token in tokens))
+        else:
+            tsquery = func.plainto_tsquery(regconfig, ' '.join(tokens))
+        tsvector = literal_column(f"({TSVECTOR_GERAKAN})")
+        pola = f"{term}%" if mode == MODE_PREFIX else f"%{term}%"
+        query = query.filter(or_(tsvector.op('@@')(tsquery), Gerakan.nama_gerakan.ilike(pola)))
+        if urutkan:
+            # Kecocokan awalan nama lebih dulu, lalu peringkat ts_rank
+            query = query.order_by(Gerakan.nama_gerakan.ilike(f"{term}%").desc(), func.ts_rank(tsvector, tsquery).desc())
+        return query
+
+    if dialect == 'sqlite' and _fts_tersedia(bind):
+        akhiran = '*' if mode == MODE_PREFIX else ''
+        match = ' '.join(f'"{token}"{akhiran}' for token in tokens)
+        # bm25 dengan bobot nama 10x deskripsi; nilai lebih kecil = lebih relevan
+        hasil_fts = text("SELECT rowid AS id, bm25(gerakan_fts, 10.0, 1.0) AS skor FROM gerakan_fts WHERE gerakan_fts MATCH :match")\
+            .bindparams(match=match).columns(id=Integer, skor=Float).subquery('hasil_fts')
+        query = query.join(hasil_fts, hasil_fts.c.id == Gerakan.id)
+        if urutkan:
+            query = query.order_by(hasil_fts.c.skor.asc())
+        return query
+
+    pola = f"{term}%" if mode == MODE_PREFIX else f"%{term}%"
+    return query.filter(or_(Gerakan.nama_gerakan.ilike(pola), Gerakan.deskripsi.ilike(pola)))
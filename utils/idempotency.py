@@ -0,0 +1,115 @@
+# utils/idempotency.py
+# Dukungan header Idempotency-Key untuk endpoint yang membuat data (submit laporan, buat program).
+# Permintaan pertama dengan sebuah key dicatat di tabel idempotency_keys beserta responsnya;
+# permintaan ulang dengan key yang sama (selama belum kedaluwarsa) dijawab dari respons tersimpan
+# tanpa menjalankan ulang transaksi, logika badge, maupun serialisasi.
+# Selama diproses, key memegang lease (locked_until, IDEMPOTENCY_LEASE_SECONDS). Jika worker mati sebelum
+# respons tersimpan (OOM, timeout gunicorn), permintaan ulang setelah lease habis mengambil alih key tersebut
+# alih-alih mendapat 409 sampai key kedaluwarsa.
+
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, jsonify, current_app, make_response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+DEFAULT_TTL_HOURS = 24
+DEFAULT_LEASE_SECONDS = 300
+MAKS_PANJANG_KEY = 255
+
+
+def _hash_permintaan():
+    return hashlib.sha256(request.get_data() or b'').hexdigest()
+
+
+def _sedang_diproses(entry, sekarang):
+    response = jsonify({"msg": f"Permintaan dengan {IDEMPOTENCY_HEADER} yang sama sedang diproses"})
+    if entry is not None and entry.locked_until is not None:
+        response.headers['Retry-After'] = str(max(1, int((entry.locked_until - sekarang).total_seconds())))
+    return response, 409
+
+
+def _respons_tersimpan(entry):
+    response = make_response(entry.response_body or '', entry.status_code)
+    response.mimetype = 'application/json'
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(endpoint):
+    """
+    Decorator untuk view yang sudah dilindungi @jwt_required(). Tanpa header Idempotency-Key,
+    view dijalankan seperti biasa. Respons dengan status < 500 disimpan; respons 5xx tidak disimpan
+    sehingga klien dapat mencoba ulang dengan key yang sama.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAKS_PANJANG_KEY:
+                return jsonify({"msg": f"{IDEMPOTENCY_HEADER} maksimal {MAKS_PANJANG_KEY} karakter"}), 400
+
+            from models import db, IdempotencyKey
+
+            user_id = get_jwt_identity().get('id')
+            request_hash = _hash_permintaan()
+            sekarang = datetime.utcnow()
+            lease = timedelta(seconds=current_app.config.get('IDEMPOTENCY_LEASE_SECONDS', DEFAULT_LEASE_SECONDS))
+
+            entry = IdempotencyKey.cari(user_id, endpoint, key)
+            if entry is not None and entry.expires_at <= sekarang:
+                db.session.delete(entry)
+                db.session.commit()
+                entry = None
+
+            if entry is not None:
+                if entry.request_hash != request_hash:
+                    return jsonify({"msg": f"{IDEMPOTENCY_HEADER} sudah dipakai untuk permintaan yang berbeda"}), 422
+                if entry.status_code is not None:
+                    return _respons_tersimpan(entry)
+                # Masih diproses, atau ditinggalkan jika lease-nya sudah habis
+                entry_id = entry.id
+                diambil_alih = IdempotencyKey.ambil_alih(entry_id, sekarang, sekarang + lease)
+                db.session.commit()
+                if not diambil_alih:
+                    return _sedang_diproses(entry, sekarang)
+                current_app.logger.warning(f"{IDEMPOTENCY_HEADER} '{key}' ditinggalkan sebelum selesai; diproses ulang")
+            else:
+                # Klaim key sebelum menjalankan view; constraint unik mencegah dua permintaan bersamaan lolos
+                ttl_hours = current_app.config.get('IDEMPOTENCY_KEY_TTL_HOURS', DEFAULT_TTL_HOURS)
+                entry = IdempotencyKey(user_id=user_id, endpoint=endpoint, key=key, request_hash=request_hash,
+                                       expires_at=sekarang + timedelta(hours=ttl_hours), locked_until=sekarang + lease)
+                try:
+                    db.session.add(entry)
+                    db.session.commit()
+                except IntegrityError:
+                    db.session.rollback()
+                    return _sedang_diproses(None, sekarang)
+                entry_id = entry.id
+
+            response = None
+            try:
+                response = make_response(view(*args, **kwargs))
+            finally:
+                # View sudah commit/rollback transaksinya sendiri; hasilnya dicatat di transaksi terpisah
+                try:
+                    db.session.rollback()
+                    entry = db.session.get(IdempotencyKey, entry_id)
+                    if entry is not None:
+                        if response is not None and response.status_code < 500:
+                            entry.status_code = response.status_code
+                            entry.response_body = response.get_data(as_text=True)
+                            entry.locked_until = None
+                        else:
+                            db.session.delete(entry)
+                        db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    current_app.logger.warning(f"Gagal menyimpan respons {IDEMPOTENCY_HEADER} '{key}': {str(e)}")
+            return response
+        return wrapper
+    return decorator
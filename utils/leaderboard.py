@@ -0,0 +1,154 @@
+# utils/leaderboard.py
+# Indeks leaderboard in-memory (per worker) berbasis SortedList untuk lookup peringkat O(log n).
+# Dimuat dari database saat pertama kali dipakai, diperbarui saat poin pasien berubah,
+# dan dimuat ulang secara berkala agar perubahan dari worker lain ikut terlihat. Pemuatan ulang berkala
+# berjalan di thread latar (request tetap dilayani dari indeks lama), dan update()/remove() yang terjadi
+# selama pemuatan dicatat lalu diterapkan ulang di atas snapshot baru sebelum indeks ditukar.
+
+import threading
+import time
+from sortedcontainers import SortedList
+from flask import current_app
+from utils import pagination
+from utils.pagination import InvalidCursorError
+
+DEFAULT_REFRESH_SECONDS = 60
+
+
+class LeaderboardIndex:
+    """
+    Menyimpan pasangan kunci (-total_points, user_id) dalam SortedList,
+    sehingga urutan leaderboard adalah poin menurun lalu user_id menaik.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = SortedList()
+        self._points_by_user = {}
+        self._loaded_at = None
+        self._load_lock = threading.Lock() # Hanya satu pemuatan dari database dalam satu waktu
+        self._perubahan_selama_muat = None # {user_id: total_points atau None (dihapus)} selama pemuatan berjalan
+        self._muat_ulang_dijadwalkan = False
+
+    # --- Pemuatan data ---
+    def _load_from_db(self):
+        from models import db, AppUser
+
+        with self._load_lock:
+            with self._lock:
+                self._perubahan_selama_muat = {}
+            try:
+                rows = db.session.query(AppUser.id, AppUser.total_points).filter(AppUser.role == 'pasien').all()
+                points_by_user = {user_id: total_points or 0 for user_id, total_points in rows}
+                with self._lock:
+                    # Perubahan yang masuk selama query berjalan bisa lebih baru dari snapshot
+                    for user_id, points in self._perubahan_selama_muat.items():
+                        if points is None:
+                            points_by_user.pop(user_id, None)
+                        else:
+                            points_by_user[user_id] = points
+                    self._points_by_user = points_by_user
+                    self._entries = SortedList((-points, user_id) for user_id, points in points_by_user.items())
+                    self._loaded_at = time.monotonic()
+            finally:
+                with self._lock:
+                    self._perubahan_selama_muat = None
+
+    def _muat_ulang_di_latar(self, app):
+        try:
+            with app.app_context():
+                self._load_from_db()
+        except Exception as e:
+            app.logger.warning(f"Gagal memuat ulang indeks leaderboard: {e}")
+        finally:
+            with self._lock:
+                self._muat_ulang_dijadwalkan = False
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None:
+            self._load_from_db() # Pemuatan pertama harus selesai sebelum indeks bisa dipakai
+            return
+        refresh_seconds = current_app.config.get('LEADERBOARD_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+        if time.monotonic() - self._loaded_at <= refresh_seconds:
+            return
+        with self._lock:
+            if self._muat_ulang_dijadwalkan:
+                return
+            self._muat_ulang_dijadwalkan = True
+        threading.Thread(target=self._muat_ulang_di_latar, args=(current_app._get_current_object(),),
+                         name='leaderboard-reload', daemon=True).start()
+
+    def warm_up(self):
+        """Memuat indeks dari database (dipanggil saat startup worker)."""
+        self._load_from_db()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    # --- Pembaruan ---
+    def update(self, user_id, total_points):
+        """Mencatat total poin terbaru seorang pasien. Dipanggil setelah commit berhasil."""
+        total_points = total_points or 0
+        with self._lock:
+            if self._perubahan_selama_muat is not None:
+                self._perubahan_selama_muat[user_id] = total_points
+            if self._loaded_at is None:
+                return # Indeks belum dimuat; data terbaru akan ikut saat pemuatan pertama
+            old_points = self._points_by_user.get(user_id)
+            if old_points is not None:
+                self._entries.discard((-old_points, user_id))
+            self._points_by_user[user_id] = total_points
+            self._entries.add((-total_points, user_id))
+
+    def remove(self, user_id):
+        with self._lock:
+            if self._perubahan_selama_muat is not None:
+                self._perubahan_selama_muat[user_id] = None
+            old_points = self._points_by_user.pop(user_id, None)
+            if old_points is not None:
+                self._entries.discard((-old_points, user_id))
+
+    # --- Query ---
+    def total(self):
+        self._ensure_fresh()
+        return len(self._entries)
+
+    def rank_of(self, user_id):
+        """
+        Mengembalikan (peringkat, posisi, total_points) untuk user, atau None jika tidak ada di leaderboard.
+        Peringkat bersifat kompetisi (poin sama = peringkat sama); posisi adalah indeks 0-based dalam urutan.
+        """
+        self._ensure_fresh()
+        with self._lock:
+            points = self._points_by_user.get(user_id)
+            if points is None:
+                return None
+            rank = self._entries.bisect_left((-points,)) + 1
+            position = self._entries.index((-points, user_id))
+            return rank, position, points
+
+    def slice(self, start, stop):
+        """Daftar (user_id, total_points, peringkat) untuk posisi [start, stop)."""
+        self._ensure_fresh()
+        with self._lock:
+            start = max(start, 0)
+            entries = list(self._entries.islice(start, stop))
+            return [(user_id, -neg_points, self._entries.bisect_left((neg_points,)) + 1) for neg_points, user_id in entries]
+
+    def position_after(self, total_points, user_id):
+        """Posisi entri pertama setelah kunci (total_points, user_id) — dipakai untuk cursor paging."""
+        self._ensure_fresh()
+        with self._lock:
+            return self._entries.bisect_right((-total_points, user_id))
+
+
+def encode_cursor(total_points, user_id):
+    return pagination.encode_cursor(total_points, user_id)
+
+
+def decode_cursor(cursor):
+    return pagination.decode_cursor(cursor, int, int)
+
+
+leaderboard = LeaderboardIndex()
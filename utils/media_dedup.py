@@ -0,0 +1,89 @@
+# utils/media_dedup.py
+# Deduplikasi media berdasarkan isi (content-addressed). Sebelumnya setiap unggahan mendapat nama uuid4 baru,
+# sehingga video atau model yang sama dari beberapa terapis disimpan dan ditransfer berulang kali.
+# - unggah_dedup : menghitung SHA-256 file secara streaming per chunk (file request sudah ada di worker, tidak
+#                  ada transfer jaringan), lalu mencari isi yang sama di media_blobs. Jika ada, unggahan
+#                  dilewati dan blob yang sama dipakai; jika belum, file diunggah seperti biasa.
+# - MediaBlob.pakai / MediaBlob.lepas (models.py) menambah/mengurangi reference count di transaksi route;
+#   file baru masuk antrean penghapusan storage ketika referensi terakhir dilepas.
+# - batalkan     : membatalkan hasil unggah_dedup (hanya blob yang benar-benar baru diunggah yang dihapus).
+# Hash isi juga dipakai sebagai ETag saat file disajikan aplikasi (routes/media_routes.py).
+
+import hashlib
+import threading
+from collections import namedtuple
+from flask import current_app
+from utils.storage_backend import storage, nama_unik, hapus_file, JENIS_MEDIA
+from utils.streaming_upload import anggaran_buffer, ukuran_chunk
+
+# baru: True jika file diunggah oleh panggilan ini, False jika memakai blob yang sudah ada
+HasilUnggah = namedtuple('HasilUnggah', ['ref', 'jenis', 'content_hash', 'ukuran', 'content_type', 'baru'])
+
+
+class DedupMetrics:
+    """Metrik in-process: jumlah unggahan baru vs dilewati dan byte transfer yang dihemat."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"unggah_baru": 0, "unggah_dilewati": 0, "byte_diunggah": 0, "byte_dihemat": 0}
+
+    def catat(self, ukuran, baru):
+        with self._lock:
+            self._stats["unggah_baru" if baru else "unggah_dilewati"] += 1
+            self._stats["byte_diunggah" if baru else "byte_dihemat"] += ukuran
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+metrics = DedupMetrics()
+
+
+def hitung_hash(stream, chunk_size=None):
+    """SHA-256 (hex) dan ukuran isi stream, dibaca per chunk dari awal; stream diputar kembali ke awal."""
+    chunk_size = chunk_size or ukuran_chunk()
+    anggaran = anggaran_buffer()
+    sha256, ukuran = hashlib.sha256(), 0
+    stream.seek(0)
+    while True:
+        with anggaran.pakai(chunk_size):
+            data = stream.read(chunk_size)
+            if not data:
+                break
+            sha256.update(data)
+            ukuran += len(data)
+    stream.seek(0)
+    return sha256.hexdigest(), ukuran
+
+
+def unggah_dedup(file_storage, folder, jenis=JENIS_MEDIA, awalan='', content_type=None):
+    """
+    Mengunggah file dari request.files kecuali isinya sudah tersimpan.
+    :return: Tuple (HasilUnggah, error_message). Ref final didapat dari MediaBlob.pakai(hasil) sebelum commit.
+    """
+    from models import MediaBlob
+
+    if not file_storage or not file_storage.filename:
+        return None, "No file selected for upload."
+    try:
+        content_hash, ukuran = hitung_hash(file_storage)
+        content_type = content_type or file_storage.content_type
+        blob = MediaBlob.cari(jenis, content_hash)
+        if blob is not None:
+            current_app.logger.info(f"Unggahan dilewati: isi sama dengan {blob.ref} ({ukuran} byte)")
+            metrics.catat(ukuran, baru=False)
+            return HasilUnggah(blob.ref, jenis, content_hash, ukuran, content_type, False), None
+        ref = storage(jenis).put(nama_unik(folder, file_storage.filename, awalan), file_storage, content_type)
+        metrics.catat(ukuran, baru=True)
+        return HasilUnggah(ref, jenis, content_hash, ukuran, content_type, True), None
+    except Exception as e:
+        current_app.logger.error(f"Gagal mengunggah file ke storage ({jenis}): {str(e)}")
+        return None, f"Failed to upload file to storage: {str(e)}"
+
+
+def batalkan(hasil):
+    """Menghapus blob hasil unggah_dedup yang belum sempat dirujuk. Blob yang dipakai bersama tidak disentuh."""
+    if hasil is None or not hasil.baru:
+        return hasil, None
+    return hapus_file(hasil.ref, hasil.jenis)
@@ -0,0 +1,160 @@
+# utils/media_io.py
+# Operasi storage media (unggah/hapus lewat utils/storage_backend.py) dijalankan paralel pada satu thread pool
+# terbatas yang dipakai bersama oleh semua request (ukuran: MEDIA_IO_MAX_WORKERS). Latensi request
+# menjadi durasi transfer terlama, bukan jumlah seluruh transfer. File lama tidak dihapus di sini, melainkan
+# lewat antrean penghapusan yang diproses worker (utils/storage_deletion.py).
+# - unggah_semua      : semua unggahan ditunggu; jika ada yang gagal, unggahan yang berhasil dihapus lagi
+#                       (semua-atau-tidak-sama-sekali) lalu MediaUploadError dilempar.
+# - batalkan_unggahan : menghapus hasil unggah_semua, mis. ketika commit database gagal.
+# Durasi per operasi dikirim ke klien lewat header Server-Timing, dicatat di log, dan dikumpulkan
+# di `metrics` (rata-rata/maksimum per jenis operasi).
+
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+DEFAULT_MAKS_WORKER = 8
+
+# unggah: tuple (fungsi, *args) yang mengembalikan (nilai, error), mis. (unggah_dedup, file, 'gerakan/foto').
+# hapus : fungsi(nilai) -> (nilai, error) untuk membatalkan unggahan yang sudah berhasil.
+UnggahanMedia = namedtuple('UnggahanMedia', ['unggah', 'hapus'])
+
+
+class MediaUploadError(Exception):
+    def __init__(self, pesan, hasil):
+        super().__init__(pesan)
+        self.hasil = hasil
+
+
+class HasilMedia:
+    """Hasil sekelompok operasi paralel: nilai/error per nama, durasi per nama, dan durasi total (detik)."""
+
+    def __init__(self):
+        self.nilai = {}
+        self.error = {}
+        self.durasi = {}
+        self.total = 0.0
+
+    @property
+    def ok(self):
+        return not self.error
+
+    def server_timing(self, awalan):
+        bagian = [f"{awalan}-{nama};dur={durasi * 1000:.1f}" for nama, durasi in self.durasi.items()]
+        if self.durasi:
+            bagian.append(f"{awalan}-total;dur={self.total * 1000:.1f}")
+        return bagian
+
+
+class MediaIOMetrics:
+    """Metrik in-process per jenis operasi (unggah/hapus): jumlah sukses/gagal dan durasi rata-rata/maksimum."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def catat(self, jenis, durasi_detik, sukses):
+        with self._lock:
+            stat = self._stats.setdefault(jenis, {"sukses": 0, "gagal": 0, "total_durasi": 0.0, "maks_durasi": 0.0})
+            stat["sukses" if sukses else "gagal"] += 1
+            stat["total_durasi"] += durasi_detik
+            stat["maks_durasi"] = max(stat["maks_durasi"], durasi_detik)
+
+    def snapshot(self):
+        with self._lock:
+            hasil = {}
+            for jenis, stat in self._stats.items():
+                jumlah = stat["sukses"] + stat["gagal"]
+                hasil[jenis] = {
+                    "sukses": stat["sukses"],
+                    "gagal": stat["gagal"],
+                    "durasi_rata_rata_ms": round(stat["total_durasi"] / jumlah * 1000, 1),
+                    "durasi_maks_ms": round(stat["maks_durasi"] * 1000, 1),
+                }
+            return hasil
+
+
+metrics = MediaIOMetrics()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            maks_worker = current_app.config.get('MEDIA_IO_MAX_WORKERS', DEFAULT_MAKS_WORKER)
+            _executor = ThreadPoolExecutor(max_workers=maks_worker, thread_name_prefix='media-io')
+        return _executor
+
+
+def _jalankan(app, jenis, operasi):
+    # Helper storage memakai current_app.logger, sehingga setiap tugas berjalan di app context
+    fungsi, *args = operasi
+    with app.app_context():
+        mulai = time.perf_counter()
+        try:
+            nilai, error = fungsi(*args)
+        except Exception as e:
+            nilai, error = None, str(e)
+        durasi = time.perf_counter() - mulai
+        metrics.catat(jenis, durasi, error is None)
+        return nilai, error, durasi
+
+
+def _jalankan_paralel(jenis, operasi):
+    """Menjalankan dict nama -> (fungsi, *args) di pool dan menunggu semuanya selesai."""
+    hasil = HasilMedia()
+    if not operasi:
+        return hasil
+    app = current_app._get_current_object()
+    executor = _get_executor()
+    mulai = time.perf_counter()
+    futures = {nama: executor.submit(_jalankan, app, jenis, op) for nama, op in operasi.items()}
+    for nama, future in futures.items():
+        nilai, error, durasi = future.result()
+        hasil.durasi[nama] = durasi
+        if error is None:
+            hasil.nilai[nama] = nilai
+        else:
+            hasil.error[nama] = error
+    hasil.total = time.perf_counter() - mulai
+    current_app.logger.info(
+        f"Media {jenis}: {len(operasi)} operasi paralel selesai dalam {hasil.total * 1000:.1f} ms "
+        f"(jumlah durasi {sum(hasil.durasi.values()) * 1000:.1f} ms)")
+    return hasil
+
+
+def unggah_semua(unggahan):
+    """
+    Mengunggah dict nama -> UnggahanMedia secara paralel dan mengembalikan HasilMedia (nilai per nama).
+    Jika satu unggahan gagal, unggahan lain yang berhasil dihapus kembali lalu MediaUploadError dilempar.
+    """
+    hasil = _jalankan_paralel('unggah', {nama: u.unggah for nama, u in unggahan.items()})
+    if not hasil.ok:
+        batalkan_unggahan(unggahan, hasil)
+        pesan = '; '.join(f"Upload {nama} gagal: {error}" for nama, error in hasil.error.items())
+        raise MediaUploadError(pesan, hasil)
+    return hasil
+
+
+def batalkan_unggahan(unggahan, hasil):
+    """Menghapus (paralel, ditunggu) semua nilai yang berhasil diunggah di `hasil`."""
+    pembatalan = _jalankan_paralel('hapus', {nama: (unggahan[nama].hapus, nilai) for nama, nilai in hasil.nilai.items()})
+    for nama, error in pembatalan.error.items():
+        current_app.logger.error(f"Gagal membatalkan unggahan {nama} ({hasil.nilai[nama]}): {error}")
+    hasil.durasi.update({f"batal-{nama}": durasi for nama, durasi in pembatalan.durasi.items()})
+    hasil.nilai.clear()
+    return pembatalan
+
+
+def pasang_server_timing(response, *bagian):
+    """Menambahkan durasi operasi media ke header Server-Timing respons."""
+    nilai = ', '.join(b for daftar in bagian for b in daftar)
+    if nilai:
+        response.headers['Server-Timing'] = nilai
+    return response
+
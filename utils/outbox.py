@@ -0,0 +1,144 @@
+# utils/outbox.py
+# Pemrosesan outbox event domain di luar request. Event ditulis ke tabel outbox_events dalam transaksi
+# yang sama dengan perubahan datanya (OutboxEvent.catat), lalu `flask worker` mengklaimnya per batch,
+# menjalankan handler (efek samping lambat seperti Firebase dan notifikasi) di luar lock dengan satu transaksi
+# per event, mencoba ulang dengan backoff, dan mencatat metrik latensi per jenis event.
+
+import time
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+
+EVENT_LAPORAN_SUBMITTED = 'laporan_submitted'
+EVENT_BADGE_AWARDED = 'badge_awarded'
+EVENT_USER_REGISTERED = 'user_registered'
+
+MAKS_PERCOBAAN = 5
+BACKOFF_DASAR_DETIK = 5 # Percobaan ke-n ditunda BACKOFF_DASAR_DETIK * 2^(n-1)
+LEASE_DETIK = 300 # Event yang diklaim tidak diambil worker lain selama ini; diproses ulang jika worker mati
+
+_handlers = {}
+
+
+def handler(event_type):
+    """Mendaftarkan fungsi handler(payload) untuk satu jenis event."""
+    def decorator(fn):
+        _handlers[event_type] = fn
+        return fn
+    return decorator
+
+
+class OutboxMetrics:
+    """
+    Metrik in-process per jenis event: jumlah sukses/gagal, lag antrean (created_at sampai selesai diproses)
+    dan durasi handler, masing-masing rata-rata dan maksimum dalam milidetik.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def catat(self, event_type, lag_detik, durasi_detik, sukses):
+        with self._lock:
+            stat = self._stats.setdefault(event_type, {"sukses": 0, "gagal": 0, "total_lag": 0.0, "maks_lag": 0.0,
+                                                       "total_durasi": 0.0, "maks_durasi": 0.0})
+            stat["sukses" if sukses else "gagal"] += 1
+            stat["total_lag"] += lag_detik
+            stat["maks_lag"] = max(stat["maks_lag"], lag_detik)
+            stat["total_durasi"] += durasi_detik
+            stat["maks_durasi"] = max(stat["maks_durasi"], durasi_detik)
+
+    def snapshot(self):
+        with self._lock:
+            hasil = {}
+            for event_type, stat in self._stats.items():
+                jumlah = stat["sukses"] + stat["gagal"]
+                hasil[event_type] = {
+                    "sukses": stat["sukses"],
+                    "gagal": stat["gagal"],
+                    "lag_rata_rata_ms": round(stat["total_lag"] / jumlah * 1000, 1),
+                    "lag_maks_ms": round(stat["maks_lag"] * 1000, 1),
+                    "durasi_rata_rata_ms": round(stat["total_durasi"] / jumlah * 1000, 1),
+                    "durasi_maks_ms": round(stat["maks_durasi"] * 1000, 1),
+                }
+            return hasil
+
+
+metrics = OutboxMetrics()
+
+
+def proses_batch(batch_size=100):
+    """
+    Memproses satu batch event pending. Event diklaim dulu (OutboxEvent.klaim_batch, lease LEASE_DETIK) lalu
+    handler dijalankan di luar lock, dan hasil setiap event di-commit sendiri sehingga kegagalan satu handler
+    (termasuk error database) tidak membatalkan event lain. Event yang handlernya gagal dijadwalkan ulang
+    dengan backoff eksponensial, dan ditandai GAGAL setelah MAKS_PERCOBAAN. Mengembalikan jumlah event diproses.
+    """
+    from models import db, OutboxEvent, OutboxStatus
+
+    event_ids = OutboxEvent.klaim_batch(batch_size, LEASE_DETIK)
+    for event_id in event_ids:
+        event = db.session.get(OutboxEvent, event_id)
+        event_type, created_at = event.event_type, event.created_at
+        mulai = time.perf_counter()
+        try:
+            fn = _handlers.get(event_type)
+            if fn is None:
+                raise LookupError(f"Tidak ada handler untuk event '{event_type}'")
+            fn(event.payload or {})
+            event.attempts += 1
+            event.status = OutboxStatus.SELESAI
+            event.processed_at = datetime.utcnow()
+            db.session.commit() # Perubahan database dari handler ikut di-commit bersama status event
+            sukses = True
+        except Exception as e:
+            sukses = False
+            db.session.rollback()
+            try:
+                event = db.session.get(OutboxEvent, event_id)
+                event.attempts += 1
+                event.last_error = str(e)
+                if event.attempts >= MAKS_PERCOBAAN:
+                    event.status = OutboxStatus.GAGAL
+                    event.processed_at = datetime.utcnow()
+                else:
+                    event.available_at = datetime.utcnow() + timedelta(seconds=BACKOFF_DASAR_DETIK * 2 ** (event.attempts - 1))
+                db.session.commit()
+                current_app.logger.warning(f"Event outbox {event_id} ({event_type}) gagal, percobaan ke-{event.attempts}: {str(e)}")
+            except Exception as e_status:
+                # Event tetap diklaim sampai lease habis lalu diproses ulang
+                db.session.rollback()
+                current_app.logger.error(f"Gagal mencatat status event outbox {event_id}: {str(e_status)}")
+        durasi = time.perf_counter() - mulai
+        metrics.catat(event_type, (datetime.utcnow() - created_at).total_seconds(), durasi, sukses)
+    return len(event_ids)
+
+
+# --- Handler event ---
+@handler(EVENT_USER_REGISTERED)
+def sinkronkan_user_firebase(payload):
+    """Membuat user Firebase dengan UID = ID user di DB utama (dilewati jika sudah ada)."""
+    import app as app_module
+    if not app_module.firebase_admin_initialized:
+        return
+    from firebase_admin import auth
+    from firebase_admin.auth import UserNotFoundError
+
+    uid_str = str(payload["user_id"])
+    try:
+        auth.get_user(uid_str)
+    except UserNotFoundError:
+        auth.create_user(uid=uid_str, display_name=payload.get("nama_lengkap"), email=payload.get("email"))
+        current_app.logger.info(f"Firebase user created successfully for {payload.get('role')} ID: {uid_str}")
+
+
+@handler(EVENT_LAPORAN_SUBMITTED)
+def log_laporan_submitted(payload):
+    current_app.logger.info(f"Laporan {payload.get('laporan_id')} disubmit oleh pasien {payload.get('pasien_id')} "
+                            f"(+{payload.get('points_earned')} poin)")
+
+
+@handler(EVENT_BADGE_AWARDED)
+def log_badge_awarded(payload):
+    # Titik untuk notifikasi ke frontend/push notification saat badge diperoleh
+    current_app.logger.info(f"Pasien {payload.get('username')} mendapatkan badge: {payload.get('badge_name')}!")
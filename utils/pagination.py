@@ -0,0 +1,76 @@
+# utils/pagination.py
+# Paging keyset (cursor) untuk endpoint daftar. Berbeda dengan .paginate(), tidak ada COUNT(*)
+# dan tidak ada OFFSET: halaman berikutnya diambil dengan filter "setelah kunci urutan terakhir",
+# sehingga biayanya tetap sama di halaman berapa pun. Cursor bersifat opaque bagi klien
+# (base64 dari nilai kunci urutan baris terakhir).
+# Konvensi endpoint: query param `cursor` (kosong untuk halaman pertama) mengaktifkan mode ini,
+# dan respons berisi `next_cursor` (null jika sudah habis) alih-alih total_items/total_pages.
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import and_, or_
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal): # Hasil SUM() di PostgreSQL
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Nilai cursor tidak didukung: {value!r}")
+
+
+def encode_cursor(*values):
+    raw = json.dumps(list(values), default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, *parsers):
+    """Mengembalikan tuple nilai kunci; setiap nilai diubah dengan parser pada posisi yang sama."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if not isinstance(values, list) or len(values) != len(parsers):
+            raise ValueError
+        return tuple(None if value is None else parser(value) for parser, value in zip(parsers, values))
+    except Exception:
+        raise InvalidCursorError("Cursor tidak valid")
+
+
+def keyset_order_by(order):
+    """Klausa ORDER BY dari daftar (kolom, menurun)."""
+    return [column.desc() if descending else column.asc() for column, descending in order]
+
+
+def _keyset_filter(order, values):
+    # (a, b, c) "setelah" (x, y, z) = a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z),
+    # dengan arah perbandingan per kolom mengikuti arah urutan (mendukung urutan campuran).
+    clauses = []
+    for i, ((column, descending), value) in enumerate(zip(order, values)):
+        prefix = [col == val for (col, _), val in zip(order[:i], values[:i])]
+        clauses.append(and_(*prefix, column < value if descending else column > value))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, order, cursor, per_page, parsers):
+    """
+    Satu halaman keyset dari query. `order` adalah daftar (kolom, menurun) yang diakhiri kolom unik
+    (mis. id) dan `parsers` mengubah nilai cursor kembali ke tipe kolomnya. Nilai kunci baris terakhir
+    dibaca dari atribut baris bernama `kolom.key`. Mengembalikan (items, next_cursor).
+    Melempar InvalidCursorError jika cursor tidak valid.
+    """
+    per_page = max(per_page, 1)
+    if cursor:
+        query = query.filter(_keyset_filter(order, decode_cursor(cursor, *parsers)))
+    rows = query.order_by(*keyset_order_by(order)).limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        next_cursor = encode_cursor(*[getattr(last, column.key) for column, _ in order])
+    return items, next_cursor
@@ -0,0 +1,346 @@
+# utils/storage_backend.py
+# Satu antarmuka storage media untuk semua route, dipilih lewat konfigurasi STORAGE_BACKEND:
+#   'cloud'  (default): foto/video/gambar badge/foto profil di Azure Blob Storage, model .tflite di GCS
+#   'lokal'           : semua file di disk (MEDIA_LOCAL_DIR), disajikan aplikasi di /media/<key> dengan dukungan Range
+#   'memori'          : semua file di memori proses (benchmark/uji beban tanpa disk maupun cloud)
+# Setiap backend menyediakan put / stream / delete / batch_delete / url / exists / list.
+# Nilai yang disimpan di database (ref) tetap sama seperti sebelumnya: nama blob untuk Azure dan
+# URI gs://bucket/objek untuk GCS. Backend lokal/memori memakai key apa adanya dan menerima ref gs:// lama.
+# Unggahan dari route melewati utils/media_dedup.py (deduplikasi isi). hapus_file mengembalikan tuple
+# (nilai, error) seperti helper storage lain, sehingga dapat dipakai langsung di pool media (utils/media_io.py).
+
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timezone
+from io import BytesIO
+from flask import current_app, has_request_context, send_file, url_for
+from werkzeug.security import safe_join
+from utils.azure_helpers import (unggah_blob, unduh_blob, delete_blob, hapus_blob_batch, daftar_blob, blob_ada,
+                                 get_blob_url, buat_url_unggah_sas)
+from utils.gcs_helpers import (upload_file_to_gcs, unduh_objek_gcs, delete_file_from_gcs, hapus_objek_gcs_batch,
+                               daftar_objek_gcs, blob_gcs_ada, get_gcs_url, buat_signed_url_unggah, GCS_BUCKET_NAME)
+from utils.streaming_upload import ukuran_chunk
+
+JENIS_MEDIA = 'media' # Foto/video gerakan, gambar badge, foto profil
+JENIS_MODEL = 'model' # Model .tflite
+
+BACKEND_CLOUD = 'cloud'
+BACKEND_LOKAL = 'lokal'
+BACKEND_MEMORI = 'memori'
+
+
+class StorageError(Exception):
+    pass
+
+
+def kunci_objek(ref):
+    """Key objek dari ref database: 'gs://bucket/a/b.tflite' -> 'a/b.tflite', nama blob tidak berubah."""
+    return ref.split('/', 3)[3] if ref.startswith('gs://') else ref
+
+
+def nama_unik(folder, filename, awalan=''):
+    """Key unik '<folder>/<awalan><uuid>.<ekstensi>', pola yang sama dengan unggahan sebelumnya."""
+    extension = filename.rsplit('.', 1)[1].lower()
+    return f"{folder.rstrip('/')}/{awalan}{uuid.uuid4().hex}.{extension}"
+
+
+class StorageBackend:
+    """
+    Antarmuka storage. `key` adalah path objek di storage, `ref` adalah nilai yang disimpan di database.
+    delete/batch_delete menganggap objek yang tidak ada sebagai sudah terhapus.
+    """
+    nama = None
+    disajikan_aplikasi = False # True: file disajikan GET /media/<key> dan unggah langsung lewat PUT aplikasi
+
+    def ref(self, key):
+        return key
+
+    def put(self, key, stream, content_type=None):
+        """Menulis stream per chunk ke `key`. Mengembalikan ref."""
+        raise NotImplementedError
+
+    def stream(self, ref, start=0, end=None):
+        """Iterator chunk isi objek dari byte `start` sampai `end` (inklusif, None = akhir objek)."""
+        raise NotImplementedError
+
+    def delete(self, ref):
+        raise NotImplementedError
+
+    def batch_delete(self, refs):
+        """Menghapus banyak objek. Mengembalikan dict ref -> pesan error untuk yang gagal."""
+        gagal = {}
+        for ref in refs:
+            try:
+                self.delete(ref)
+            except Exception as e:
+                gagal[ref] = str(e)
+        return gagal
+
+    def url(self, ref):
+        raise NotImplementedError
+
+    def exists(self, ref):
+        raise NotImplementedError
+
+    def list(self, prefix):
+        """Iterator (ref, waktu_ubah) untuk semua objek dengan awalan `prefix`; waktu dalam UTC (timezone-aware)."""
+        raise NotImplementedError
+
+    def url_unggah(self, ref, content_type, kedaluwarsa):
+        """URL bertanda tangan untuk PUT langsung ke storage: tuple (url, headers_wajib, error_message)."""
+        raise NotImplementedError
+
+
+class AzureBlobBackend(StorageBackend):
+    nama = 'azure'
+
+    def put(self, key, stream, content_type=None):
+        unggah_blob(key, stream, content_type)
+        return key
+
+    def stream(self, ref, start=0, end=None):
+        return unduh_blob(ref, start, end)
+
+    def delete(self, ref):
+        if not delete_blob(ref):
+            raise StorageError(f"Gagal menghapus blob '{ref}'")
+
+    def batch_delete(self, refs):
+        return hapus_blob_batch(list(refs))
+
+    def url(self, ref):
+        return get_blob_url(ref)
+
+    def exists(self, ref):
+        return blob_ada(ref)
+
+    def list(self, prefix):
+        return daftar_blob(prefix)
+
+    def url_unggah(self, ref, content_type, kedaluwarsa):
+        return buat_url_unggah_sas(ref, content_type, kedaluwarsa)
+
+
+class GCSBackend(StorageBackend):
+    nama = 'gcs'
+
+    def ref(self, key):
+        return f"gs://{GCS_BUCKET_NAME}/{key}"
+
+    def put(self, key, stream, content_type=None):
+        gcs_uri, err = upload_file_to_gcs(stream, key, content_type)
+        if err:
+            raise StorageError(err)
+        return gcs_uri
+
+    def stream(self, ref, start=0, end=None):
+        return unduh_objek_gcs(kunci_objek(ref), start, end)
+
+    def delete(self, ref):
+        ok, err = delete_file_from_gcs(kunci_objek(ref))
+        if not ok:
+            raise StorageError(err)
+
+    def batch_delete(self, refs):
+        refs = list(refs)
+        gagal = hapus_objek_gcs_batch([kunci_objek(ref) for ref in refs])
+        return {ref: gagal[kunci_objek(ref)] for ref in refs if kunci_objek(ref) in gagal}
+
+    def url(self, ref):
+        return get_gcs_url(kunci_objek(ref))
+
+    def exists(self, ref):
+        return blob_gcs_ada(kunci_objek(ref))
+
+    def list(self, prefix):
+        for nama, waktu_ubah in daftar_objek_gcs(prefix):
+            yield self.ref(nama), waktu_ubah
+
+    def url_unggah(self, ref, content_type, kedaluwarsa):
+        return buat_signed_url_unggah(kunci_objek(ref), content_type, kedaluwarsa)
+
+
+def url_media(key):
+    """URL GET /media/<key> milik aplikasi ini (MEDIA_BASE_URL jika diatur, misalnya di luar request)."""
+    base_url = current_app.config.get('MEDIA_BASE_URL')
+    if base_url:
+        return f"{base_url.rstrip('/')}/{key}"
+    if has_request_context():
+        return url_for('media_bp.sajikan_media', key=key, _external=True)
+    return f"/media/{key}"
+
+
+class LocalBackend(StorageBackend):
+    """File di MEDIA_LOCAL_DIR (default: <instance>/media). Penulisan atomik lewat file sementara."""
+    nama = 'lokal'
+    disajikan_aplikasi = True
+
+    def direktori(self):
+        return current_app.config.get('MEDIA_LOCAL_DIR') or os.path.join(current_app.instance_path, 'media')
+
+    def path(self, ref):
+        path = safe_join(self.direktori(), kunci_objek(ref))
+        if path is None:
+            raise StorageError(f"Key tidak valid: '{ref}'")
+        return path
+
+    def put(self, key, stream, content_type=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        chunk_size = ukuran_chunk()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.unggah-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    data = stream.read(chunk_size)
+                    if not data:
+                        break
+                    f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return key
+
+    def stream(self, ref, start=0, end=None):
+        chunk_size = ukuran_chunk()
+        with open(self.path(ref), 'rb') as f:
+            f.seek(start)
+            sisa = end - start + 1 if end is not None else None
+            while sisa is None or sisa > 0:
+                data = f.read(chunk_size if sisa is None else min(chunk_size, sisa))
+                if not data:
+                    break
+                if sisa is not None:
+                    sisa -= len(data)
+                yield data
+
+    def delete(self, ref):
+        try:
+            os.remove(self.path(ref))
+        except FileNotFoundError:
+            pass
+
+    def url(self, ref):
+        return url_media(kunci_objek(ref))
+
+    def exists(self, ref):
+        return os.path.isfile(self.path(ref))
+
+    def list(self, prefix):
+        root = self.direktori()
+        for dirpath, _, filenames in os.walk(self.path(prefix)):
+            for filename in filenames:
+                if filename.startswith('.unggah-'): # File sementara unggahan yang sedang berjalan
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, root).replace(os.sep, '/')
+                yield key, datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+
+    def kirim(self, key, etag=None):
+        """
+        Respons file untuk GET /media/<key>; Werkzeug menangani Range (206), If-None-Match, dan 304.
+        `etag`: hash isi jika diketahui, selain itu ETag dari waktu ubah dan ukuran file.
+        """
+        path = safe_join(self.direktori(), key)
+        if path is None or not os.path.isfile(path):
+            return None
+        return send_file(path, conditional=True, etag=etag or True)
+
+
+class MemoryBackend(StorageBackend):
+    """File di memori proses (per worker, hilang saat restart). Untuk benchmark dan uji beban."""
+    nama = 'memori'
+    disajikan_aplikasi = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objek = {} # key -> (isi, content_type, sha256, waktu_tulis)
+
+    def put(self, key, stream, content_type=None):
+        chunk_size, bagian = ukuran_chunk(), []
+        while True:
+            data = stream.read(chunk_size)
+            if not data:
+                break
+            bagian.append(data)
+        isi = b''.join(bagian)
+        with self._lock:
+            self._objek[key] = (isi, content_type, hashlib.sha256(isi).hexdigest(), datetime.now(timezone.utc))
+        return key
+
+    def _ambil(self, ref):
+        with self._lock:
+            return self._objek.get(kunci_objek(ref))
+
+    def stream(self, ref, start=0, end=None):
+        objek = self._ambil(ref)
+        if objek is None:
+            raise StorageError(f"Objek '{ref}' tidak ditemukan")
+        isi = objek[0][start:end + 1 if end is not None else None]
+        chunk_size = ukuran_chunk()
+        for awal in range(0, len(isi), chunk_size):
+            yield isi[awal:awal + chunk_size]
+
+    def delete(self, ref):
+        with self._lock:
+            self._objek.pop(kunci_objek(ref), None)
+
+    def url(self, ref):
+        return url_media(kunci_objek(ref))
+
+    def exists(self, ref):
+        return self._ambil(ref) is not None
+
+    def list(self, prefix):
+        with self._lock:
+            daftar = [(key, objek[3]) for key, objek in self._objek.items() if key.startswith(prefix)]
+        return iter(daftar)
+
+    def kirim(self, key, etag=None):
+        objek = self._ambil(key)
+        if objek is None:
+            return None
+        isi, content_type, sha256, waktu_tulis = objek
+        etag = etag or sha256
+        return send_file(BytesIO(isi), mimetype=content_type or mimetypes.guess_type(key)[0] or 'application/octet-stream',
+                         download_name=os.path.basename(key), conditional=True, etag=etag, last_modified=waktu_tulis)
+
+
+_BACKEND = {
+    'azure': AzureBlobBackend(),
+    'gcs': GCSBackend(),
+    'lokal': LocalBackend(),
+    'memori': MemoryBackend(),
+}
+
+
+def storage(jenis=JENIS_MEDIA):
+    """Backend untuk jenis file sesuai STORAGE_BACKEND. Mode lokal/memori memakai satu backend untuk semua jenis."""
+    mode = current_app.config.get('STORAGE_BACKEND', BACKEND_CLOUD)
+    if mode in (BACKEND_LOKAL, BACKEND_MEMORI):
+        return _BACKEND[mode]
+    return _BACKEND['gcs'] if jenis == JENIS_MODEL else _BACKEND['azure']
+
+
+def hapus_file(ref, jenis=JENIS_MEDIA):
+    """Menghapus satu file. :return: Tuple (ref, error_message)."""
+    if not ref:
+        return ref, None
+    try:
+        storage(jenis).delete(ref)
+        return ref, None
+    except Exception as e:
+        current_app.logger.error(f"Gagal menghapus '{ref}' dari storage ({jenis}): {str(e)}")
+        return None, str(e)
+
+
+def url_file(ref, jenis=JENIS_MEDIA):
+    """URL untuk ref yang tersimpan di database (None jika kosong)."""
+    if not ref:
+        return None
+    return storage(jenis).url(ref)
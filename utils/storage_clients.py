@@ -0,0 +1,144 @@
+# utils/storage_clients.py
+# Registry client storage yang dibuat sekali per proses worker dan dipakai ulang oleh semua unggah/hapus,
+# menggantikan BlobServiceClient baru per panggilan (sesi HTTP dan handshake TLS baru setiap kali) dan
+# storage.Client() yang dibuat saat import. Setiap client memakai requests.Session dengan connection pool
+# berukuran STORAGE_POOL_MAXSIZE (koneksi keep-alive dipakai ulang), timeout connect/read, dan kebijakan retry.
+# Client dibuat malas saat pertama dipakai dan dibuat ulang setelah fork (mis. gunicorn --preload),
+# karena koneksi TCP tidak boleh dibagi antar proses.
+# Konfigurasi:
+#   STORAGE_POOL_MAXSIZE     : koneksi per host yang disimpan (default 16)
+#   STORAGE_CONNECT_TIMEOUT  : detik (default 10)
+#   STORAGE_READ_TIMEOUT     : detik (default 120)
+#   STORAGE_RETRY_TOTAL      : jumlah retry untuk error sementara (default 3)
+#   STORAGE_RETRY_BACKOFF    : jeda awal retry dalam detik, naik eksponensial (default 1)
+
+import os
+import threading
+import google.auth
+import requests
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient, ExponentialRetry
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 120
+DEFAULT_RETRY_TOTAL = 3
+DEFAULT_RETRY_BACKOFF = 1
+
+
+def _statistik_session(session):
+    """Statistik connection pool urllib3 per host dari semua adapter sebuah requests.Session."""
+    hasil = {}
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hasil[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "koneksi_dibuat": pool.num_connections,
+                "request": pool.num_requests,
+                # Antrean pool berisi placeholder None untuk slot yang belum pernah dipakai
+                "koneksi_idle": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0,
+                "ukuran_pool": pool.pool.maxsize if pool.pool is not None else 0,
+            }
+    return hasil
+
+
+class StorageClients:
+    """Ekstensi Flask: client Azure Blob dan GCS bersama untuk satu proses worker."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._azure = None
+        self._azure_session = None
+        self._gcs = None
+        self._gcs_session = None
+        self.config = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.config = {
+            "pool_maxsize": app.config.get('STORAGE_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE),
+            "connect_timeout": app.config.get('STORAGE_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+            "read_timeout": app.config.get('STORAGE_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+            "retry_total": app.config.get('STORAGE_RETRY_TOTAL', DEFAULT_RETRY_TOTAL),
+            "retry_backoff": app.config.get('STORAGE_RETRY_BACKOFF', DEFAULT_RETRY_BACKOFF),
+        }
+        app.extensions['storage_clients'] = self
+
+    def _cfg(self, key, default):
+        return self.config.get(key, default)
+
+    @property
+    def timeout(self):
+        """Tuple (connect, read) untuk panggilan GCS."""
+        return (self._cfg("connect_timeout", DEFAULT_CONNECT_TIMEOUT), self._cfg("read_timeout", DEFAULT_READ_TIMEOUT))
+
+    def _session(self):
+        # Retry ditangani kebijakan retry SDK masing-masing, bukan urllib3
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self._cfg("pool_maxsize", DEFAULT_POOL_MAXSIZE),
+                              max_retries=Retry(total=False, redirect=False, raise_on_status=False))
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _reset_jika_fork(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._azure = self._azure_session = None
+            self._gcs = self._gcs_session = None
+
+    def azure(self):
+        """BlobServiceClient bersama; ValueError jika AZURE_STORAGE_CONNECTION_STRING tidak diatur."""
+        with self._lock:
+            self._reset_jika_fork()
+            if self._azure is None:
+                connect_str = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
+                if not connect_str:
+                    raise ValueError("AZURE_STORAGE_CONNECTION_STRING environment variable not set.")
+                session = self._session()
+                transport = RequestsTransport(session=session, session_owner=False,
+                                              connection_timeout=self._cfg("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+                                              read_timeout=self._cfg("read_timeout", DEFAULT_READ_TIMEOUT))
+                retry = ExponentialRetry(initial_backoff=self._cfg("retry_backoff", DEFAULT_RETRY_BACKOFF), increment_base=2,
+                                         retry_total=self._cfg("retry_total", DEFAULT_RETRY_TOTAL), random_jitter_range=1)
+                self._azure = BlobServiceClient.from_connection_string(connect_str, transport=transport, retry_policy=retry)
+                self._azure_session = session
+            return self._azure
+
+    def gcs(self):
+        """storage.Client bersama dengan sesi terotorisasi ber-pool; melempar exception jika kredensial tidak ada."""
+        with self._lock:
+            self._reset_jika_fork()
+            if self._gcs is None:
+                credentials, project = google.auth.default(scopes=["https://www.googleapis.com/auth/devstorage.read_write"])
+                session = AuthorizedSession(credentials)
+                adapter = self._session().get_adapter('https://')
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._gcs = storage.Client(project=project, credentials=credentials, _http=session)
+                self._gcs_session = session
+            return self._gcs
+
+    def gcs_retry(self):
+        """Kebijakan retry GCS (backoff eksponensial, dibatasi read timeout)."""
+        return DEFAULT_RETRY.with_delay(initial=self._cfg("retry_backoff", DEFAULT_RETRY_BACKOFF), multiplier=2)\
+            .with_timeout(self._cfg("read_timeout", DEFAULT_READ_TIMEOUT))
+
+    def snapshot(self):
+        """Statistik pool per client: koneksi yang dibuat vs request yang dilayani (reuse keep-alive)."""
+        with self._lock:
+            hasil = {"konfigurasi": dict(self.config)}
+            for nama, session in (("azure", self._azure_session), ("gcs", self._gcs_session)):
+                if session is not None and self._pid == os.getpid():
+                    hasil[nama] = _statistik_session(session)
+            return hasil
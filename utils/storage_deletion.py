@@ -0,0 +1,85 @@
+# utils/storage_deletion.py
+# Penghapusan file storage yang tertunda. Route tidak lagi menghapus file lama secara inline (satu round trip
+# per objek, kegagalan hanya dicatat di log lalu file menjadi yatim). Sebagai gantinya file dicatat di tabel
+# pending_deletions dalam transaksi yang sama dengan perubahan datanya (PendingDeletion.catat), lalu
+# `flask worker` menghapusnya per batch per backend (Azure Blob Batch API, batch request GCS), mencoba ulang
+# dengan backoff eksponensial, dan menandai GAGAL setelah MAKS_PERCOBAAN.
+# cari_file_yatim membandingkan daftar objek di storage dengan referensi di database untuk menemukan file
+# yang tidak lagi dirujuk (mis. dari kegagalan sebelum antrean ini ada), lihat `flask reconcile-storage`.
+
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from utils.storage_backend import storage, kunci_objek
+
+MAKS_PERCOBAAN = 8
+BACKOFF_DASAR_DETIK = 30 # Percobaan ke-n ditunda BACKOFF_DASAR_DETIK * 2^(n-1), maksimum BACKOFF_MAKS_DETIK
+BACKOFF_MAKS_DETIK = 6 * 60 * 60
+
+
+def proses_batch(batch_size=100):
+    """
+    Menghapus satu batch file dari antrean dalam satu transaksi, dikelompokkan per backend storage.
+    Baris yang berhasil dihapus dari antrean; yang gagal dijadwalkan ulang. Mengembalikan jumlah baris diproses.
+    """
+    from models import db, PendingDeletion, DeletionStatus
+
+    deletions = PendingDeletion.ambil_batch(batch_size)
+    per_backend = {}
+    for deletion in deletions:
+        per_backend.setdefault(storage(deletion.jenis), []).append(deletion)
+
+    for backend, daftar in per_backend.items():
+        mulai = time.perf_counter()
+        try:
+            gagal = backend.batch_delete([deletion.ref for deletion in daftar])
+        except Exception as e:
+            gagal = {deletion.ref: str(e) for deletion in daftar}
+        current_app.logger.info(f"Penghapusan storage ({backend.nama}): {len(daftar)} file dalam "
+                                f"{(time.perf_counter() - mulai) * 1000:.1f} ms, {len(gagal)} gagal")
+
+        for deletion in daftar:
+            if deletion.ref not in gagal:
+                db.session.delete(deletion)
+                continue
+            deletion.attempts += 1
+            deletion.last_error = gagal[deletion.ref]
+            if deletion.attempts >= MAKS_PERCOBAAN:
+                deletion.status = DeletionStatus.GAGAL
+            else:
+                tunda = min(BACKOFF_DASAR_DETIK * 2 ** (deletion.attempts - 1), BACKOFF_MAKS_DETIK)
+                deletion.available_at = datetime.utcnow() + timedelta(seconds=tunda)
+            current_app.logger.warning(f"Gagal menghapus {deletion.ref}, percobaan ke-{deletion.attempts}: {deletion.last_error}")
+    db.session.commit()
+    return len(deletions)
+
+
+def referensi_db():
+    """Key objek semua file yang masih dirujuk database, termasuk tiket unggah aktif dan antrean penghapusan."""
+    from models import db, Gerakan, Badge, PatientProfile, PendingMedia, PendingDeletion, MediaBlob
+
+    kolom = [Gerakan.blob_name_foto, Gerakan.blob_name_video, Gerakan.gcs_uri_model_tflite, Badge.filename_image,
+             PatientProfile.filename_foto_profil, PendingMedia.blob_name, PendingDeletion.ref, MediaBlob.ref]
+    referensi = set()
+    for col in kolom:
+        referensi.update(kunci_objek(ref) for (ref,) in db.session.query(col).filter(col.isnot(None)))
+    return referensi
+
+
+def cari_file_yatim(prefixes, umur_minimal):
+    """
+    Daftar (ref, jenis) objek storage di bawah `prefixes` (iterable (jenis, prefix)) yang tidak dirujuk
+    database dan lebih tua dari `umur_minimal` (timedelta), agar unggahan yang belum di-commit tidak ikut terhapus.
+    """
+    referensi = referensi_db()
+    batas = datetime.now(timezone.utc) - umur_minimal
+    yatim, dilihat = [], set()
+    for jenis, prefix in prefixes:
+        backend = storage(jenis)
+        for ref, waktu_ubah in backend.list(prefix):
+            key = kunci_objek(ref)
+            if key in referensi or key in dilihat or (waktu_ubah and waktu_ubah > batas):
+                continue
+            dilihat.add(key)
+            yatim.append((ref, jenis))
+    return yatim
@@ -0,0 +1,111 @@
+# utils/streaming_upload.py
+# Unggah media secara streaming per chunk, menggantikan file_storage.read() yang memuat seluruh file
+# (video bisa ratusan MB) ke memori worker.
+# - Azure: setiap chunk dikirim dengan stage_block lalu dirangkai dengan commit_block_list.
+# - GCS  : resumable upload dengan chunk_size (kelipatan 256 KiB), library membaca satu chunk per request.
+# Ukuran chunk diatur MEDIA_UPLOAD_CHUNK_BYTES. MEDIA_UPLOAD_MAX_BUFFER_BYTES adalah batas memori buffer
+# unggahan per proses worker: setiap chunk yang sedang dipegang mengambil jatah dari anggaran ini, dan
+# unggahan lain menunggu jika anggaran habis (mis. banyak unggahan paralel di pool media).
+
+import base64
+import threading
+from contextlib import contextmanager
+from flask import current_app
+from azure.storage.blob import BlobBlock
+
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+DEFAULT_MAKS_BUFFER_BYTES = 32 * 1024 * 1024
+GCS_KELIPATAN_CHUNK = 256 * 1024 # Syarat chunk_size resumable upload GCS
+
+
+class AnggaranBuffer:
+    """Batas total byte buffer chunk yang boleh dipegang bersamaan dalam satu proses."""
+
+    def __init__(self, kapasitas):
+        self.kapasitas = kapasitas
+        self._kondisi = threading.Condition()
+        self._terpakai = 0
+        self._puncak = 0
+
+    @contextmanager
+    def pakai(self, jumlah):
+        jumlah = min(jumlah, self.kapasitas)
+        with self._kondisi:
+            self._kondisi.wait_for(lambda: self._terpakai + jumlah <= self.kapasitas)
+            self._terpakai += jumlah
+            self._puncak = max(self._puncak, self._terpakai)
+        try:
+            yield
+        finally:
+            with self._kondisi:
+                self._terpakai -= jumlah
+                self._kondisi.notify_all()
+
+    def snapshot(self):
+        with self._kondisi:
+            return {"kapasitas": self.kapasitas, "terpakai": self._terpakai, "puncak": self._puncak}
+
+
+_anggaran = None
+_anggaran_lock = threading.Lock()
+
+
+def anggaran_buffer():
+    global _anggaran
+    with _anggaran_lock:
+        if _anggaran is None:
+            _anggaran = AnggaranBuffer(current_app.config.get('MEDIA_UPLOAD_MAX_BUFFER_BYTES', DEFAULT_MAKS_BUFFER_BYTES))
+        return _anggaran
+
+
+def ukuran_chunk():
+    """Ukuran chunk dari konfigurasi, tidak melebihi batas memori buffer."""
+    chunk = current_app.config.get('MEDIA_UPLOAD_CHUNK_BYTES', DEFAULT_CHUNK_BYTES)
+    return max(1, min(chunk, current_app.config.get('MEDIA_UPLOAD_MAX_BUFFER_BYTES', DEFAULT_MAKS_BUFFER_BYTES)))
+
+
+def ukuran_chunk_gcs(chunk_size=None):
+    """Ukuran chunk dibulatkan ke bawah ke kelipatan 256 KiB (minimal 256 KiB)."""
+    chunk_size = chunk_size or ukuran_chunk()
+    return max(GCS_KELIPATAN_CHUNK, chunk_size - chunk_size % GCS_KELIPATAN_CHUNK)
+
+
+def _block_id(index):
+    # Semua block id dalam satu blob harus sama panjang
+    return base64.b64encode(f"{index:08d}".encode()).decode()
+
+
+def stage_blok_azure(blob_client, stream, content_settings=None, chunk_size=None):
+    """
+    Mengunggah stream ke blob_client per chunk (stage_block) lalu commit_block_list.
+    Hanya satu chunk per unggahan yang berada di memori. Mengembalikan jumlah byte yang diunggah.
+    """
+    chunk_size = chunk_size or ukuran_chunk()
+    anggaran = anggaran_buffer()
+    blok, total = [], 0
+    stream.seek(0)
+    while True:
+        with anggaran.pakai(chunk_size):
+            data = stream.read(chunk_size)
+            if not data:
+                break
+            block_id = _block_id(len(blok))
+            blob_client.stage_block(block_id, data, length=len(data))
+            total += len(data)
+            data = None # Lepas chunk sebelum membaca chunk berikutnya
+        blok.append(BlobBlock(block_id=block_id))
+    blob_client.commit_block_list(blok, content_settings=content_settings)
+    return total
+
+
+def unggah_resumable_gcs(bucket, blob_name, stream, content_type=None, chunk_size=None, **opsi):
+    """
+    Resumable upload GCS dari stream; library membaca dan mengirim satu chunk per request.
+    `opsi` diteruskan ke blob.upload_from_file (mis. timeout, retry).
+    """
+    chunk_size = ukuran_chunk_gcs(chunk_size)
+    blob = bucket.blob(blob_name, chunk_size=chunk_size)
+    stream.seek(0)
+    with anggaran_buffer().pakai(chunk_size):
+        blob.upload_from_file(stream, content_type=content_type, **opsi)
+    return blob
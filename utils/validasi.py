@@ -0,0 +1,15 @@
+# utils/validasi.py
+# Validasi nilai input JSON yang dipakai bersama oleh beberapa route.
+
+
+def id_int(nilai, nama):
+    """
+    ID dari JSON sebagai int; string angka ("12") tetap diterima seperti sebelumnya (database dulu yang
+    mengonversinya). Boolean dan nilai bukan angka ditolak dengan ValueError.
+    """
+    if isinstance(nilai, bool):
+        raise ValueError(f"{nama} harus berupa bilangan bulat")
+    try:
+        return int(nilai)
+    except (TypeError, ValueError):
+        raise ValueError(f"{nama} harus berupa bilangan bulat")